@@ -0,0 +1,111 @@
+"""
+Admin analytics page with population-level allergen prevalence
+"""
+import streamlit as st
+import pandas as pd
+import db
+from db import db_manager
+
+# Tab labels mapped to get_allergen_prevalence groupings
+PREVALENCE_VIEWS = {
+    "By Allergen": 'allergen',
+    "By Practitioner": 'practitioner',
+    "By Month": 'month'
+}
+
+def _prevalence_frame(rows, group_by):
+    """Format prevalence rows for display"""
+    df = pd.DataFrame(rows, columns=[group_by, 'tested', 'high', 'moderate', 'high_rate', 'moderate_rate', 'average_igg'])
+    if group_by == 'practitioner':
+        df['practitioner'] = df['practitioner'].replace('', 'Not specified')
+    df['high_rate'] = (df['high_rate'] * 100).round(1)
+    df['moderate_rate'] = (df['moderate_rate'] * 100).round(1)
+    df['average_igg'] = df['average_igg'].round(2)
+    return df.rename(columns={
+        group_by: group_by.capitalize(),
+        'tested': "Results",
+        'high': "High",
+        'moderate': "Moderate",
+        'high_rate': "High %",
+        'moderate_rate': "Moderate %",
+        'average_igg': "Avg IgG (µg/ml)"
+    })
+
+def render_analytics_page():
+    """
+    Render the allergen analytics dashboard
+    
+    Everything is read from the pre-aggregated summary tables, so the page
+    loads in the same time regardless of the archive size.
+    """
+    st.subheader("Allergen Analytics")
+    st.markdown("Population-level prevalence of High and Moderate results across all generated reports.")
+    
+    report_counts = db_manager.get_report_counts('practitioner')
+    total_reports = sum(row['reports'] for row in report_counts)
+    
+    if not total_reports:
+        st.info("No reports found. Generate reports in the Reporting tab to see analytics here.")
+        return
+    
+    # Filters
+    practitioners = [row['practitioner'] for row in report_counts]
+    allergens = [row['allergen'] for row in db_manager.get_allergen_prevalence('allergen')]
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        practitioner_label = st.selectbox(
+            "Practitioner",
+            ["All practitioners"] + [practitioner or "Not specified" for practitioner in practitioners]
+        )
+    with col2:
+        allergen = st.selectbox("Allergen", ["All allergens"] + allergens)
+    
+    practitioner = None
+    if practitioner_label != "All practitioners":
+        practitioner = practitioners[[p or "Not specified" for p in practitioners].index(practitioner_label)]
+    allergen = None if allergen == "All allergens" else allergen
+    
+    # Summary metrics for the current filter
+    overall = db_manager.get_allergen_prevalence('practitioner', allergen=allergen, practitioner=practitioner)
+    tested = sum(row['tested'] for row in overall)
+    high = sum(row['high'] for row in overall)
+    moderate = sum(row['moderate'] for row in overall)
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        reports = total_reports if practitioner is None else next(
+            (row['reports'] for row in report_counts if row['practitioner'] == practitioner), 0
+        )
+        st.metric("Reports", reports)
+    with col2:
+        st.metric("Allergen Results", tested)
+    with col3:
+        st.metric("High", f"{high / tested * 100:.1f}%" if tested else "–")
+    with col4:
+        st.metric("Moderate", f"{moderate / tested * 100:.1f}%" if tested else "–")
+    
+    st.markdown("---")
+    
+    tabs = st.tabs(list(PREVALENCE_VIEWS))
+    for tab, (label, group_by) in zip(tabs, PREVALENCE_VIEWS.items()):
+        with tab:
+            rows = db_manager.get_allergen_prevalence(group_by, allergen=allergen, practitioner=practitioner)
+            if not rows:
+                st.info("No allergen results for this selection.")
+                continue
+            
+            df = _prevalence_frame(rows, group_by)
+            if group_by == 'allergen':
+                df = df.sort_values(["High %", "Moderate %"], ascending=False)
+            elif group_by == 'month':
+                st.line_chart(df.set_index("Month")[["High %", "Moderate %"]])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+    
+    st.markdown("---")
+    
+    # Summaries are kept up to date on every save; a rebuild is only needed after backfills or manual edits
+    if st.button("🔄 Rebuild Analytics Summaries"):
+        with st.spinner("Rebuilding summaries from allergen results..."):
+            db.rebuild_report_summaries(db_manager.engine)
+        st.rerun()
@@ -2,10 +2,20 @@
 Complete Pinnertest Portal - Admin report generation + Client access
 """
 import streamlit as st
-from db import DatabaseManager
-import json
+from db import db_manager, check_db_connection, describe_error
+from session_store import artifact_store
+from login_throttle import login_throttle, get_client_address
+from client_report_cache import get_cached_client_report, invalidate_client_report
+from csv_ingestion import build_admin_records, classify_igg
+from payload_codec import payload_to_frame
+from analytics_page import render_analytics_page
+from report_jobs import submit_job, get_job_items, start_embedded_worker
+from job_progress import render_job_progress, render_recent_jobs
 import pandas as pd
 
+# Reports per page of the admin archive
+ADMIN_ARCHIVE_PAGE_SIZE = 50
+
 # Initialize session state
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
@@ -13,6 +23,48 @@ if 'authenticated' not in st.session_state:
 def check_credentials(username, password):
     """
     Check if the provided username and password are valid
+    
+    Attempts are throttled per client address and globally, and failed
+    attempts lock out the username and address pair, before any credential
+    check; a throttled attempt returns False and sets
+    st.session_state.login_retry_after. If the throttle state cannot be
+    read or a failure cannot be recorded, logins fail closed and
+    st.session_state.login_unavailable is set.
+    """
+    # Forget any report from a previous login in this session
+    st.session_state.pop('report_id', None)
+    st.session_state.pop('login_retry_after', None)
+    st.session_state.pop('login_unavailable', None)
+    invalidate_client_report(st.session_state)
+    
+    client_address = get_client_address()
+    try:
+        allowed, retry_after = login_throttle.check(username, client_address)
+    except Exception as e:
+        print(f"Login throttle check failed: {describe_error(e)}")
+        st.session_state.login_unavailable = True
+        return False
+    if not allowed:
+        st.session_state.login_retry_after = retry_after
+        return False
+    
+    auth_result = verify_credentials(username, password)
+    try:
+        if auth_result:
+            login_throttle.record_success(username, client_address)
+        else:
+            login_throttle.record_failure(username, client_address)
+    except Exception as e:
+        print(f"Recording login attempt failed: {describe_error(e)}")
+        # A failure that was not counted must not be retried freely; a missed
+        # reset only leaves an old failure count behind
+        if not auth_result:
+            st.session_state.login_unavailable = True
+    return auth_result
+
+def verify_credentials(username, password):
+    """
+    Check a username and password against the built-in accounts and the client database
     """
     # Admin access for full system management
     if username == "admin" and password == "admin":
@@ -35,18 +87,28 @@ def check_credentials(username, password):
     
     # Check real client database
     try:
-        db_manager = DatabaseManager()
-        db_manager.connect()
-        
-        if db_manager.connected:
-            client_report = db_manager.get_client_report(username, password)
-            if client_report:
-                return "client"
+        if check_db_connection():
+            auth = db_manager.authenticate(username, password)
+            if auth:
+                st.session_state.report_id = auth['report_id']
+                return auth['role']
     except Exception as e:
         print(f"Database authentication error: {e}")
     
     return False
 
+def clear_session_artifacts():
+    """
+    Drop the large per-session artifacts (processed report data) on logout
+    """
+    if 'artifact_session_id' in st.session_state:
+        artifact_store.clear_session(st.session_state.artifact_session_id)
+    st.session_state.pop('processed_reports', None)
+    st.session_state.pop('generated_pdfs', None)
+    st.session_state.pop('report_job_id', None)
+    st.session_state.pop('admin_report_job_id', None)
+    invalidate_client_report(st.session_state)
+
 def login_page():
     """
     Render the login page
@@ -70,11 +132,15 @@ def login_page():
                 if auth_result:
                     st.session_state.authenticated = True
                     st.session_state.username = username
-                    st.session_state.password = password
                     st.session_state.user_role = auth_result
                     if 'current_page' not in st.session_state:
                         st.session_state.current_page = "reports"
                     st.rerun()
+                elif st.session_state.get('login_unavailable'):
+                    st.error("Login is temporarily unavailable. Please try again later.")
+                elif st.session_state.get('login_retry_after'):
+                    minutes = max(1, int(-(-st.session_state.login_retry_after // 60)))
+                    st.error(f"Too many login attempts. Please try again in {minutes} minute(s).")
                 else:
                     st.error("Invalid username or password")
             else:
@@ -86,7 +152,7 @@ def render_navigation():
     """
     if st.session_state.user_role == "admin":
         # Admin has access to all features
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4, col5 = st.columns(5)
         
         with col1:
             if st.button("📊 Generate Reports", use_container_width=True):
@@ -99,12 +165,18 @@ def render_navigation():
                 st.rerun()
                 
         with col3:
+            if st.button("📈 Analytics", use_container_width=True):
+                st.session_state.current_page = "analytics"
+                st.rerun()
+        
+        with col4:
             if st.button("👥 Client Management", use_container_width=True):
                 st.session_state.current_page = "clients"
                 st.rerun()
         
-        with col4:
+        with col5:
             if st.button("🚪 Logout", use_container_width=True):
+                clear_session_artifacts()
                 st.session_state.authenticated = False
                 st.session_state.current_page = "reports"
                 st.rerun()
@@ -120,6 +192,7 @@ def render_navigation():
             
         with col3:
             if st.button("🚪 Logout", use_container_width=True):
+                clear_session_artifacts()
                 st.session_state.authenticated = False
                 st.session_state.current_page = "reports"
                 st.rerun()
@@ -148,90 +221,96 @@ def render_admin_reports_page():
             with st.expander("📋 Data Preview", expanded=True):
                 st.dataframe(df.head())
             
-            # Process and generate reports
+            # Queue report generation; a background worker saves the reports
             if st.button("🔄 Process Data & Generate Reports", type="primary", use_container_width=True):
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                generated_reports = []
-                
-                for idx, row in df.iterrows():
-                    progress = (idx + 1) / len(df)
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing client {idx + 1} of {len(df)}...")
-                    
-                    # Extract client info
-                    client_info = {
-                        'patient_name': row.get('Name', ''),
-                        'patient_id': f"P{idx + 1:04d}",
-                        'dob': row.get('Date of Birth', ''),
-                        'gender': row.get('Gender', ''),
-                        'collection_date': row.get('Collection Date', '2025-05-28'),
-                        'practitioner': row.get('Practitioner', 'Dr. Smith'),
-                        'specimen_type': 'Serum',
-                        'email': row.get('Email', '')
+                if db_manager.is_connected():
+                    # Convert every client row at once
+                    records = build_admin_records(df)
+                    st.session_state.admin_report_job_id = submit_job(db_manager.engine, 'admin_reports', [
+                        (record['client_info']['patient_id'], record['client_info'], record['allergen_data'])
+                        for record in records
+                    ])
+                    st.session_state.admin_report_allergens = {
+                        record['client_info']['patient_id']: len(record['allergen_data']) for record in records
                     }
-                    
-                    # Create allergen data from CSV columns
-                    allergen_data = []
-                    for col in df.columns:
-                        if col not in ['Name', 'Date of Birth', 'Gender', 'Email', 'Collection Date', 'Practitioner']:
-                            try:
-                                value = float(row[col]) if pd.notna(row[col]) else 0.0
-                                if value >= 2.5:
-                                    classification = "High"
-                                elif value >= 1.5:
-                                    classification = "Moderate"
-                                else:
-                                    classification = "Low"
-                                
-                                allergen_data.append({
-                                    'Allergen': col,
-                                    'IgG_Level': value,
-                                    'Classification': classification
-                                })
-                            except:
-                                continue
-                    
-                    # Generate PDF placeholder
-                    pdf_content = f"Report for {client_info['patient_name']} - {len(allergen_data)} allergens tested".encode()
-                    
-                    # Save to database
-                    try:
-                        db_manager = DatabaseManager()
-                        if db_manager.is_connected():
-                            result = db_manager.save_client_report(
-                                client_info, 
-                                pdf_content, 
-                                pd.DataFrame(allergen_data)
-                            )
-                            generated_reports.append({
-                                'name': client_info['patient_name'],
-                                'username': result['username'],
-                                'password': result['password'],
-                                'allergens': len(allergen_data)
-                            })
-                    except Exception as e:
-                        st.error(f"Error saving report for {client_info['patient_name']}: {e}")
-                
-                progress_bar.progress(1.0)
-                status_text.text("✅ Processing complete!")
-                
-                # Display generated reports
-                if generated_reports:
-                    st.success(f"🎉 Successfully generated {len(generated_reports)} client reports!")
-                    
-                    st.subheader("📋 Generated Client Credentials")
-                    for report in generated_reports:
-                        with st.expander(f"👤 {report['name']} - {report['allergens']} allergens"):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.write(f"**Username:** `{report['username']}`")
-                            with col2:
-                                st.write(f"**Password:** `{report['password']}`")
+                else:
+                    st.error("Database connection unavailable")
                 
         except Exception as e:
             st.error(f"Error processing file: {e}")
+    
+    # Progress and results of the background job, which keeps running when the tab is closed
+    job_id = st.session_state.get('admin_report_job_id')
+    if job_id and db_manager.is_connected():
+        job = render_job_progress(job_id)
+        if job and job['status'] == 'completed':
+            items = get_job_items(db_manager.engine, job_id)
+            allergen_counts = st.session_state.get('admin_report_allergens', {})
+            
+            for item in items:
+                if item['status'] == 'failed':
+                    st.error(f"Error saving report for {item['client_info'].get('patient_name', '')}: {item['error']}")
+            
+            # Display generated reports
+            generated_reports = [item for item in items if item['credentials']]
+            if generated_reports:
+                st.success(f"🎉 Successfully generated {len(generated_reports)} client reports!")
+                
+                st.subheader("📋 Generated Client Credentials")
+                for item in generated_reports:
+                    report = item['credentials']
+                    allergens = allergen_counts.get(item['item_key'])
+                    label = f"👤 {report['patient_name']}" + (f" - {allergens} allergens" if allergens is not None else "")
+                    with st.expander(label):
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.write(f"**Username:** `{report['username']}`")
+                        with col2:
+                            st.write(f"**Password:** `{report['password']}`")
+    
+    if db_manager.is_connected():
+        render_recent_jobs('admin_reports', 'admin_report_job_id')
+
+# Text colour of each classification in the client results table
+CLASSIFICATION_COLORS = {
+    'High': '#FF4B4B',
+    'Moderate': '#FFA500',
+    'Low': '#00C851'
+}
+
+# Client results sort options: (columns, ascending per column)
+RESULT_SORTS = {
+    "Highest IgG first": (['IgG (µg/ml)', 'Allergen'], [False, True]),
+    "Allergen (A-Z)": (['Allergen'], [True]),
+    "Category": (['Category', 'IgG (µg/ml)'], [True, False])
+}
+
+def prepare_client_results(df):
+    """
+    Normalize a report's allergen data for the client results table
+    
+    Admin reports carry IgG_Level and Classification, lab exports carry
+    Category and IgG (µg/ml); missing classifications are derived from the
+    IgG level with the standard thresholds.
+    """
+    results = pd.DataFrame({'Allergen': df['Allergen'].fillna('').astype(str) if 'Allergen' in df else ''}, index=df.index)
+    if 'Category' in df:
+        results['Category'] = df['Category'].fillna('').astype(str)
+    
+    igg_column = next((column for column in ('IgG_Level', 'IgG (µg/ml)') if column in df), None)
+    igg = pd.to_numeric(df[igg_column], errors='coerce').fillna(0.0) if igg_column else pd.Series(0.0, index=df.index)
+    results['IgG (µg/ml)'] = igg
+    
+    if 'Classification' in df:
+        results['Classification'] = df['Classification'].fillna('Low').astype(str)
+    else:
+        results['Classification'] = classify_igg(igg.to_numpy())
+    return results.reset_index(drop=True)
+
+def classification_styles(classifications):
+    """CSS for a column of classifications"""
+    colors = classifications.map(CLASSIFICATION_COLORS).fillna(CLASSIFICATION_COLORS['Low'])
+    return ('color: ' + colors + '; font-weight: bold').tolist()
 
 def render_client_report():
     """
@@ -240,10 +319,11 @@ def render_client_report():
     try:
         client_report = None
         
-        # Try to get data from database first
-        db_manager = DatabaseManager()
-        if db_manager.is_connected():
-            client_report = db_manager.get_client_report(st.session_state.username, st.session_state.get('password', ''))
+        # Try to get data from database first (report id is set by a successful login);
+        # it is loaded once per session and reused across reruns
+        report_id = st.session_state.get('report_id')
+        if report_id and db_manager.is_connected():
+            client_report = get_cached_client_report(st.session_state, db_manager, report_id)
         
         # If no database data, use demo data for demo account
         if not client_report and hasattr(st.session_state, 'demo_client_data'):
@@ -267,28 +347,57 @@ def render_client_report():
             # Display allergen results
             st.markdown("### 🧪 Your Allergen Test Results")
             
-            # Parse allergen data from JSON
-            allergen_data = json.loads(client_report['allergen_data'])
-            df = pd.DataFrame(allergen_data)
+            # Database reports are already decoded; the demo report holds JSON text
+            results = prepare_client_results(payload_to_frame(client_report['allergen_data']))
             
-            # Create colored display based on classification
-            for idx, row in df.iterrows():
-                col1, col2, col3 = st.columns([3, 2, 2])
-                
-                with col1:
-                    st.write(f"**{row['Allergen']}**")
-                
-                with col2:
-                    # Color-coded classification
-                    if row['Classification'] == 'High':
-                        st.markdown(f"<span style='color: #FF4B4B; font-weight: bold;'>{row['Classification']}</span>", unsafe_allow_html=True)
-                    elif row['Classification'] == 'Moderate':
-                        st.markdown(f"<span style='color: #FFA500; font-weight: bold;'>{row['Classification']}</span>", unsafe_allow_html=True)
-                    else:
-                        st.markdown(f"<span style='color: #00C851; font-weight: bold;'>{row['Classification']}</span>", unsafe_allow_html=True)
-                
-                with col3:
-                    st.write(f"IgG: {row['IgG_Level']}")
+            # Summary counts per level
+            level_counts = results['Classification'].value_counts()
+            col1, col2, col3 = st.columns(3)
+            for column, level in zip((col1, col2, col3), CLASSIFICATION_COLORS):
+                with column:
+                    st.metric(level, int(level_counts.get(level, 0)))
+            
+            # Filter and sort controls
+            filter_columns = st.columns(3 if 'Category' in results else 2)
+            with filter_columns[0]:
+                level_options = list(CLASSIFICATION_COLORS) + sorted(set(results['Classification']) - set(CLASSIFICATION_COLORS))
+                levels = st.multiselect("Level", level_options, default=level_options)
+            with filter_columns[1]:
+                sort_option = st.selectbox("Sort by", list(RESULT_SORTS))
+            categories = None
+            if 'Category' in results:
+                with filter_columns[2]:
+                    categories = st.multiselect("Category", sorted(results['Category'].unique()))
+            
+            mask = results['Classification'].isin(levels)
+            if categories:
+                mask &= results['Category'].isin(categories)
+            sort_keys = [(column, ascending) for column, ascending in zip(*RESULT_SORTS[sort_option]) if column in results]
+            visible = results[mask].sort_values(
+                [column for column, _ in sort_keys],
+                ascending=[ascending for _, ascending in sort_keys],
+                kind='stable'
+            )
+            
+            # One table for the whole panel, coloured by classification
+            st.dataframe(
+                visible.style.apply(classification_styles, subset=['Classification']).format({'IgG (µg/ml)': '{:g}'}),
+                use_container_width=True,
+                hide_index=True
+            )
+            
+            # The PDF is only loaded from the database when the client asks for it
+            if report_id and st.button("📄 Prepare PDF Download"):
+                pdf_data = db_manager.get_report_pdf(report_id, active_only=True)
+                if pdf_data:
+                    st.download_button(
+                        label="⬇️ Download PDF Report",
+                        data=pdf_data,
+                        file_name=f"{client_report['patient_id']}_{client_report['patient_name']}.pdf",
+                        mime="application/pdf"
+                    )
+                else:
+                    st.error("Your PDF report is not available. Please contact support.")
             
             st.markdown("---")
             st.markdown("*For questions about your results, please contact your healthcare practitioner.*")
@@ -304,12 +413,20 @@ def render_archive_page():
     st.subheader("📁 Report Archive")
     
     try:
-        db_manager = DatabaseManager()
         if db_manager.is_connected():
-            reports = db_manager.get_all_client_reports()
+            total = db_manager.get_archive_stats()['total']
             
-            if reports:
-                st.info(f"Found {len(reports)} client reports in the database")
+            if total:
+                st.info(f"Found {total} client reports in the database")
+                
+                # One keyset-paginated page at a time, newest first
+                if 'admin_archive_cursors' not in st.session_state:
+                    st.session_state.admin_archive_cursors = [None]
+                page = db_manager.query_client_reports(
+                    after_cursor=st.session_state.admin_archive_cursors[-1],
+                    limit=ADMIN_ARCHIVE_PAGE_SIZE
+                )
+                reports = page['reports']
                 
                 for report in reports:
                     with st.expander(f"👤 {report['patient_name']} - {report['report_date']}"):
@@ -323,6 +440,19 @@ def render_archive_page():
                         with col3:
                             st.write(f"**Practitioner:** {report['practitioner']}")
                             st.write(f"**Active:** {'Yes' if report['is_active'] else 'No'}")
+                
+                page_number = len(st.session_state.admin_archive_cursors)
+                nav_col1, nav_col2, nav_col3 = st.columns([1, 3, 1])
+                with nav_col1:
+                    if page_number > 1 and st.button("◀ Previous", key="admin_archive_previous"):
+                        st.session_state.admin_archive_cursors.pop()
+                        st.rerun()
+                with nav_col2:
+                    st.caption(f"Page {page_number}")
+                with nav_col3:
+                    if page['next_cursor'] and st.button("Next ▶", key="admin_archive_next"):
+                        st.session_state.admin_archive_cursors.append(page['next_cursor'])
+                        st.rerun()
             else:
                 st.info("No reports found in the archive")
         else:
@@ -341,6 +471,9 @@ def main():
         initial_sidebar_state="collapsed"
     )
     
+    # Resume queued report jobs as soon as the server runs, not only once a progress view opens
+    start_embedded_worker(db_manager)
+    
     # Custom CSS for clean white theme
     st.markdown("""
     <style>
@@ -387,6 +520,9 @@ def main():
     elif st.session_state.current_page == "archive":
         render_archive_page()
     
+    elif st.session_state.current_page == "analytics":
+        render_analytics_page()
+    
     elif st.session_state.current_page == "clients":
         st.subheader("👥 Client Management")
         st.info("Client management features coming soon...")
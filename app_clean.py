@@ -7,7 +7,11 @@ from datetime import datetime
 
 # Database functionality
 import db
-from db import DatabaseManager
+from db import db_manager, check_db_connection, describe_error
+from session_store import artifact_store
+from login_throttle import login_throttle, get_client_address
+from client_report_cache import invalidate_client_report
+from report_jobs import start_embedded_worker
 
 # Initialize session state for navigation
 if 'current_page' not in st.session_state:
@@ -19,6 +23,48 @@ if 'authenticated' not in st.session_state:
 def check_credentials(username, password):
     """
     Check if the provided username and password are valid
+    
+    Attempts are throttled per client address and globally, and failed
+    attempts lock out the username and address pair, before any credential
+    check; a throttled attempt returns False and sets
+    st.session_state.login_retry_after. If the throttle state cannot be
+    read or a failure cannot be recorded, logins fail closed and
+    st.session_state.login_unavailable is set.
+    """
+    # Forget any report from a previous login in this session
+    st.session_state.pop('report_id', None)
+    st.session_state.pop('login_retry_after', None)
+    st.session_state.pop('login_unavailable', None)
+    invalidate_client_report(st.session_state)
+    
+    client_address = get_client_address()
+    try:
+        allowed, retry_after = login_throttle.check(username, client_address)
+    except Exception as e:
+        print(f"Login throttle check failed: {describe_error(e)}")
+        st.session_state.login_unavailable = True
+        return False
+    if not allowed:
+        st.session_state.login_retry_after = retry_after
+        return False
+    
+    auth_result = verify_credentials(username, password)
+    try:
+        if auth_result:
+            login_throttle.record_success(username, client_address)
+        else:
+            login_throttle.record_failure(username, client_address)
+    except Exception as e:
+        print(f"Recording login attempt failed: {describe_error(e)}")
+        # A failure that was not counted must not be retried freely; a missed
+        # reset only leaves an old failure count behind
+        if not auth_result:
+            st.session_state.login_unavailable = True
+    return auth_result
+
+def verify_credentials(username, password):
+    """
+    Check a username and password against the built-in accounts and the client database
     """
     # Admin access only for super secure analysis features
     if username == "admin" and password == "admin":
@@ -30,18 +76,28 @@ def check_credentials(username, password):
     
     # Check against client database for real client credentials
     try:
-        db_manager = DatabaseManager()
-        db_manager.connect()
-        
-        if db_manager.connected:
-            client_report = db_manager.get_client_report(username, password)
-            if client_report:
-                return "client"
+        if check_db_connection():
+            auth = db_manager.authenticate(username, password)
+            if auth:
+                st.session_state.report_id = auth['report_id']
+                return auth['role']
     except Exception as e:
         print(f"Database authentication error: {e}")
     
     return False
 
+def clear_session_artifacts():
+    """
+    Drop the large per-session artifacts (processed report data) on logout
+    """
+    if 'artifact_session_id' in st.session_state:
+        artifact_store.clear_session(st.session_state.artifact_session_id)
+    st.session_state.pop('processed_reports', None)
+    st.session_state.pop('generated_pdfs', None)
+    st.session_state.pop('report_job_id', None)
+    st.session_state.pop('admin_report_job_id', None)
+    invalidate_client_report(st.session_state)
+
 def login_page():
     """
     Render the login page
@@ -67,6 +123,11 @@ def login_page():
                 st.session_state.username = username
                 st.session_state.user_role = auth_result  # Store role (admin/client)
                 st.rerun()
+            elif st.session_state.get('login_unavailable'):
+                st.error("Login is temporarily unavailable. Please try again later.")
+            elif st.session_state.get('login_retry_after'):
+                minutes = max(1, int(-(-st.session_state.login_retry_after // 60)))
+                st.error(f"Too many login attempts. Please try again in {minutes} minute(s).")
             else:
                 st.error("Invalid username or password. Please try again.")
         
@@ -89,7 +150,7 @@ def render_navigation():
     
     if user_role == "admin":
         # Admin gets access to all features
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4, col5 = st.columns(5)
         
         with col1:
             if st.button("📊 Reports", use_container_width=True):
@@ -102,12 +163,18 @@ def render_navigation():
                 st.rerun()
                 
         with col3:
+            if st.button("📈 Analytics", use_container_width=True):
+                st.session_state.current_page = "analytics"
+                st.rerun()
+        
+        with col4:
             if st.button("🎨 Portal Design", use_container_width=True):
                 st.session_state.current_page = "portal"
                 st.rerun()
         
-        with col4:
+        with col5:
             if st.button("🚪 Logout", use_container_width=True):
+                clear_session_artifacts()
                 st.session_state.authenticated = False
                 st.session_state.current_page = "reports"
                 st.rerun()
@@ -123,6 +190,7 @@ def render_navigation():
             
         with col3:
             if st.button("🚪 Logout", use_container_width=True):
+                clear_session_artifacts()
                 st.session_state.authenticated = False
                 st.session_state.current_page = "reports"
                 st.rerun()
@@ -138,6 +206,9 @@ def main():
         initial_sidebar_state="collapsed"
     )
     
+    # Resume queued report jobs as soon as the server runs, not only once a progress view opens
+    start_embedded_worker(db_manager)
+    
     # Custom CSS for clean white theme
     st.markdown("""
     <style>
@@ -198,6 +269,14 @@ def main():
         except ImportError:
             st.error("Archive functionality not available in this deployment.")
 
+    elif st.session_state.current_page == "analytics":
+        try:
+            # Import and render the allergen analytics page
+            from analytics_page import render_analytics_page
+            render_analytics_page()
+        except ImportError:
+            st.error("Analytics functionality not available in this deployment.")
+
     elif st.session_state.current_page == "portal":
         try:
             # Import and render the client portal design page
@@ -0,0 +1,86 @@
+"""
+Command line entry point: python -m benchmarks --help
+"""
+import argparse
+import os
+
+from benchmarks.db_benchmarks import OPERATION_ITERATIONS, PostgresBackend, SqliteBackend, run_benchmark
+from benchmarks.harness import compare_results, environment_info, load_results, peak_rss_bytes, write_results
+from benchmarks.synthetic import SyntheticData
+
+# Tried when no --postgres-url is given; runs without PostgreSQL are skipped, not failed
+DEFAULT_POSTGRES_URL = os.environ.get('BENCHMARK_POSTGRES_URL', 'postgresql://postgres@localhost:5432/postgres')
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DatabaseManager hot paths on synthetic data")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help="Seeded report counts, e.g. 1000 100000 1000000")
+    parser.add_argument('--backend', choices=['sqlite', 'postgresql', 'all'], default='all',
+                        help="Databases to run against (PostgreSQL is skipped when unavailable)")
+    parser.add_argument('--postgres-url', default=DEFAULT_POSTGRES_URL, help="PostgreSQL database; each run uses a temporary schema")
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATION_ITERATIONS), help="Operations to run (default all)")
+    parser.add_argument('--iterations', type=int, help="Timed calls per operation (default per operation)")
+    parser.add_argument('--panel-size', type=int, default=40, help="Allergens per report")
+    parser.add_argument('--pdf-size', type=int, default=16 * 1024, help="Bytes per fake PDF")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed of the synthetic data")
+    parser.add_argument('--workdir', help="Directory for the SQLite files (default a temporary directory)")
+    parser.add_argument('--keep', action='store_true', help="Keep the seeded databases")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write")
+    parser.add_argument('--compare', help="Earlier result file to compare p50/p95 latencies with")
+    args = parser.parse_args()
+    
+    backends = []
+    if args.backend in ('sqlite', 'all'):
+        backends.append(SqliteBackend(args.workdir, args.keep))
+    
+    skipped = {}
+    if args.backend in ('postgresql', 'all'):
+        reason = PostgresBackend.available(args.postgres_url)
+        if reason is None:
+            backends.append(PostgresBackend(args.postgres_url, args.keep))
+        else:
+            print(f"Skipping PostgreSQL: {reason}")
+            skipped['postgresql'] = reason
+    
+    results = {
+        'environment': environment_info(),
+        'config': {
+            'rows': args.rows,
+            'panel_size': args.panel_size,
+            'pdf_size': args.pdf_size,
+            'seed': args.seed,
+            'iterations': args.iterations or OPERATION_ITERATIONS
+        },
+        'skipped': skipped,
+        'runs': []
+    }
+    
+    for backend in backends:
+        for rows in args.rows:
+            # Fresh generator per run so every backend and scale sees the same data
+            data = SyntheticData(seed=args.seed, panel_size=args.panel_size, pdf_size=args.pdf_size)
+            try:
+                results['runs'].append(run_benchmark(backend, rows, data, args.operations, args.iterations))
+            except Exception as e:
+                print(f"Benchmark run failed ({backend.name}, {rows} rows): {e}")
+                results['runs'].append({'backend': backend.name, 'rows': rows, 'error': str(e)})
+            # Written after every run so a long 1M-row run keeps the results of the earlier ones
+            results['peak_rss_bytes'] = peak_rss_bytes()
+            write_results(results, args.output)
+    
+    print(f"\n{'backend':<11}{'rows':>10}  {'operation':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak MB':>9}")
+    for run in results['runs']:
+        for name, stats in run.get('operations', {}).items():
+            print(f"{run['backend']:<11}{run['rows']:>10,}  {name:<28}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                  f"{stats['p99_ms']:>10.2f}{stats['throughput_ops']:>10.1f}{stats['peak_python_bytes'] / 2 ** 20:>9.1f}")
+    print(f"\nResults written to {args.output}")
+    
+    if args.compare:
+        baseline = load_results(args.compare)
+        for metric in ('p50_ms', 'p95_ms'):
+            print(f"\n{metric} compared with {args.compare} (ratio > 1 is slower):")
+            for backend, rows, name, old, new, ratio in compare_results(baseline, results, metric):
+                change = f"{ratio:6.2f}x" if ratio is not None else "     –"
+                print(f"  {backend:<11}{rows:>10,}  {name:<28}{old:>10.2f} -> {new:>10.2f}  {change}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+DatabaseManager benchmarks against a freshly seeded database per scale and backend
+"""
+import os
+import time
+import random
+import shutil
+import tempfile
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+import db
+from benchmarks.harness import measure
+from benchmarks.synthetic import SyntheticData
+
+# Timed calls per operation (get_all_client_reports loads the whole table, so it gets few)
+OPERATION_ITERATIONS = {
+    'get_client_report': 500,
+    'get_all_client_reports': 3,
+    'get_analyses': 20,
+    'generate_client_credentials': 500,
+    'save_client_report': 100
+}
+
+# Reports per save_client_reports_bulk call while seeding
+SEED_BATCH_SIZE = 1000
+
+# Credentials kept for get_client_report lookups
+CREDENTIAL_SAMPLE_SIZE = 1000
+
+def _analysis_count(rows):
+    return min(max(rows // 100, 10), 10000)
+
+class SqliteBackend:
+    """A new SQLite file per run, removed afterwards unless keep is set"""
+    name = 'sqlite'
+    
+    def __init__(self, workdir=None, keep=False):
+        self.workdir = workdir
+        self.keep = keep
+        self._created_dir = None
+    
+    def setup(self, rows):
+        if self.workdir is None:
+            self._created_dir = tempfile.mkdtemp(prefix='clientportal_bench_')
+        directory = self.workdir or self._created_dir
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"bench_{rows}.db")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return f"sqlite:///{self.path}"
+    
+    def size_bytes(self, engine):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+    
+    def teardown(self):
+        if self.keep:
+            return
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        if self._created_dir:
+            shutil.rmtree(self._created_dir, ignore_errors=True)
+            self._created_dir = None
+
+class PostgresBackend:
+    """A new schema per run in an existing PostgreSQL database, dropped afterwards unless keep is set"""
+    name = 'postgresql'
+    
+    def __init__(self, url, keep=False):
+        self.url = url
+        self.keep = keep
+    
+    @staticmethod
+    def available(url):
+        """Return None if the server accepts connections, otherwise the reason it does not"""
+        try:
+            engine, _ = db.get_engine(url)
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return None
+        except Exception as e:
+            return str(e).splitlines()[0]
+    
+    def setup(self, rows):
+        self.schema = f"bench_{rows}_{int(time.time())}"
+        engine, _ = db.get_engine(self.url)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'CREATE SCHEMA "{self.schema}"')
+        # Tables go to the run's schema; extensions such as pg_trgm stay visible from public
+        return make_url(self.url).update_query_dict({'options': f'-csearch_path={self.schema},public'}).render_as_string(hide_password=False)
+    
+    def size_bytes(self, engine):
+        with engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT coalesce(sum(pg_total_relation_size(c.oid)), 0) FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = :schema AND c.relkind = 'r'"
+            ), {'schema': self.schema}).scalar()
+    
+    def teardown(self):
+        if self.keep:
+            return
+        engine, _ = db.get_engine(self.url)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'DROP SCHEMA "{self.schema}" CASCADE')
+
+def seed_database(manager, data, rows):
+    """
+    Load rows synthetic reports (and a proportional number of analyses)
+    
+    Returns:
+    --------
+    dict
+        seed statistics and a sample of (username, password) credentials
+    """
+    credentials = []
+    seen = 0
+    sampler = random.Random(data.seed)
+    failed = 0
+    started = time.perf_counter()
+    
+    for batch in data.reports(rows, SEED_BATCH_SIZE):
+        result = manager.save_client_reports_bulk(batch)
+        failed += len(result['failed'])
+        # Reservoir sample, so lookups hit reports from the whole table
+        for saved in result['saved']:
+            seen += 1
+            if len(credentials) < CREDENTIAL_SAMPLE_SIZE:
+                credentials.append((saved['username'], saved['password']))
+            else:
+                slot = sampler.randrange(seen)
+                if slot < CREDENTIAL_SAMPLE_SIZE:
+                    credentials[slot] = (saved['username'], saved['password'])
+        if seen and seen % (SEED_BATCH_SIZE * 50) == 0:
+            print(f"  seeded {seen:,} of {rows:,} reports")
+    
+    reports_seconds = time.perf_counter() - started
+    
+    analyses = _analysis_count(rows)
+    for _ in range(analyses):
+        manager.save_analysis(**data.analysis())
+    
+    return {
+        'reports': seen,
+        'failed': failed,
+        'analyses': analyses,
+        'seconds': round(time.perf_counter() - started, 3),
+        'reports_per_second': round(seen / reports_seconds, 1) if reports_seconds else None,
+        'credentials': credentials
+    }
+
+def _operations(manager, data, credentials):
+    """Benchmark name -> operation(i); read-only operations come first"""
+    def get_client_report(i):
+        username, password = credentials[i % len(credentials)]
+        return manager.get_client_report(username, password)
+    
+    def get_all_client_reports(i):
+        return manager.get_all_client_reports()
+    
+    def get_analyses(i):
+        return manager.get_analyses()
+    
+    def generate_client_credentials(i):
+        return manager.generate_client_credentials(data.client_info())
+    
+    # Inputs are generated up front so only the save is timed
+    save_inputs = [data.report() for _ in range(OPERATION_ITERATIONS['save_client_report'] + 2)]
+    
+    def save_client_report(i):
+        record = save_inputs[i % len(save_inputs)]
+        return manager.save_client_report(record['client_info'], record['pdf_data'], record['allergen_data'])
+    
+    return {
+        'get_client_report': get_client_report,
+        'get_all_client_reports': get_all_client_reports,
+        'get_analyses': get_analyses,
+        'generate_client_credentials': generate_client_credentials,
+        'save_client_report': save_client_report
+    }
+
+def run_benchmark(backend, rows, data, operations=None, iterations=None):
+    """
+    Seed a fresh database with rows reports and time each operation
+    
+    Parameters:
+    -----------
+    backend : SqliteBackend or PostgresBackend
+        Where the database is created
+    rows : int
+        Number of reports to seed
+    data : benchmarks.synthetic.SyntheticData
+        Generator of the synthetic inputs
+    operations : list
+        Names from OPERATION_ITERATIONS to run (default all)
+    iterations : int
+        Timed calls per operation (default OPERATION_ITERATIONS)
+    
+    Returns:
+    --------
+    dict
+        backend, rows, seed statistics, database size and per-operation results
+    """
+    url = backend.setup(rows)
+    try:
+        manager = db.DatabaseManager()
+        if not manager.connect(url):
+            raise RuntimeError(f"Could not connect to the {backend.name} benchmark database")
+        
+        print(f"[{backend.name}] seeding {rows:,} reports...")
+        seed = seed_database(manager, data, rows)
+        credentials = seed.pop('credentials')
+        if not credentials:
+            raise RuntimeError("Seeding saved no reports")
+        db.flush_access_events()
+        
+        run = {
+            'backend': backend.name,
+            'rows': rows,
+            'seed': seed,
+            'database_bytes': backend.size_bytes(manager.engine),
+            'operations': {}
+        }
+        
+        selected = operations or list(OPERATION_ITERATIONS)
+        for name, operation in _operations(manager, data, credentials).items():
+            if name not in selected:
+                continue
+            count = iterations or OPERATION_ITERATIONS[name]
+            print(f"[{backend.name}] {rows:,} rows: {name} x{count}")
+            run['operations'][name] = measure(operation, count)
+            # Access events of get_client_report are written in the background; keep them out of the next timing
+            db.flush_access_events()
+        return run
+    finally:
+        db.dispose_engines()
+        backend.teardown()
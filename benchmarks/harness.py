@@ -0,0 +1,168 @@
+"""
+Timing, memory measurement and result files
+"""
+import gc
+import sys
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Latency percentiles reported for every operation
+PERCENTILES = (50, 90, 95, 99)
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where it is not available"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def measure(operation, iterations, warmup=1):
+    """
+    Time an operation and measure its peak Python memory
+    
+    Latencies are taken without tracing; one extra call runs under
+    tracemalloc to find the peak memory allocated during a single call.
+    
+    Parameters:
+    -----------
+    operation : callable
+        Called as operation(i) for i in range(iterations)
+    iterations : int
+        Number of timed calls
+    warmup : int
+        Untimed calls made first (connection pools, statement caches)
+    
+    Returns:
+    --------
+    dict
+        iterations, total_seconds, throughput_ops, mean_ms, min_ms, max_ms,
+        p50_ms ... p99_ms, peak_python_bytes and errors
+    """
+    errors = 0
+    for i in range(warmup):
+        operation(-1 - i)
+    
+    gc.collect()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        try:
+            if operation(i) is None:
+                errors += 1
+        except Exception as e:
+            print(f"Benchmark operation error: {e}")
+            errors += 1
+        latencies.append(time.perf_counter() - call_started)
+    total = time.perf_counter() - started
+    
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation(iterations)
+        _, peak_python = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    result = {
+        'iterations': iterations,
+        'total_seconds': round(total, 6),
+        'throughput_ops': round(iterations / total, 3) if total else None
+    }
+    result.update(summarize_latencies(latencies))
+    del result['count']
+    result['peak_python_bytes'] = peak_python
+    result['errors'] = errors
+    return result
+
+def summarize_latencies(latencies):
+    """count, mean_ms, min_ms, max_ms and p50_ms ... p99_ms of latencies in seconds"""
+    result = {'count': len(latencies)}
+    if not latencies:
+        return result
+    latencies_ms = np.array(latencies) * 1000
+    result.update({
+        'mean_ms': round(float(latencies_ms.mean()), 4),
+        'min_ms': round(float(latencies_ms.min()), 4),
+        'max_ms': round(float(latencies_ms.max()), 4)
+    })
+    for percentile in PERCENTILES:
+        result[f'p{percentile}_ms'] = round(float(np.percentile(latencies_ms, percentile)), 4)
+    return result
+
+def summarize_counts(values):
+    """count, mean, min, max and p50 ... p99 of integer counts"""
+    result = {'count': len(values)}
+    if not values:
+        return result
+    array = np.array(values)
+    result.update({'mean': round(float(array.mean()), 2), 'min': int(array.min()), 'max': int(array.max())})
+    for percentile in PERCENTILES:
+        result[f'p{percentile}'] = float(np.percentile(array, percentile))
+    return result
+
+def environment_info():
+    """Versions and host details recorded with every result file"""
+    import sqlalchemy
+    import pandas
+    
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    
+    return {
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'pandas': pandas.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine()
+    }
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(baseline, current, metric='p50_ms'):
+    """
+    Compare two result files operation by operation
+    
+    Returns:
+    --------
+    list
+        (backend, rows, operation, baseline value, current value, ratio)
+        for every operation present in both files; ratio > 1 means slower
+    """
+    def index(results):
+        return {
+            (run['backend'], run['rows'], name): stats.get(metric)
+            for run in results.get('runs', [])
+            for name, stats in run.get('operations', {}).items()
+        }
+    
+    before, after = index(baseline), index(current)
+    rows = []
+    for key in sorted(before.keys() & after.keys(), key=lambda k: (k[0], k[1], k[2])):
+        old, new = before[key], after[key]
+        ratio = new / old if old else None
+        rows.append(key + (old, new, ratio))
+    return rows
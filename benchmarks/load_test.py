@@ -0,0 +1,335 @@
+"""
+Concurrent client-login load test of app.py
+
+Each simulated user drives the real app.py main() through its own
+streamlit.testing.v1.AppTest session:
+
+    open       load the login page
+    login      submit username and password (the report renders on the rerun)
+    interact   change the sort order of the results table
+    download   prepare the PDF download
+    logout     log out again
+
+AppTest replaces Streamlit's global runtime on every run, so sessions in
+one process cannot run at the same time. Concurrent users therefore run in
+separate worker processes sharing the database; per-process state such as
+the client report cache and the in-memory login throttle is not shared.
+
+Client reports are seeded into a temporary SQLite database unless --url
+points at an existing one. Latency percentiles per step and per flow,
+database queries per flow and error rates are printed and written as JSON.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --users 200 --concurrency 8
+    python -m benchmarks.load_test --users 500 --concurrency 16 --ramp-up 30 --output load.json
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from benchmarks.harness import environment_info, peak_rss_bytes, summarize_counts, summarize_latencies, write_results
+from benchmarks.synthetic import SyntheticData
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+FLOW_STEPS = ('open', 'login', 'interact', 'download', 'logout')
+
+class QueryCounter:
+    """
+    Count the SQL statements of the running flow step
+    
+    Statements issued from a Streamlit script run are counted against the
+    current step; statements from other threads (e.g. the access log
+    writer) are counted as background queries.
+    """
+    
+    def __init__(self):
+        self.step = None
+        self.counts = Counter()
+        self.background = 0
+        self._lock = threading.Lock()
+    
+    def install(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+    
+    def reset(self):
+        with self._lock:
+            self.step = None
+            self.counts = Counter()
+            self.background = 0
+    
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        in_script = get_script_run_ctx(suppress_warning=True) is not None
+        with self._lock:
+            if in_script and self.step:
+                self.counts[self.step] += 1
+            else:
+                self.background += 1
+
+# Worker process state, set by _init_worker
+_counter = None
+_timeout = None
+
+def _init_worker(db_url, timeout, keep_throttle):
+    """Connect a worker process to the load test database"""
+    global _counter, _timeout
+    os.environ['DATABASE_URL'] = db_url
+    
+    from db import db_manager
+    import login_throttle
+    
+    if not db_manager.connect(db_url):
+        raise RuntimeError("Worker could not connect to the load test database")
+    if not keep_throttle:
+        # All simulated users share one client address
+        login_throttle.login_throttle.address_bucket = (0.0, 0.0)
+    
+    _counter = QueryCounter()
+    _counter.install(db_manager.engine)
+    _timeout = timeout
+
+def seed_clients(users, seed, panel_size, pdf_size):
+    """Save one client report per simulated user; returns their (username, password) pairs"""
+    from db import db_manager
+    
+    data = SyntheticData(seed=seed, panel_size=panel_size, pdf_size=pdf_size)
+    credentials = []
+    for batch in data.reports(users):
+        result = db_manager.save_client_reports_bulk(batch)
+        credentials.extend((saved['username'], saved['password']) for saved in result['saved'])
+    return credentials
+
+def _find(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"No widget labelled {label!r}")
+
+def _check(at, expectation, description):
+    """Raise if the script run failed, showed an error or missed the expected state"""
+    if at.exception:
+        raise RuntimeError(f"Script exception: {at.exception[0].value}")
+    if at.error:
+        raise RuntimeError(f"Error shown: {at.error[0].value}")
+    if not expectation(at):
+        raise RuntimeError(f"Expected {description}")
+
+def run_user_flow(plan):
+    """
+    Run one user's login -> view -> download -> logout flow in this worker
+    
+    Parameters:
+    -----------
+    plan : tuple
+        (user number, (username, password), mistype the password first,
+        wall-clock start time)
+    
+    Returns:
+    --------
+    dict
+        user, per-step latencies in seconds and query counts, total seconds,
+        background queries, failed step and error (None on success)
+    """
+    from streamlit.testing.v1 import AppTest
+    import db
+    
+    user, (username, password), wrong_password, start_at = plan
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    
+    result = {'user': user, 'steps': {}, 'failed_step': None, 'error': None}
+    _counter.reset()
+    started = time.perf_counter()
+    
+    def step(name, action, expectation, description):
+        _counter.step = name
+        step_started = time.perf_counter()
+        try:
+            action()
+            at.run(timeout=_timeout)
+            _check(at, expectation, description)
+        finally:
+            result['steps'][name] = time.perf_counter() - step_started
+    
+    def submit_login(attempt_password):
+        _find(at.text_input, "Username").input(username)
+        _find(at.text_input, "Password").input(attempt_password)
+        _find(at.button, "Login").click()
+    
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=_timeout)
+        step('open', lambda: None, lambda at: any(t.label == "Username" for t in at.text_input), "the login form")
+        
+        if wrong_password:
+            # A mistyped password first, as real clients do; counted in the login step's queries
+            _counter.step = 'login'
+            submit_login(password + "x")
+            at.run(timeout=_timeout)
+        
+        step('login', lambda: submit_login(password),
+             lambda at: at.session_state['authenticated'] and len(at.dataframe) > 0, "the client report")
+        
+        step('interact', lambda: _find(at.selectbox, "Sort by").select("Allergen (A-Z)"),
+             lambda at: len(at.dataframe) > 0, "the re-sorted results table")
+        
+        step('download', lambda: _find(at.button, "📄 Prepare PDF Download").click(),
+             lambda at: len(at.get('download_button')) > 0, "a PDF download button")
+        
+        step('logout', lambda: _find(at.button, "🚪 Logout").click(),
+             lambda at: not at.session_state['authenticated'], "the login page")
+    except Exception as e:
+        result['failed_step'] = _counter.step or 'open'
+        result['error'] = str(e).splitlines()[0] if str(e) else type(e).__name__
+    
+    result['total'] = time.perf_counter() - started
+    result['queries'] = dict(_counter.counts)
+    
+    # Write buffered access events now so they are not counted in the next flow
+    _counter.step = None
+    db.flush_access_events()
+    result['background_queries'] = _counter.background
+    return result
+
+def run_load_test(db_url, credentials, users, concurrency, ramp_up, timeout, wrong_password_rate, seed, keep_throttle):
+    """
+    Run one flow per user in concurrency worker processes
+    
+    Returns:
+    --------
+    dict
+        wall time, throughput, per-step and per-flow latency summaries,
+        query counts, error rate and the most common errors
+    """
+    rng = random.Random(seed)
+    context = multiprocessing.get_context('spawn')
+    
+    with context.Pool(concurrency, initializer=_init_worker, initargs=(db_url, timeout, keep_throttle)) as pool:
+        # Start every worker (imports, connection) before the clock starts
+        pool.map(time.sleep, [0.2] * concurrency, chunksize=1)
+        
+        # Spread the starts over the ramp-up period
+        start = time.time()
+        plans = [
+            (user, credentials[user % len(credentials)], rng.random() < wrong_password_rate, start + ramp_up * user / users)
+            for user in range(users)
+        ]
+        started = time.perf_counter()
+        flows = pool.map(run_user_flow, plans, chunksize=1)
+        wall_seconds = time.perf_counter() - started
+    
+    succeeded = [flow for flow in flows if not flow['error']]
+    failures = [flow for flow in flows if flow['error']]
+    return {
+        'users': users,
+        'concurrency': concurrency,
+        'wall_seconds': round(wall_seconds, 3),
+        'flows_per_second': round(len(flows) / wall_seconds, 3) if wall_seconds else None,
+        'error_rate': round(len(failures) / len(flows), 4) if flows else 0.0,
+        'errors_by_step': dict(Counter(flow['failed_step'] for flow in failures)),
+        'top_errors': Counter(flow['error'] for flow in failures).most_common(5),
+        'flow_latency': summarize_latencies([flow['total'] for flow in succeeded]),
+        'step_latency': {
+            name: summarize_latencies([
+                flow['steps'][name] for flow in flows if name in flow['steps'] and flow['failed_step'] != name
+            ])
+            for name in FLOW_STEPS
+        },
+        'queries_per_flow': summarize_counts([sum(flow['queries'].values()) for flow in succeeded]),
+        'queries_per_step': {
+            name: summarize_counts([flow['queries'].get(name, 0) for flow in succeeded])
+            for name in FLOW_STEPS
+        },
+        'background_queries': sum(flow['background_queries'] for flow in flows)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent client-login load test of app.py")
+    parser.add_argument('--users', type=int, default=100, help="Simulated users (one flow each)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Users running at the same time (one process each)")
+    parser.add_argument('--ramp-up', type=float, default=0, help="Seconds over which user starts are spread")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds allowed per script run")
+    parser.add_argument('--wrong-password-rate', type=float, default=0.05, help="Share of users who mistype their password once")
+    parser.add_argument('--url', help="Existing database with client reports (default: seed a temporary SQLite database)")
+    parser.add_argument('--credentials', help="CSV of username,password rows to log in with when --url is given")
+    parser.add_argument('--keep-throttle', action='store_true',
+                        help="Keep the per-address login bucket (all simulated users share one address)")
+    parser.add_argument('--panel-size', type=int, default=40, help="Allergens per seeded report")
+    parser.add_argument('--pdf-size', type=int, default=64 * 1024, help="Bytes per seeded PDF")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed")
+    parser.add_argument('--output', default='load_test_results.json', help="JSON file to write")
+    args = parser.parse_args()
+    
+    workdir = None
+    if args.url:
+        db_url = args.url
+    else:
+        workdir = tempfile.mkdtemp(prefix='clientportal_load_')
+        db_url = f"sqlite:///{os.path.join(workdir, 'load_test.db')}"
+    # The app's database is chosen when db is first imported; worker processes inherit this
+    os.environ['DATABASE_URL'] = db_url
+    
+    import db
+    from db import db_manager
+    
+    try:
+        if not db_manager.connect(db_url):
+            raise SystemExit("Could not connect to the load test database")
+        
+        if args.credentials:
+            import csv
+            with open(args.credentials, newline='') as f:
+                credentials = [(row[0], row[1]) for row in csv.reader(f) if len(row) >= 2]
+        elif args.url:
+            raise SystemExit("--credentials is required with --url")
+        else:
+            print(f"Seeding {args.users} client reports...")
+            credentials = seed_clients(args.users, args.seed, args.panel_size, args.pdf_size)
+        if not credentials:
+            raise SystemExit("No client credentials to log in with")
+        database = db_manager.engine.dialect.name
+        
+        print(f"Running {args.users} users, {args.concurrency} at a time...")
+        summary = run_load_test(
+            db_url, credentials, args.users, args.concurrency, args.ramp_up, args.timeout,
+            args.wrong_password_rate, args.seed, args.keep_throttle
+        )
+    finally:
+        db.dispose_engines()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    results = {
+        'environment': environment_info(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('credentials', 'output')},
+        'database': database,
+        'summary': summary,
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+    write_results(results, args.output)
+    
+    print(f"\n{summary['users']} flows in {summary['wall_seconds']:.1f}s "
+          f"({summary['flows_per_second']:.2f} flows/s), error rate {summary['error_rate']:.1%}")
+    print(f"\n{'step':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'queries p50':>13}")
+    rows = [(name, summary['step_latency'][name], summary['queries_per_step'][name]) for name in FLOW_STEPS]
+    rows.append(('flow', summary['flow_latency'], summary['queries_per_flow']))
+    for name, latency, queries in rows:
+        if latency['count']:
+            print(f"{name:<10}{latency['p50_ms']:>10.1f}{latency['p95_ms']:>10.1f}{latency['p99_ms']:>10.1f}"
+                  f"{latency['max_ms']:>10.1f}{queries.get('p50', 0):>13.0f}")
+    for error, count in summary['top_errors']:
+        print(f"  {count} x {error}")
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    # Pool tasks must pickle by the importable module name: AppTest swaps __main__ for the app script
+    from benchmarks.load_test import main
+    main()
@@ -0,0 +1,130 @@
+"""
+Deterministic synthetic data: patients, allergen panels and fake PDF blobs
+"""
+import random
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from csv_ingestion import classify_igg
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Carlos', 'Karen',
+    'Ahmed', 'Mei', 'Olga', 'Kenji', 'Fatima', 'Lucas', 'Sofia', 'Noah', 'Emma', 'Ravi'
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson'
+]
+PRACTITIONERS = [f"Dr. {name}" for name in ('Smith', 'Johnson', 'Nguyen', 'Patel', 'Kim', 'Okafor', 'Rossi', 'Schmidt', 'Haddad', 'Silva')]
+
+# Allergen panel: category -> allergens
+ALLERGEN_PANEL = {
+    'Dairy': ['Milk', 'Cheddar', 'Yogurt', 'Goat Milk', 'Casein', 'Whey'],
+    'Grains': ['Wheat', 'Gluten', 'Rye', 'Barley', 'Oat', 'Rice', 'Corn', 'Spelt'],
+    'Nuts & Seeds': ['Peanut', 'Almond', 'Cashew', 'Hazelnut', 'Walnut', 'Sesame', 'Sunflower Seed'],
+    'Fruits': ['Apple', 'Banana', 'Orange', 'Strawberry', 'Grape', 'Pineapple', 'Kiwi', 'Mango'],
+    'Vegetables': ['Tomato', 'Potato', 'Carrot', 'Celery', 'Spinach', 'Broccoli', 'Garlic', 'Onion'],
+    'Meats': ['Beef', 'Chicken', 'Pork', 'Lamb', 'Turkey'],
+    'Seafood': ['Cod', 'Salmon', 'Tuna', 'Shrimp', 'Crab', 'Lobster'],
+    'Legumes': ['Soybean', 'Lentil', 'Chickpea', 'Pea', 'Kidney Bean'],
+    'Other': ['Egg White', 'Egg Yolk', 'Yeast', 'Coffee', 'Cocoa', 'Honey']
+}
+
+def _panel_columns(panel_size):
+    """(category, allergen) pairs of a panel; larger panels repeat the list with numbered names"""
+    allergens = [(category, allergen) for category, names in ALLERGEN_PANEL.items() for allergen in names]
+    panel = []
+    for i in range(panel_size):
+        category, allergen = allergens[i % len(allergens)]
+        panel.append((category, allergen if i < len(allergens) else f"{allergen} {i // len(allergens) + 1}"))
+    return panel
+
+class SyntheticData:
+    """
+    Reproducible generator of report inputs
+    
+    The same seed always produces the same patients, panels and PDFs, so
+    results of different versions are measured on identical data.
+    
+    Parameters:
+    -----------
+    seed : int
+        Random seed
+    panel_size : int
+        Allergens per report
+    pdf_size : int
+        Bytes per fake PDF blob
+    """
+    
+    def __init__(self, seed=42, panel_size=40, pdf_size=16 * 1024):
+        self.seed = seed
+        self.panel_size = panel_size
+        self.pdf_size = pdf_size
+        self._panel = _panel_columns(panel_size)
+        self._random = random.Random(seed)
+        self._numpy = np.random.default_rng(seed)
+        # One random PDF body, sliced at different offsets so blobs differ without generating each one
+        self._pdf_body = self._numpy.bytes(pdf_size * 2)
+    
+    def client_info(self):
+        """Patient and sample details in the format used by save_client_report"""
+        rng = self._random
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        dob = date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 65))
+        collection = date(2024, 1, 1) + timedelta(days=rng.randrange(730))
+        return {
+            'name': f"{first} {last}",
+            'patient_id': f"P{rng.randrange(10 ** 9):09d}",
+            'dob': dob.strftime('%d/%m/%Y'),
+            'gender': rng.choice(['Male', 'Female']),
+            'practitioner': rng.choice(PRACTITIONERS),
+            'collection_date': collection.isoformat(),
+            'specimen': 'Dry Blood',
+            'email': f"{first.lower()}.{last.lower()}@example.com"
+        }
+    
+    def allergen_panel(self):
+        """Allergen results with a realistic skew: most Low, some Moderate and High"""
+        levels = np.round(self._numpy.lognormal(mean=0.0, sigma=0.7, size=self.panel_size), 2)
+        return pd.DataFrame({
+            'Allergen': [allergen for _, allergen in self._panel],
+            'Category': [category for category, _ in self._panel],
+            'IgG_Level': levels,
+            'Classification': classify_igg(levels)
+        })
+    
+    def pdf_blob(self):
+        """Fake PDF of pdf_size bytes"""
+        offset = self._random.randrange(self.pdf_size)
+        header = b'%PDF-1.4\n'
+        return header + self._pdf_body[offset:offset + self.pdf_size - len(header)]
+    
+    def report(self):
+        """One save_client_reports_bulk record"""
+        return {'client_info': self.client_info(), 'pdf_data': self.pdf_blob(), 'allergen_data': self.allergen_panel()}
+    
+    def reports(self, count, batch_size=1000):
+        """Yield lists of up to batch_size records until count records were produced"""
+        for start in range(0, count, batch_size):
+            yield [self.report() for _ in range(min(batch_size, count - start))]
+    
+    def analysis(self, grid_rows=16, grid_columns=24):
+        """Arguments of DatabaseManager.save_analysis for one microarray analysis"""
+        spots = grid_rows * grid_columns
+        results = pd.DataFrame({
+            'Row': np.repeat(np.arange(1, grid_rows + 1), grid_columns),
+            'Column': np.tile(np.arange(1, grid_columns + 1), grid_rows),
+            'Intensity': np.round(self._numpy.uniform(0, 65535, spots), 1),
+            'Background': np.round(self._numpy.uniform(0, 2000, spots), 1)
+        })
+        return {
+            'name': f"Analysis {self._random.randrange(10 ** 6)}",
+            'description': "Synthetic benchmark analysis",
+            'rows': grid_rows,
+            'columns': grid_columns,
+            'image_filename': 'synthetic.tif',
+            'grid_params': {'rows': grid_rows, 'columns': grid_columns, 'spot_radius': 6},
+            'results_df': results
+        }
@@ -4,6 +4,8 @@ Client Portal Website Design page for configuring the client-facing portal
 import streamlit as st
 import json
 from datetime import datetime
+from db import db_manager
+from login_throttle import ADDRESS_BUCKET, DEFAULT_MAX_LOGIN_ATTEMPTS, LOGIN_LOCKOUT_SECONDS
 
 def render_client_portal_design_page():
     """
@@ -180,7 +182,18 @@ def render_client_portal_design_page():
         st.markdown("**Security Settings**")
         session_timeout = st.slider("Session Timeout (minutes)", 15, 120, 60)
         password_expiry = st.slider("Password Expiry (days)", 30, 365, 90)
-        max_login_attempts = st.slider("Max Login Attempts", 3, 10, 5)
+        try:
+            stored_max_attempts = int(db_manager.get_portal_setting('max_login_attempts', DEFAULT_MAX_LOGIN_ATTEMPTS))
+        except (TypeError, ValueError):
+            stored_max_attempts = DEFAULT_MAX_LOGIN_ATTEMPTS
+        max_login_attempts = st.slider(
+            "Max Login Attempts", 3, 10, min(max(stored_max_attempts, 3), 10),
+            help=f"Failed attempts per username and client address before a "
+                 f"{LOGIN_LOCKOUT_SECONDS / 60:.0f} minute lockout. Separately, each client address "
+                 f"may make {ADDRESS_BUCKET[1] * 60:.0f} login attempts per minute (bursts of "
+                 f"{ADDRESS_BUCKET[0]:.0f}, set with LOGIN_ADDRESS_PER_MINUTE / LOGIN_ADDRESS_BURST); "
+                 f"a clinic behind one shared address counts as one client address."
+        )
         
         st.markdown("**Performance Settings**")
         enable_caching = st.checkbox("Enable Caching", True)
@@ -202,7 +215,10 @@ def render_client_portal_design_page():
     with col1:
         if st.button("💾 Save Configuration", type="primary", use_container_width=True):
             # Here you would save all the configuration to the database
-            st.success("Portal configuration saved successfully!")
+            if db_manager.save_portal_setting('max_login_attempts', max_login_attempts):
+                st.success("Portal configuration saved successfully!")
+            else:
+                st.error("Failed to save portal configuration")
     
     with col2:
         if st.button("👀 Preview Portal", use_container_width=True):
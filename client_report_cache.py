@@ -0,0 +1,55 @@
+"""
+Session-scoped cache of the logged-in client's report across Streamlit reruns
+"""
+
+# st.session_state key holding the cache entry
+CACHE_KEY = 'client_report_cache'
+
+def get_cached_client_report(session_state, db_manager, report_id):
+    """
+    Get a client report, loading it from the database at most once per version
+    
+    The entry is keyed by report id and row version. Every rerun checks the
+    version with one small primary key query, so a deactivation or any
+    other change made by any process is noticed on the next rerun; the
+    report itself is only reloaded when the version changed.
+    
+    Parameters:
+    -----------
+    session_state : streamlit.runtime.state.SessionStateProxy
+        Session state of the client's browser session
+    db_manager : db.DatabaseManager
+        Database to load the report from
+    report_id : int
+        ID returned by DatabaseManager.authenticate
+    
+    Returns:
+    --------
+    dict
+        Report as returned by get_client_report_by_id, or None if it is
+        missing or no longer active
+    """
+    entry = session_state.get(CACHE_KEY)
+    if entry and entry['report_id'] == report_id:
+        row_version = db_manager.get_report_version(report_id)
+        if row_version is None:
+            invalidate_client_report(session_state)
+            return None
+        if row_version == entry['row_version']:
+            return entry['report']
+    
+    report = db_manager.get_client_report_by_id(report_id)
+    if report is None:
+        invalidate_client_report(session_state)
+        return None
+    
+    session_state[CACHE_KEY] = {
+        'report_id': report_id,
+        'row_version': report['row_version'],
+        'report': report
+    }
+    return report
+
+def invalidate_client_report(session_state):
+    """Drop the cached report of a session, e.g. on login or logout"""
+    session_state.pop(CACHE_KEY, None)
@@ -0,0 +1,301 @@
+"""
+Vectorized ingestion of lab CSV exports into the formats used by the report pages
+"""
+import os
+import numpy as np
+import pandas as pd
+
+# Rows per chunk when reading uploaded CSV files
+INGEST_CHUNK_SIZE = int(os.environ.get('CSV_INGEST_CHUNK_SIZE', '50000'))
+
+# Columns of a complete lab export (client details in the first row, one allergen per row)
+REQUIRED_COLUMNS = ['Category', 'Allergen', 'IgG', 'Sample ID', 'Name', 'Gender', 'Date of Birth', 'Practitioner', 'Date of Receipt', 'Report Date']
+
+# Per-row columns are read as text; IgG mixes numbers with "Unelevated"
+LAB_EXPORT_DTYPES = {'Category': str, 'Allergen': str, 'IgG': str}
+
+# Client columns of the admin CSV; every other column is an allergen
+ADMIN_CLIENT_COLUMNS = ['Name', 'Date of Birth', 'Gender', 'Email', 'Collection Date', 'Practitioner']
+
+# IgG thresholds (µg/ml) of the admin classification
+HIGH_THRESHOLD = 2.5
+MODERATE_THRESHOLD = 1.5
+
+class MissingColumnsError(ValueError):
+    """Raised when an uploaded CSV lacks required columns"""
+    
+    def __init__(self, columns):
+        self.columns = columns
+        super().__init__(f"missing required columns: {', '.join(columns)}")
+
+def read_csv_chunks(source, chunk_size=INGEST_CHUNK_SIZE, dtype=None):
+    """
+    Read a CSV file in chunks
+    
+    The index keeps counting across chunks, so row numbers derived from it
+    match those of a single pd.read_csv call.
+    
+    Parameters:
+    -----------
+    source : str or file-like
+        CSV file path or uploaded file
+    chunk_size : int
+        Rows per chunk
+    dtype : dict
+        Explicit column dtypes passed to pd.read_csv
+    
+    Returns:
+    --------
+    iterator of pandas.DataFrame
+    """
+    return pd.read_csv(source, chunksize=chunk_size, dtype=dtype)
+
+def parse_floats(values):
+    """
+    Convert a column to float64 the way float() converts single values
+    
+    Numeric columns are cast directly. Text in object columns is parsed in
+    one NumPy pass; only strings that pandas cannot read as numbers and
+    non-string values (e.g. True in a column that also has missing values)
+    go through float() one by one.
+    
+    Parameters:
+    -----------
+    values : pandas.Series
+        Column to convert
+    
+    Returns:
+    --------
+    tuple
+        (float64 ndarray with NaN for missing values, bool ndarray that is
+        False where a present value could not be converted)
+    """
+    if pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+        result = values.to_numpy(dtype='float64', na_value=np.nan)
+        return result, np.ones(len(result), dtype=bool)
+    
+    result = np.full(len(values), np.nan)
+    valid = np.ones(len(values), dtype=bool)
+    
+    present = values.notna().to_numpy()
+    objects = values[present].to_numpy(dtype=object)
+    # Only strings are parsed as text; float("True") would fail where float(True) is 1.0
+    is_text = np.fromiter((isinstance(value, str) for value in objects), dtype=bool, count=len(objects))
+    text = pd.Series(objects[is_text], dtype=object)
+    parsed = np.zeros(len(objects), dtype=bool)
+    parsed[is_text] = pd.to_numeric(text, errors='coerce').notna().to_numpy()
+    
+    # NumPy converts each string with float() itself, in a single C loop
+    positions = np.flatnonzero(present)
+    try:
+        result[positions[parsed]] = objects[parsed].astype('float64')
+    except ValueError:
+        parsed[:] = False
+    
+    # Non-string values and rare leftovers such as "1_000" or " inf " that float() still accepts
+    for position, value in zip(positions[~parsed], objects[~parsed]):
+        try:
+            result[position] = float(value)
+        except (TypeError, ValueError):
+            valid[position] = False
+    
+    return result, valid
+
+def normalize_igg(values):
+    """
+    Convert raw IgG values to µg/ml
+    
+    Missing, "Unelevated" (any case) and unparseable values become 0.0.
+    
+    Parameters:
+    -----------
+    values : pandas.Series
+        Raw IgG column
+    
+    Returns:
+    --------
+    numpy.ndarray
+        float64 IgG values
+    """
+    unelevated = values.astype(str).str.lower().to_numpy() == 'unelevated'
+    result, valid = parse_floats(values.mask(unelevated))
+    result[~valid | unelevated] = 0.0
+    return np.nan_to_num(result, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+def _text_column(values):
+    """Column as str values, with missing values as empty strings"""
+    return values.astype(object).where(values.notna(), '').astype(str)
+
+def process_lab_rows(df):
+    """
+    Convert lab export rows to the format expected by the report generator
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Rows (or a chunk of rows) of a lab export
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns Row, Column, Allergen, Latin Name, Category, IgG (µg/ml)
+    """
+    return pd.DataFrame({
+        'Row': df.index.to_numpy(dtype='int64') + 1,
+        'Column': np.ones(len(df), dtype='int64'),
+        'Allergen': _text_column(df['Allergen']).to_numpy(),
+        'Latin Name': np.full(len(df), '', dtype=object),
+        'Category': _text_column(df['Category']).to_numpy(),
+        'IgG (µg/ml)': normalize_igg(df['IgG'])
+    })
+
+def extract_client_info(first_row, file_idx):
+    """
+    Build the client information dictionary from the first row of a lab export
+    
+    Parameters:
+    -----------
+    first_row : pandas.Series
+        First row of the export
+    file_idx : int
+        Position of the file in the upload, used for placeholder names
+    
+    Returns:
+    --------
+    dict
+        Client information dictionary
+    """
+    def text(column, default=''):
+        value = first_row[column]
+        return str(value) if pd.notna(value) else default
+    
+    return {
+        'patient_id': text('Sample ID', f"ID_{file_idx+1}"),
+        'name': text('Name', f"Patient_{file_idx+1}"),
+        'gender': text('Gender'),
+        'dob': text('Date of Birth'),
+        'practitioner': text('Practitioner'),
+        'collection_date': text('Date of Receipt'),
+        'report_date': text('Report Date'),
+        'specimen': 'Dry Blood',
+        'email': ''
+    }
+
+def ingest_lab_export(source, file_idx=0, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Read a complete lab export and convert it for report generation
+    
+    The file is read and converted chunk by chunk, so only one chunk of the
+    raw CSV is in memory at a time.
+    
+    Parameters:
+    -----------
+    source : str or file-like
+        CSV file path or uploaded file
+    file_idx : int
+        Position of the file in the upload, used for placeholder names
+    chunk_size : int
+        Rows per chunk
+    
+    Returns:
+    --------
+    tuple
+        (client_info dict, processed pandas.DataFrame)
+    
+    Raises:
+    -------
+    MissingColumnsError
+        If the file lacks any of REQUIRED_COLUMNS
+    IndexError
+        If the file has no data rows
+    """
+    client_info = None
+    processed_chunks = []
+    
+    for chunk in read_csv_chunks(source, chunk_size, dtype=LAB_EXPORT_DTYPES):
+        if client_info is None:
+            missing_columns = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+            if missing_columns:
+                raise MissingColumnsError(missing_columns)
+            client_info = extract_client_info(chunk.iloc[0], file_idx)
+        processed_chunks.append(process_lab_rows(chunk))
+    
+    if client_info is None:
+        raise IndexError("CSV file has no data rows")
+    
+    return client_info, pd.concat(processed_chunks, ignore_index=True)
+
+def classify_igg(values):
+    """Classify IgG levels as High, Moderate or Low"""
+    return np.select(
+        [values >= HIGH_THRESHOLD, values >= MODERATE_THRESHOLD],
+        ['High', 'Moderate'],
+        default='Low'
+    ).astype(object)
+
+def build_admin_records(df):
+    """
+    Convert an admin CSV (one client per row, one column per allergen) to report records
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Admin CSV rows (or a chunk of rows); patient ids follow the index
+    
+    Returns:
+    --------
+    list
+        {'client_info', 'allergen_data'} dicts, one per row; allergen_data
+        is a DataFrame with Allergen, IgG_Level and Classification columns
+    """
+    def column(name, default):
+        if name in df.columns:
+            return df[name].tolist()
+        return [default] * len(df)
+    
+    names = column('Name', '')
+    dobs = column('Date of Birth', '')
+    genders = column('Gender', '')
+    collection_dates = column('Collection Date', '2025-05-28')
+    practitioners = column('Practitioner', 'Dr. Smith')
+    emails = column('Email', '')
+    
+    # Allergen values as a rows x allergens matrix; unparseable cells are skipped
+    allergen_columns = [col for col in df.columns if col not in ADMIN_CLIENT_COLUMNS]
+    levels = np.zeros((len(df), len(allergen_columns)))
+    valid = np.ones((len(df), len(allergen_columns)), dtype=bool)
+    for position, col in enumerate(allergen_columns):
+        values, parsed = parse_floats(df[col])
+        levels[:, position] = np.nan_to_num(values, nan=0.0, posinf=np.inf, neginf=-np.inf)
+        valid[:, position] = parsed
+    
+    # Flatten the valid cells in row order; each client is then a contiguous slice
+    long_rows, long_columns = np.nonzero(valid)
+    long_levels = levels[long_rows, long_columns]
+    allergen_data = pd.DataFrame({
+        'Allergen': np.array(allergen_columns, dtype=object)[long_columns],
+        'IgG_Level': long_levels,
+        'Classification': classify_igg(long_levels)
+    })
+    boundaries = np.searchsorted(long_rows, np.arange(len(df) + 1))
+    
+    records = []
+    for position, idx in enumerate(df.index):
+        start, end = boundaries[position], boundaries[position + 1]
+        client_allergens = allergen_data.iloc[start:end].reset_index(drop=True) if end > start else pd.DataFrame()
+        records.append({
+            'client_info': {
+                'name': names[position],
+                'patient_name': names[position],
+                'patient_id': f"P{idx + 1:04d}",
+                'dob': dobs[position],
+                'gender': genders[position],
+                'collection_date': collection_dates[position],
+                'practitioner': practitioners[position],
+                'specimen_type': 'Serum',
+                'email': emails[position]
+            },
+            'allergen_data': client_allergens
+        })
+    
+    return records
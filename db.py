@@ -1,12 +1,24 @@
 import os
+import re
 import json
-from datetime import datetime
+import base64
+import atexit
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import sqlite3
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, MetaData, Table, select, insert, Boolean, LargeBinary
+import time
+from sqlalchemy import event, create_engine, Column, Integer, String, Float, DateTime, Text, MetaData, Table, select, insert, Boolean, LargeBinary, Index, func, inspect, update, bindparam, ForeignKey, tuple_, or_, text, case, cast
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import StatementError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session, deferred, undefer
 import secrets
 import string
+import numpy as np
+from csv_ingestion import HIGH_THRESHOLD, MODERATE_THRESHOLD, classify_igg
+from payload_codec import PayloadDecodeError, decode_payload, encode_payload
 
 # Create a directory for databases if it doesn't exist
 DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
@@ -17,6 +29,55 @@ if not os.path.exists(DB_DIR):
 DB_PATH = os.path.join(DB_DIR, 'microarray_analysis.db')
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+# Connection pool settings (only applied to server databases such as PostgreSQL)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+
+# Apply pending schema migrations on the first connect of each process.
+# Disable to require running `python migrate.py` as a separate deploy step.
+AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+
+# Rows per executemany batch in save_client_reports_bulk
+BULK_INSERT_CHUNK_SIZE = int(os.environ.get('BULK_INSERT_CHUNK_SIZE', '500'))
+
+# Archive listing sort orders: (sort column, direction). The report id is always
+# appended as a tie-breaker so keyset cursors are unique.
+ARCHIVE_SORTS = {
+    'newest': ('report_date', 'desc'),
+    'oldest': ('report_date', 'asc'),
+    'name': ('patient_name', 'asc'),
+}
+ARCHIVE_STATUSES = ('all', 'active', 'inactive', 'accessed', 'not_accessed')
+
+# Groupings offered by the analytics summaries
+ANALYTICS_GROUPINGS = ('allergen', 'practitioner', 'month')
+
+# Archive summary metrics are cached per engine until a write invalidates them,
+# and at most this many seconds so the "This Week" window keeps moving
+ARCHIVE_STATS_TTL = float(os.environ.get('ARCHIVE_STATS_TTL', '300'))
+
+# Chunk size used when streaming PDF blobs out of the database
+PDF_CHUNK_SIZE = 256 * 1024
+
+# Report views are buffered in memory and written to report_access_events in
+# batches, either every ACCESS_LOG_FLUSH_INTERVAL seconds or once
+# ACCESS_LOG_BATCH_SIZE views are pending
+ACCESS_LOG_FLUSH_INTERVAL = float(os.environ.get('ACCESS_LOG_FLUSH_INTERVAL', '5'))
+ACCESS_LOG_BATCH_SIZE = int(os.environ.get('ACCESS_LOG_BATCH_SIZE', '500'))
+ACCESS_LOG_MAX_PENDING = int(os.environ.get('ACCESS_LOG_MAX_PENDING', '50000'))
+
+# One engine and one scoped session registry per database URL, shared by every
+# DatabaseManager in the process (Streamlit runs each script run in its own thread)
+_engines = {}
+_sessions = {}
+_schema_versions = {}
+_access_buffers = {}
+_search_backends = {}
+_archive_stats_cache = {}
+_engine_lock = threading.Lock()
+
 # Define base class for SQLAlchemy models
 Base = declarative_base()
 
@@ -27,34 +88,36 @@ class Analysis(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
-    date_created = Column(DateTime, default=datetime.utcnow)
+    date_created = Column(DateTime, default=datetime.utcnow, index=True)
     rows = Column(Integer, nullable=False)
     columns = Column(Integer, nullable=False)
     image_filename = Column(String(255), nullable=True)
-    grid_params = Column(Text, nullable=False)  # Stored as JSON
-    results = Column(Text, nullable=False)  # Stored as JSON
+    grid_params = Column(Text, nullable=False)  # Compact JSON (see payload_codec)
+    results = Column(Text, nullable=False)  # Columnar payload or legacy JSON (see payload_codec)
 
 # New models for client portal system
 class ClientReport(Base):
     __tablename__ = 'client_reports'
     
     id = Column(Integer, primary_key=True)
-    patient_id = Column(String(255), nullable=False)
+    patient_id = Column(String(255), nullable=False, index=True)
     patient_name = Column(String(255), nullable=False)
-    report_date = Column(DateTime, default=datetime.utcnow)
+    report_date = Column(DateTime, default=datetime.utcnow, index=True)
     practitioner = Column(String(255), nullable=True)
     collection_date = Column(String(255), nullable=True)
     gender = Column(String(10), nullable=True)
     dob = Column(String(255), nullable=True)
     specimen_type = Column(String(255), nullable=True)
     email = Column(String(255), nullable=True)
-    pdf_data = Column(LargeBinary, nullable=False)  # Store PDF binary data
-    allergen_data = Column(Text, nullable=False)  # JSON string of allergen results
+    # Large payloads are deferred so listings and logins only load metadata columns
+    pdf_data = deferred(Column(LargeBinary, nullable=False))  # Store PDF binary data
+    allergen_data = deferred(Column(Text, nullable=False))  # Columnar payload or legacy JSON (see payload_codec)
     username = Column(String(255), nullable=False, unique=True)
     password = Column(String(255), nullable=False)
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True, index=True)
     access_granted = Column(DateTime, default=datetime.utcnow)
-    last_accessed = Column(DateTime, nullable=True)
+    last_accessed = Column(DateTime, nullable=True, index=True)
+    row_version = Column(Integer, nullable=False, default=1, server_default='1')  # Bumped by every change clients can see
 
 class PortalSettings(Base):
     __tablename__ = 'portal_settings'
@@ -64,15 +127,928 @@ class PortalSettings(Base):
     setting_value = Column(Text, nullable=False)
     updated_date = Column(DateTime, default=datetime.utcnow)
 
+class LoginThrottleState(Base):
+    __tablename__ = 'login_throttle_state'
+    
+    # Shared login throttle buckets and lockouts (see login_throttle.DatabaseThrottleStore)
+    key = Column(String(255), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)  # Unix time of the last change
+    failures = Column(Integer, nullable=False, default=0)
+    locked_until = Column(Float, nullable=False, default=0)
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    
+    version = Column(Integer, primary_key=True)
+    description = Column(String(255), nullable=False)
+    applied_date = Column(DateTime, default=datetime.utcnow)
+
+class AccessEvent(Base):
+    __tablename__ = 'report_access_events'
+    
+    id = Column(Integer, primary_key=True)
+    report_id = Column(Integer, ForeignKey('client_reports.id'), nullable=False, index=True)
+    accessed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class UsernameCounter(Base):
+    __tablename__ = 'username_counters'
+    
+    base_username = Column(String(255), primary_key=True)
+    allocated = Column(Integer, nullable=False, default=0)  # Usernames handed out for this base
+
+class AllergenResult(Base):
+    __tablename__ = 'allergen_results'
+    __table_args__ = (
+        Index('ix_allergen_results_allergen_classification', 'allergen', 'classification'),
+        Index('ix_allergen_results_category', 'category'),
+    )
+    
+    # One row per entry of ClientReport.allergen_data, written in the same transaction
+    id = Column(Integer, primary_key=True)
+    report_id = Column(Integer, ForeignKey('client_reports.id'), nullable=False, index=True)
+    allergen = Column(String(255), nullable=False)
+    category = Column(String(255), nullable=True)
+    igg = Column(Float, nullable=True)  # IgG level in µg/ml
+    classification = Column(String(50), nullable=True)
+
+class ReportSummary(Base):
+    __tablename__ = 'report_summaries'
+    
+    # Reports per practitioner and month, maintained incrementally on save
+    practitioner = Column(String(255), primary_key=True)
+    month = Column(String(7), primary_key=True)  # YYYY-MM of the report date
+    reports = Column(Integer, nullable=False, default=0)
+
+class AllergenSummary(Base):
+    __tablename__ = 'allergen_summaries'
+    
+    # Allergen results per allergen, practitioner and month, maintained incrementally on save
+    allergen = Column(String(255), primary_key=True)
+    practitioner = Column(String(255), primary_key=True)
+    month = Column(String(7), primary_key=True)
+    tested = Column(Integer, nullable=False, default=0)
+    high = Column(Integer, nullable=False, default=0)
+    moderate = Column(Integer, nullable=False, default=0)
+    igg_total = Column(Float, nullable=False, default=0)  # Sum of IgG levels, for averages
+
+class ReportJob(Base):
+    __tablename__ = 'report_jobs'
+    __table_args__ = (
+        Index('ix_report_jobs_status_created', 'status', 'created_date'),
+    )
+    
+    # Background report generation jobs, run by report_jobs.JobWorker
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    idempotency_key = Column(String(64), nullable=False, unique=True)  # Resubmitting the same items returns this job
+    status = Column(String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    options = Column(Text, nullable=False, default='{}')  # JSON
+    total_items = Column(Integer, nullable=False, default=0)
+    done_items = Column(Integer, nullable=False, default=0)
+    failed_items = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String(255), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Jobs whose worker stopped beating are reclaimed
+    attempts = Column(Integer, nullable=False, default=0)  # Claims so far; the job fails after JOB_MAX_ATTEMPTS
+    created_date = Column(DateTime, default=datetime.utcnow)
+    started_date = Column(DateTime, nullable=True)
+    finished_date = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+
+class ReportJobItem(Base):
+    __tablename__ = 'report_job_items'
+    __table_args__ = (
+        Index('ix_report_job_items_job_status', 'job_id', 'status'),
+    )
+    
+    # One report of a job; marked done in the transaction that saves the report
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('report_jobs.id'), nullable=False)
+    position = Column(Integer, nullable=False)
+    item_key = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default='pending')  # pending, done, failed
+    client_info = Column(Text, nullable=False)  # JSON
+    payload = deferred(Column(Text, nullable=False))  # Allergen data, columnar payload (see payload_codec)
+    report_id = Column(Integer, ForeignKey('client_reports.id'), nullable=True)
+    error = Column(Text, nullable=True)
+
+def _migration_initial_tables(conn):
+    """Create the original tables (no-op on databases created before versioning)"""
+    tables = [SchemaVersion.__table__, Analysis.__table__, ClientReport.__table__, PortalSettings.__table__]
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+def _migration_lookup_indexes(conn):
+    """Add indexes used by report listings, filters and analysis history"""
+    indexed_columns = [
+        ClientReport.__table__.c.patient_id,
+        ClientReport.__table__.c.report_date,
+        ClientReport.__table__.c.is_active,
+        ClientReport.__table__.c.last_accessed,
+        Analysis.__table__.c.date_created,
+    ]
+    for column in indexed_columns:
+        for index in column.table.indexes:
+            if list(index.columns) == [column]:
+                index.create(conn, checkfirst=True)
+
+def _migration_access_events(conn):
+    """Create the access event log, seeded with each report's last recorded access"""
+    AccessEvent.__table__.create(conn, checkfirst=True)
+    reports = ClientReport.__table__
+    conn.execute(insert(AccessEvent.__table__).from_select(
+        ['report_id', 'accessed_at'],
+        select(reports.c.id, reports.c.last_accessed).where(reports.c.last_accessed.isnot(None))
+    ))
+
+def _migration_username_counters(conn):
+    """Create username counters, seeded from the usernames already in use"""
+    UsernameCounter.__table__.create(conn, checkfirst=True)
+    
+    # Usernames look like <name>_<year|unknown> with an optional _<n> suffix
+    pattern = re.compile(r'^(.+?_(?:\d{4}|unknown))(?:_(\d+))?$')
+    allocated = {}
+    for (username,) in conn.execute(select(ClientReport.__table__.c.username)):
+        match = pattern.match(username or '')
+        if not match:
+            continue
+        base_username, suffix = match.group(1), int(match.group(2) or 1)
+        allocated[base_username] = max(allocated.get(base_username, 0), suffix)
+    
+    if allocated:
+        conn.execute(insert(UsernameCounter.__table__), [
+            {'base_username': base_username, 'allocated': count}
+            for base_username, count in allocated.items()
+        ])
+
+def _advance_username_counter(conn, base_username, count):
+    """Add count to a base username's counter and return the new total"""
+    table = UsernameCounter.__table__
+    dialect_insert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(conn.dialect.name)
+    
+    if dialect_insert is not None:
+        statement = dialect_insert(table).values(base_username=base_username, allocated=count)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.base_username],
+            set_={'allocated': table.c.allocated + count}
+        ).returning(table.c.allocated)
+        return conn.execute(statement).scalar_one()
+    
+    # Other databases: row-locking update, inserting the counter on first use
+    updated = conn.execute(
+        update(table).where(table.c.base_username == base_username).values(allocated=table.c.allocated + count)
+    )
+    if updated.rowcount == 0:
+        conn.execute(insert(table).values(base_username=base_username, allocated=count))
+    return conn.execute(select(table.c.allocated).where(table.c.base_username == base_username)).scalar_one()
+
+def _migration_archive_keyset_indexes(conn):
+    """Add composite indexes matching the archive's keyset sort orders"""
+    reports = ClientReport.__table__
+    for name, columns in (
+        ('ix_client_reports_report_date_id', (reports.c.report_date, reports.c.id)),
+        ('ix_client_reports_patient_name_id', (reports.c.patient_name, reports.c.id)),
+    ):
+        # Index() attaches itself to the table, so reuse it when another database
+        # in this process was already migrated
+        index = next((index for index in reports.indexes if index.name == name), None)
+        if index is None:
+            index = Index(name, *columns)
+        index.create(conn, checkfirst=True)
+
+# Columns covered by the archive search index
+SEARCH_COLUMNS = ('patient_name', 'patient_id', 'practitioner', 'username')
+
+# Lower-cased concatenation of the searchable columns. PostgreSQL only uses the
+# trigram index when queries repeat this expression verbatim.
+SEARCH_DOCUMENT_SQL = "lower(" + " || ' ' || ".join(f"coalesce({name}, '')" for name in SEARCH_COLUMNS) + ")"
+
+def _migration_search_index(conn):
+    """
+    Add a search index over patient name, patient id, practitioner and username
+    
+    SQLite gets an external-content FTS5 table kept in sync by triggers (trigram
+    tokenizer for substring matches, unicode61 prefix tokens on older SQLite).
+    PostgreSQL gets a pg_trgm GIN index on the search document expression.
+    """
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{name}' for name in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{name}' for name in SEARCH_COLUMNS)
+    
+    if conn.dialect.name == 'sqlite':
+        for tokenizer in ("tokenize='trigram'", "tokenize='unicode61', prefix='2 3 4'"):
+            try:
+                with conn.begin_nested():
+                    conn.exec_driver_sql(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS client_reports_fts USING fts5("
+                        f"{columns}, content='client_reports', content_rowid='id', {tokenizer})"
+                    )
+                break
+            except Exception as e:
+                print(f"FTS5 tokenizer unavailable ({tokenizer}): {e}")
+        else:
+            print("SQLite FTS5 unavailable; archive search will use LIKE scans")
+            return
+        
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS client_reports_fts_ai AFTER INSERT ON client_reports BEGIN "
+            f"INSERT INTO client_reports_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS client_reports_fts_ad AFTER DELETE ON client_reports BEGIN "
+            f"INSERT INTO client_reports_fts(client_reports_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS client_reports_fts_au AFTER UPDATE OF {columns} ON client_reports BEGIN "
+            f"INSERT INTO client_reports_fts(client_reports_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO client_reports_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+        )
+        conn.exec_driver_sql("INSERT INTO client_reports_fts(client_reports_fts) VALUES ('rebuild')")
+    
+    elif conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        conn.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_client_reports_search_trgm ON client_reports "
+            f"USING gin (({SEARCH_DOCUMENT_SQL}) gin_trgm_ops)"
+        )
+
+def _migration_allergen_results(conn):
+    """Create the normalized allergen results table (filled by backfill_allergen_results)"""
+    AllergenResult.__table__.create(conn, checkfirst=True)
+
+def _migration_analytics_summaries(conn):
+    """Create the analytics summary tables, filled from the existing allergen results"""
+    ReportSummary.__table__.create(conn, checkfirst=True)
+    AllergenSummary.__table__.create(conn, checkfirst=True)
+    _rebuild_report_summaries(conn)
+
+def _migration_report_row_version(conn):
+    """Add the row_version column used to invalidate cached client reports"""
+    if 'row_version' not in {column['name'] for column in inspect(conn).get_columns('client_reports')}:
+        conn.exec_driver_sql("ALTER TABLE client_reports ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1")
+
+def _migration_login_throttle(conn):
+    """Create the shared login throttle state table"""
+    LoginThrottleState.__table__.create(conn, checkfirst=True)
+
+def _migration_report_jobs(conn):
+    """Create the background report job tables"""
+    ReportJob.__table__.create(conn, checkfirst=True)
+    ReportJobItem.__table__.create(conn, checkfirst=True)
+
+def _migration_report_job_attempts(conn):
+    """Add the attempts column that stops jobs from being retried forever"""
+    if 'attempts' not in {column['name'] for column in inspect(conn).get_columns('report_jobs')}:
+        conn.exec_driver_sql("ALTER TABLE report_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+def _migration_allergen_classifications(conn):
+    """Classify allergen results saved without a classification (lab exports) by IgG, then rebuild the summaries"""
+    results = AllergenResult.__table__
+    igg = func.coalesce(results.c.igg, 0.0)
+    conn.execute(update(results).where(results.c.classification.is_(None)).values(classification=case(
+        (igg >= HIGH_THRESHOLD, 'High'),
+        (igg >= MODERATE_THRESHOLD, 'Moderate'),
+        else_='Low'
+    )))
+    _rebuild_report_summaries(conn)
+
+def _migration_backfill_allergen_results(conn):
+    """
+    Fill allergen_results for reports saved before the table existed, then
+    rebuild the analytics summaries that migration 8 derived from it
+    """
+    summary = {'reports': 0, 'rows': 0, 'failed': []}
+    last_id = 0
+    while last_id is not None:
+        last_id = _backfill_allergen_results_batch(conn, last_id, BULK_INSERT_CHUNK_SIZE, False, summary)
+    
+    if summary['failed']:
+        print(f"Could not parse allergen data of {len(summary['failed'])} reports: {summary['failed']}")
+    _rebuild_report_summaries(conn)
+
+# Columns of client_reports whose changes clients can see; updating any of them bumps row_version
+ROW_VERSION_COLUMNS = [
+    column.name for column in ClientReport.__table__.columns
+    if column.name not in ('id', 'last_accessed', 'row_version')
+]
+
+def _migration_row_version_triggers(conn):
+    """
+    Bump row_version on every update of a client-visible column
+    
+    Updates that already set a new row_version (set_report_active) are left
+    alone. Other dialects rely on the writers bumping it themselves.
+    """
+    columns = ', '.join(ROW_VERSION_COLUMNS)
+    
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS client_reports_row_version AFTER UPDATE OF {columns} ON client_reports "
+            f"WHEN new.row_version = old.row_version BEGIN "
+            f"UPDATE client_reports SET row_version = old.row_version + 1 WHERE id = new.id; END"
+        )
+    
+    elif conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql(
+            "CREATE OR REPLACE FUNCTION client_reports_bump_row_version() RETURNS trigger AS $$ "
+            "BEGIN NEW.row_version := OLD.row_version + 1; RETURN NEW; END $$ LANGUAGE plpgsql"
+        )
+        conn.exec_driver_sql("DROP TRIGGER IF EXISTS client_reports_row_version ON client_reports")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER client_reports_row_version BEFORE UPDATE OF {columns} ON client_reports "
+            f"FOR EACH ROW WHEN (NEW.row_version = OLD.row_version) EXECUTE FUNCTION client_reports_bump_row_version()"
+        )
+
+# Ordered list of (version, description, migration function). Append new
+# migrations at the end; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, "Initial tables", _migration_initial_tables),
+    (2, "Indexes on client_reports and analyses lookup columns", _migration_lookup_indexes),
+    (3, "Report access event log", _migration_access_events),
+    (4, "Username suffix counters", _migration_username_counters),
+    (5, "Archive keyset pagination indexes", _migration_archive_keyset_indexes),
+    (6, "Archive search index", _migration_search_index),
+    (7, "Normalized allergen results", _migration_allergen_results),
+    (8, "Analytics summary tables", _migration_analytics_summaries),
+    (9, "Client report row versions", _migration_report_row_version),
+    (10, "Login throttle state", _migration_login_throttle),
+    (11, "Background report jobs", _migration_report_jobs),
+    (12, "Report job attempts", _migration_report_job_attempts),
+    (13, "Classify lab export allergen results", _migration_allergen_classifications),
+    (14, "Backfill allergen results of existing reports", _migration_backfill_allergen_results),
+    (15, "Client report row version triggers", _migration_row_version_triggers),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Return the applied schema version, or 0 for an empty/unversioned database"""
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return 0
+    return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+# Key of the PostgreSQL advisory lock that serializes migrations across processes
+MIGRATION_LOCK_KEY = 4815162342
+
+def _lock_migrations(conn):
+    """
+    Hold the cross-process migration lock until conn's transaction ends: a
+    transaction-scoped advisory lock on PostgreSQL. On SQLite the write lock
+    taken by write_transaction already serializes migrations.
+    """
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+
+def migrate_schema(engine):
+    """
+    Apply all pending migrations, each in its own transaction
+    
+    Each transaction takes the migration lock and re-reads the schema
+    version, so processes starting at the same time apply every migration
+    exactly once.
+    
+    Parameters:
+    -----------
+    engine : sqlalchemy.engine.Engine
+        Engine of the database to migrate
+    
+    Returns:
+    --------
+    int
+        Schema version after migrating
+    """
+    with engine.connect() as conn:
+        current_version = get_schema_version(conn)
+    
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        with write_transaction(engine) as conn:
+            _lock_migrations(conn)
+            # Another process may have applied it while this one waited for the lock
+            current_version = get_schema_version(conn)
+            if version <= current_version:
+                continue
+            
+            migration(conn)
+            conn.execute(insert(SchemaVersion.__table__).values(
+                version=version,
+                description=description,
+                applied_date=datetime.utcnow()
+            ))
+        print(f"Applied schema migration {version}: {description}")
+        current_version = version
+    
+    return current_version
+
+# Keys that hold the IgG level in allergen_data records, by report format
+ALLERGEN_IGG_KEYS = ('IgG_Level', 'IgG (µg/ml)', 'IgG')
+
+def _allergen_result_rows(report_id, allergen_records):
+    """
+    Build allergen_results rows from a report's allergen_data records
+    
+    Parameters:
+    -----------
+    report_id : int
+        Report the results belong to
+    allergen_records : list
+        Decoded allergen_data (list of dicts or payload_codec.ColumnarRecords)
+    
+    Returns:
+    --------
+    list
+        Row dictionaries for an executemany insert into allergen_results
+    """
+    rows = []
+    unclassified = []
+    for record in allergen_records or []:
+        if not isinstance(record, dict):
+            continue
+        
+        igg = next((record[key] for key in ALLERGEN_IGG_KEYS if record.get(key) is not None), None)
+        try:
+            igg = float(igg) if igg is not None else None
+        except (TypeError, ValueError):
+            igg = None
+        
+        # Lab exports have no Classification column; classify them by IgG like the result tables do
+        if 'Classification' in record:
+            classification = record['Classification'] if isinstance(record['Classification'], str) else 'Low'
+        else:
+            classification = None
+            unclassified.append(len(rows))
+        
+        rows.append({
+            'report_id': report_id,
+            'allergen': str(record.get('Allergen') or ''),
+            'category': record.get('Category'),
+            'igg': igg,
+            'classification': classification
+        })
+    
+    if unclassified:
+        levels = np.array([rows[position]['igg'] or 0.0 for position in unclassified])
+        for position, classification in zip(unclassified, classify_igg(levels)):
+            rows[position]['classification'] = classification
+    return rows
+
+def _backfill_allergen_results_batch(conn, last_id, batch_size, rebuild, summary):
+    """
+    Write the allergen_results rows of the next batch of reports after last_id
+    
+    Returns:
+    --------
+    int
+        Id of the last report processed, or None when there are no more reports
+    """
+    reports = ClientReport.__table__
+    results = AllergenResult.__table__
+    
+    statement = select(reports.c.id, reports.c.allergen_data).where(reports.c.id > last_id)
+    if not rebuild:
+        statement = statement.where(~select(results.c.id).where(results.c.report_id == reports.c.id).exists())
+    
+    batch = conn.execute(statement.order_by(reports.c.id).limit(batch_size)).all()
+    if not batch:
+        return None
+    
+    rows = []
+    for report_id, allergen_payload in batch:
+        try:
+            rows.extend(_allergen_result_rows(report_id, decode_payload(allergen_payload)))
+        except PayloadDecodeError as e:
+            print(f"Error parsing allergen data of report {report_id}: {e}")
+            summary['failed'].append(report_id)
+    
+    if rebuild:
+        conn.execute(results.delete().where(results.c.report_id.in_([row.id for row in batch])))
+    if rows:
+        conn.execute(insert(results), rows)
+    
+    summary['reports'] += len(batch)
+    summary['rows'] += len(rows)
+    return batch[-1].id
+
+def backfill_allergen_results(engine, batch_size=BULK_INSERT_CHUNK_SIZE, rebuild=False):
+    """
+    Fill allergen_results from the allergen_data of existing reports
+    
+    Reports are processed in id order, one transaction per batch, so an
+    interrupted run can simply be started again. By default only reports
+    without any result rows are processed.
+    
+    Parameters:
+    -----------
+    engine : sqlalchemy.engine.Engine
+        Engine of the database to backfill
+    batch_size : int
+        Reports per transaction
+    rebuild : bool
+        Delete and rewrite the results of every report
+    
+    Returns:
+    --------
+    dict
+        {'reports': reports processed, 'rows': result rows written,
+         'failed': ids of reports whose allergen_data could not be parsed}
+    """
+    summary = {'reports': 0, 'rows': 0, 'failed': []}
+    last_id = 0
+    
+    while last_id is not None:
+        with engine.begin() as conn:
+            last_id = _backfill_allergen_results_batch(conn, last_id, batch_size, rebuild, summary)
+    
+    return summary
+
+def _increment_counters(conn, table, key_columns, rows):
+    """Add each row's counter values to the matching summary row, creating it if needed"""
+    if not rows:
+        return
+    
+    counter_columns = [name for name in rows[0] if name not in key_columns]
+    dialect_insert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(conn.dialect.name)
+    
+    if dialect_insert is not None:
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[name] for name in key_columns],
+            set_={name: table.c[name] + statement.excluded[name] for name in counter_columns}
+        )
+        conn.execute(statement, rows)
+        return
+    
+    for row in rows:
+        key = [table.c[name] == row[name] for name in key_columns]
+        updated = conn.execute(
+            update(table).where(*key).values({name: table.c[name] + row[name] for name in counter_columns})
+        )
+        if updated.rowcount == 0:
+            conn.execute(insert(table).values(row))
+
+def _update_report_summaries(conn, reports):
+    """
+    Add newly saved reports to the analytics summary tables
+    
+    Parameters:
+    -----------
+    conn : sqlalchemy.engine.Connection
+        Connection of the transaction that saved the reports
+    reports : list
+        (practitioner, report_date, allergen_results rows) per report
+    """
+    report_counts = {}
+    allergen_counts = {}
+    for practitioner, report_date, result_rows in reports:
+        practitioner = practitioner or ''
+        month = report_date.strftime('%Y-%m')
+        report_counts[(practitioner, month)] = report_counts.get((practitioner, month), 0) + 1
+        
+        for row in result_rows:
+            key = (row['allergen'], practitioner, month)
+            counts = allergen_counts.setdefault(key, {'tested': 0, 'high': 0, 'moderate': 0, 'igg_total': 0.0})
+            counts['tested'] += 1
+            counts['high'] += row['classification'] == 'High'
+            counts['moderate'] += row['classification'] == 'Moderate'
+            counts['igg_total'] += row['igg'] or 0.0
+    
+    _increment_counters(conn, ReportSummary.__table__, ('practitioner', 'month'), [
+        {'practitioner': practitioner, 'month': month, 'reports': count}
+        for (practitioner, month), count in sorted(report_counts.items())
+    ])
+    _increment_counters(conn, AllergenSummary.__table__, ('allergen', 'practitioner', 'month'), [
+        dict(allergen=allergen, practitioner=practitioner, month=month, **counts)
+        for (allergen, practitioner, month), counts in sorted(allergen_counts.items())
+    ])
+
+def _month_expression(conn, column):
+    """SQL expression formatting a datetime column as YYYY-MM"""
+    if conn.dialect.name == 'postgresql':
+        month = func.to_char(column, 'YYYY-MM')
+    elif conn.dialect.name == 'sqlite':
+        month = func.strftime('%Y-%m', column)
+    else:
+        month = func.substr(cast(column, String), 1, 7)
+    return func.coalesce(month, '')
+
+def _rebuild_report_summaries(conn):
+    """Recompute both summary tables from client_reports and allergen_results"""
+    reports = ClientReport.__table__
+    results = AllergenResult.__table__
+    report_summaries = ReportSummary.__table__
+    allergen_summaries = AllergenSummary.__table__
+    
+    practitioner = func.coalesce(reports.c.practitioner, '')
+    month = _month_expression(conn, reports.c.report_date)
+    
+    conn.execute(report_summaries.delete())
+    conn.execute(allergen_summaries.delete())
+    
+    conn.execute(insert(report_summaries).from_select(
+        ['practitioner', 'month', 'reports'],
+        select(practitioner, month, func.count()).group_by(practitioner, month)
+    ))
+    conn.execute(insert(allergen_summaries).from_select(
+        ['allergen', 'practitioner', 'month', 'tested', 'high', 'moderate', 'igg_total'],
+        select(
+            results.c.allergen,
+            practitioner,
+            month,
+            func.count(),
+            func.sum(case((results.c.classification == 'High', 1), else_=0)),
+            func.sum(case((results.c.classification == 'Moderate', 1), else_=0)),
+            func.coalesce(func.sum(results.c.igg), 0.0)
+        ).select_from(results.join(reports, results.c.report_id == reports.c.id))
+        .group_by(results.c.allergen, practitioner, month)
+    ))
+
+def rebuild_report_summaries(engine):
+    """
+    Recompute the analytics summary tables from scratch in one transaction
+    
+    Run after backfilling allergen results, or whenever the summaries may
+    have drifted (e.g. after editing reports by hand).
+    
+    Returns:
+    --------
+    dict
+        {'report_summaries': rows, 'allergen_summaries': rows}
+    """
+    with engine.begin() as conn:
+        _rebuild_report_summaries(conn)
+        return {
+            'report_summaries': conn.execute(select(func.count()).select_from(ReportSummary.__table__)).scalar(),
+            'allergen_summaries': conn.execute(select(func.count()).select_from(AllergenSummary.__table__)).scalar()
+        }
+
+def _enable_sqlite_transactions(engine):
+    """
+    Make transactions on a SQLite engine start with a real BEGIN
+    
+    pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so under
+    engine.begin() the first SAVEPOINT would be the outermost one and its
+    RELEASE would commit. The driver's implicit transactions are switched off
+    and the BEGIN statement is emitted when SQLAlchemy begins; the
+    sqlite_begin execution option replaces it (see write_transaction).
+    """
+    @event.listens_for(engine, 'connect')
+    def disable_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, 'begin')
+    def emit_begin(conn):
+        conn.exec_driver_sql(conn.get_execution_options().get('sqlite_begin', 'BEGIN'))
+
+@contextmanager
+def write_transaction(engine):
+    """
+    Like engine.begin(), but on SQLite the database write lock is taken by
+    the BEGIN (BEGIN IMMEDIATE), so concurrent read-modify-write
+    transactions are serialized instead of reading the same state
+    """
+    with engine.connect() as conn:
+        conn.execution_options(sqlite_begin='BEGIN IMMEDIATE')
+        with conn.begin():
+            yield conn
+
+def _create_engine(db_url):
+    """Create an engine with pool settings suited to the database backend"""
+    if db_url.startswith('sqlite'):
+        # SQLite connections are shared between Streamlit script threads
+        engine = create_engine(db_url, connect_args={'check_same_thread': False})
+        _enable_sqlite_transactions(engine)
+        return engine
+    
+    return create_engine(
+        db_url,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=POOL_PRE_PING,
+        pool_recycle=POOL_RECYCLE
+    )
+
+def get_engine(db_url=DATABASE_URL):
+    """
+    Get the process-wide engine and scoped session factory for a database URL
+    
+    The engine, its connection pool and the session registry are created on the
+    first call for each URL and reused afterwards.
+    
+    Returns:
+    --------
+    tuple
+        (engine, scoped_session factory)
+    """
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine, _sessions[db_url]
+    
+    with _engine_lock:
+        if db_url not in _engines:
+            engine = _create_engine(db_url)
+            _sessions[db_url] = scoped_session(sessionmaker(bind=engine))
+            _engines[db_url] = engine
+        return _engines[db_url], _sessions[db_url]
+
+class AccessEventBuffer:
+    """
+    In-process write-behind buffer for report access events
+    
+    Views are appended to a list and written by a background thread in one
+    transaction per batch: the events are inserted into report_access_events
+    and client_reports.last_accessed is advanced to the newest event of each
+    report in the batch.
+    """
+    
+    def __init__(self, engine, batch_size=ACCESS_LOG_BATCH_SIZE,
+                 flush_interval=ACCESS_LOG_FLUSH_INTERVAL, max_pending=ACCESS_LOG_MAX_PENDING):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.dropped = 0  # Events discarded because the buffer was full
+    
+    def record(self, report_id, accessed_at=None):
+        """
+        Queue an access event; never touches the database
+        
+        If the writer falls behind by max_pending events, the oldest queued
+        events are dropped so the buffer stays bounded.
+        """
+        with self._lock:
+            if len(self._events) >= self.max_pending:
+                if not self.dropped:
+                    print(f"Access event writer is {len(self._events)} events behind; dropping the oldest")
+                overflow = len(self._events) - self.max_pending + 1
+                del self._events[:overflow]
+                self.dropped += overflow
+            self._events.append({
+                'report_id': report_id,
+                'accessed_at': accessed_at or datetime.utcnow()
+            })
+            pending = len(self._events)
+            
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="access-event-flusher", daemon=True)
+                self._thread.start()
+        
+        if pending >= self.batch_size:
+            self._wakeup.set()
+    
+    def pending(self):
+        """Number of events waiting to be written"""
+        with self._lock:
+            return len(self._events)
+    
+    def flush(self):
+        """
+        Write all pending events in a single transaction
+        
+        Returns:
+        --------
+        int
+            Number of events written
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            
+            if not events:
+                return 0
+            
+            latest = {}
+            for event in events:
+                if event['report_id'] not in latest or event['accessed_at'] > latest[event['report_id']]:
+                    latest[event['report_id']] = event['accessed_at']
+            
+            reports = ClientReport.__table__
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(AccessEvent.__table__), events)
+                    conn.execute(
+                        update(reports)
+                        .where(reports.c.id == bindparam('b_report_id'))
+                        .where((reports.c.last_accessed.is_(None)) | (reports.c.last_accessed < bindparam('b_accessed_at')))
+                        .values(last_accessed=bindparam('b_accessed_at')),
+                        [{'b_report_id': report_id, 'b_accessed_at': accessed_at} for report_id, accessed_at in latest.items()]
+                    )
+                invalidate_archive_stats(self.engine)
+                return len(events)
+            except Exception as e:
+                print(f"Error writing access events: {e}")
+                # Keep the events for the next attempt, dropping the oldest beyond the cap
+                with self._lock:
+                    self._events = (events + self._events)[-self.max_pending:]
+                return 0
+    
+    def stop(self, timeout=None):
+        """Stop the background writer thread and write the remaining events"""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+    
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+def describe_error(e):
+    """
+    Short description of a failure that is safe to show and store
+    
+    SQLAlchemy errors embed the SQL statement and its bound parameters
+    (generated passwords, patient details), so only the exception type and
+    the first line of the database driver's message are kept.
+    """
+    if isinstance(e, StatementError) and e.orig is not None:
+        e = e.orig
+    message = str(e).strip().splitlines()
+    return f"{type(e).__name__}: {message[0]}" if message else type(e).__name__
+
+def invalidate_archive_stats(engine):
+    """Drop the cached archive summary metrics of a database"""
+    _archive_stats_cache.pop(engine, None)
+
+def get_access_buffer(db_url=DATABASE_URL):
+    """Get the process-wide access event buffer for a database URL"""
+    buffer = _access_buffers.get(db_url)
+    if buffer is not None:
+        return buffer
+    
+    engine, _ = get_engine(db_url)
+    with _engine_lock:
+        if db_url not in _access_buffers:
+            _access_buffers[db_url] = AccessEventBuffer(engine)
+        return _access_buffers[db_url]
+
+@atexit.register
+def flush_access_events():
+    """Write all buffered access events (also runs at interpreter exit)"""
+    for buffer in list(_access_buffers.values()):
+        buffer.flush()
+
+def dispose_engines():
+    """Close all pooled connections, e.g. before forking worker processes"""
+    with _engine_lock:
+        buffers = list(_access_buffers.values())
+        _access_buffers.clear()
+    
+    # Stop the writer threads (writing their last events) before their engines
+    # go; joining them happens outside the lock
+    for buffer in buffers:
+        buffer.stop()
+    
+    with _engine_lock:
+        for db_url, engine in _engines.items():
+            _sessions[db_url].remove()
+            engine.dispose()
+        _engines.clear()
+        _sessions.clear()
+        _schema_versions.clear()
+        # Caches keyed by the disposed engines or their URLs
+        _search_backends.clear()
+        _archive_stats_cache.clear()
+
 class DatabaseManager:
     def __init__(self):
-        self.engine = None
-        self.Session = None
-        self.connected = False
+        self._engine = None
+        self._Session = None
+        self._connected = None  # None until the first connection attempt
         self.db_url = DATABASE_URL
-        
-        # Try to connect to the database
-        self.connect()
+    
+    def _connect_on_first_use(self):
+        # Connecting (and auto-migrating) is deferred to the first use, so importing
+        # db has no database side effects, e.g. for `python migrate.py --status`
+        if self._connected is None:
+            self.connect()
+    
+    @property
+    def engine(self):
+        self._connect_on_first_use()
+        return self._engine
+    
+    @property
+    def Session(self):
+        self._connect_on_first_use()
+        return self._Session
+    
+    @property
+    def connected(self):
+        self._connect_on_first_use()
+        return self._connected
     
     def connect(self, db_url=None):
         """Connect to the database using PostgreSQL or SQLite fallback"""
@@ -86,34 +1062,61 @@ class DatabaseManager:
                 self.db_url = postgres_url
         
         try:
-            # Create SQLAlchemy engine
-            self.engine = create_engine(self.db_url)
+            # Reuse the shared engine, pool and session registry for this URL
+            self._engine, self._Session = get_engine(self.db_url)
             
-            # Create session factory
-            self.Session = sessionmaker(bind=self.engine)
+            # After the first connect only the cached version stamp is checked
+            if _schema_versions.get(self.db_url) == SCHEMA_VERSION:
+                self._connected = True
+                return True
             
-            # Create tables if they don't exist
-            Base.metadata.create_all(self.engine)
-            
-            # Test connection
-            with self.engine.connect() as conn:
-                conn.execute(select(1))
-                self.connected = True
+            with _engine_lock:
+                if _schema_versions.get(self.db_url) != SCHEMA_VERSION:
+                    # Reading the version stamp also tests the connection
+                    with self._engine.connect() as conn:
+                        version = get_schema_version(conn)
+                    
+                    if version < SCHEMA_VERSION:
+                        if not AUTO_MIGRATE:
+                            raise RuntimeError(
+                                f"Database schema is at version {version}, expected {SCHEMA_VERSION}. "
+                                "Run `python migrate.py` to upgrade."
+                            )
+                        version = migrate_schema(self._engine)
+                    
+                    _schema_versions[self.db_url] = version
+                    
+                    if 'postgresql' in self.db_url:
+                        print("Connected to PostgreSQL cloud database")
+                    else:
+                        print(f"Connected to local SQLite database at: {DB_PATH}")
             
-            if 'postgresql' in self.db_url:
-                print("Connected to PostgreSQL cloud database")
-            else:
-                print(f"Connected to local SQLite database at: {DB_PATH}")
+            self._connected = True
             return True
         except Exception as e:
             print(f"Database connection error: {e}")
-            self.connected = False
+            self._connected = False
             return False
     
     def is_connected(self):
         """Check if the database is connected"""
         return self.connected
     
+    @contextmanager
+    def session_scope(self):
+        """
+        Provide the thread's scoped session, rolling back on error and
+        releasing it back to the registry when done
+        """
+        session = self.Session()
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self.Session.remove()
+    
     def save_analysis(self, name, description, rows, columns, image_filename, grid_params, results_df):
         """
         Save analysis results to the database
@@ -145,8 +1148,8 @@ class DatabaseManager:
             return None
         
         try:
-            # Convert dataframe to JSON
-            results_json = results_df.to_json(orient='records')
+            # Encode the results in the compact columnar format
+            results_payload = encode_payload(results_df)
             
             # Create a new Analysis object
             analysis = Analysis(
@@ -155,22 +1158,62 @@ class DatabaseManager:
                 rows=rows,
                 columns=columns,
                 image_filename=image_filename,
-                grid_params=json.dumps(grid_params),
-                results=results_json
+                grid_params=encode_payload(grid_params),
+                results=results_payload
             )
             
             # Save to database
-            session = self.Session()
-            session.add(analysis)
-            session.commit()
-            analysis_id = analysis.id
-            session.close()
+            with self.session_scope() as session:
+                session.add(analysis)
+                session.commit()
+                analysis_id = analysis.id
             
             return analysis_id
         except Exception as e:
             print(f"Error saving analysis: {e}")
             return None
     
+    def get_portal_setting(self, setting_name, default=None):
+        """
+        Get a portal setting value
+        
+        Returns:
+        --------
+        str
+            The stored value, or default if the setting is not stored
+        """
+        if not self.connected or self.Session is None:
+            return default
+        
+        try:
+            with self.session_scope() as session:
+                setting = session.query(PortalSettings.setting_value).filter(
+                    PortalSettings.setting_name == setting_name
+                ).first()
+            return setting[0] if setting else default
+        except Exception as e:
+            print(f"Error retrieving portal setting: {e}")
+            return default
+    
+    def save_portal_setting(self, setting_name, setting_value):
+        """Create or update a portal setting; returns True on success"""
+        if not self.connected or self.Session is None:
+            return False
+        
+        try:
+            with self.session_scope() as session:
+                setting = session.query(PortalSettings).filter(PortalSettings.setting_name == setting_name).first()
+                if setting is None:
+                    setting = PortalSettings(setting_name=setting_name)
+                    session.add(setting)
+                setting.setting_value = str(setting_value)
+                setting.updated_date = datetime.utcnow()
+                session.commit()
+            return True
+        except Exception as e:
+            print(f"Error saving portal setting: {e}")
+            return False
+    
     def get_analyses(self):
         """
         Get a list of all analyses
@@ -185,22 +1228,21 @@ class DatabaseManager:
             return []
         
         try:
-            session = self.Session()
-            analyses = session.query(Analysis).order_by(Analysis.date_created.desc()).all()
-            
-            result = []
-            for analysis in analyses:
-                result.append({
-                    'id': analysis.id,
-                    'name': analysis.name,
-                    'description': analysis.description,
-                    'date_created': analysis.date_created,
-                    'rows': analysis.rows,
-                    'columns': analysis.columns,
-                    'image_filename': analysis.image_filename
-                })
+            with self.session_scope() as session:
+                analyses = session.query(Analysis).order_by(Analysis.date_created.desc()).all()
+                
+                result = []
+                for analysis in analyses:
+                    result.append({
+                        'id': analysis.id,
+                        'name': analysis.name,
+                        'description': analysis.description,
+                        'date_created': analysis.date_created,
+                        'rows': analysis.rows,
+                        'columns': analysis.columns,
+                        'image_filename': analysis.image_filename
+                    })
             
-            session.close()
             return result
         except Exception as e:
             print(f"Error retrieving analyses: {e}")
@@ -225,36 +1267,35 @@ class DatabaseManager:
             return None
         
         try:
-            session = self.Session()
-            analysis = session.query(Analysis).filter(Analysis.id == analysis_id).first()
-            
-            if not analysis:
-                return None
-            
-            # Parse JSON data
-            grid_params = json.loads(str(analysis.grid_params))
-            results = json.loads(str(analysis.results))
-            
-            result = {
-                'id': analysis.id,
-                'name': analysis.name,
-                'description': analysis.description,
-                'date_created': analysis.date_created,
-                'rows': analysis.rows,
-                'columns': analysis.columns,
-                'image_filename': analysis.image_filename,
-                'grid_params': grid_params,
-                'results': results
-            }
+            with self.session_scope() as session:
+                analysis = session.query(Analysis).filter(Analysis.id == analysis_id).first()
+                
+                if not analysis:
+                    return None
+                
+                # Decode stored payloads (results are decoded lazily on access)
+                grid_params = decode_payload(analysis.grid_params)
+                results = decode_payload(analysis.results)
+                
+                result = {
+                    'id': analysis.id,
+                    'name': analysis.name,
+                    'description': analysis.description,
+                    'date_created': analysis.date_created,
+                    'rows': analysis.rows,
+                    'columns': analysis.columns,
+                    'image_filename': analysis.image_filename,
+                    'grid_params': grid_params,
+                    'results': results
+                }
             
-            session.close()
             return result
         except Exception as e:
             print(f"Error retrieving analysis: {e}")
             return None
     
-    def generate_client_credentials(self, client_info):
-        """Generate unique username and password for client access"""
+    def get_base_username(self, client_info):
+        """Build the username before any duplicate suffix, e.g. 'johndoe_1990'"""
         # Extract name and birth year from client info
         name = client_info.get('name', 'client').replace(' ', '').lower()
         dob = client_info.get('dob', '')
@@ -319,27 +1360,43 @@ class DatabaseManager:
                 birth_year = ""
         
         # Create base username
-        base_username = f"{name}_{birth_year}" if birth_year else f"{name}_unknown"
+        return f"{name}_{birth_year}" if birth_year else f"{name}_unknown"
+    
+    def reserve_usernames(self, base_username, count=1):
+        """
+        Atomically reserve count unique usernames for a base username
         
-        # Check for duplicates and add numerical suffix if needed
-        username = base_username
-        counter = 2
+        The per-base counter in username_counters is advanced with a single
+        upsert, so concurrent sessions never receive the same name. The first
+        name for a base is the base itself, later ones get _2, _3, ...
         
-        if self.connected and self.Session:
-            session = self.Session()
-            while True:
-                existing = session.query(ClientReport).filter_by(username=username).first()
-                if not existing:
-                    break
-                username = f"{base_username}_{counter}"
-                counter += 1
-            session.close()
-        
-        # Generate a secure password
+        Returns:
+        --------
+        list
+            Reserved usernames in allocation order
+        """
+        with self.engine.begin() as conn:
+            last = _advance_username_counter(conn, base_username, count)
+        
+        return [
+            base_username if sequence == 1 else f"{base_username}_{sequence}"
+            for sequence in range(last - count + 1, last + 1)
+        ]
+    
+    def generate_password(self):
+        """Generate a secure password"""
         alphabet = string.ascii_letters + string.digits
-        password = ''.join(secrets.choice(alphabet) for _ in range(8))
+        return ''.join(secrets.choice(alphabet) for _ in range(8))
+    
+    def generate_client_credentials(self, client_info):
+        """Generate unique username and password for client access"""
+        username = self.get_base_username(client_info)
+        
+        # Add a numerical suffix if the name is already taken
+        if self.connected and self.Session:
+            username = self.reserve_usernames(username)[0]
         
-        return username, password
+        return username, self.generate_password()
     
     def save_client_report(self, client_info, pdf_data, allergen_data):
         """
@@ -366,10 +1423,11 @@ class DatabaseManager:
             # Generate unique credentials
             username, password = self.generate_client_credentials(client_info)
             
-            # Convert allergen data to JSON
-            allergen_json = allergen_data.to_json(orient='records')
+            # Encode allergen data in the compact columnar format
+            allergen_payload = encode_payload(allergen_data)
             
             # Create new client report record
+            report_date = datetime.utcnow()
             client_report = ClientReport(
                 patient_id=client_info.get('patient_id', ''),
                 patient_name=client_info.get('name', ''),
@@ -379,18 +1437,26 @@ class DatabaseManager:
                 dob=client_info.get('dob', ''),
                 specimen_type=client_info.get('specimen', ''),
                 email=client_info.get('email', ''),
+                report_date=report_date,
                 pdf_data=pdf_data,
-                allergen_data=allergen_json,
+                allergen_data=allergen_payload,
                 username=username,
                 password=password
             )
             
-            # Save to database
-            session = self.Session()
-            session.add(client_report)
-            session.commit()
-            report_id = client_report.id
-            session.close()
+            # Save the report, its normalized results and the analytics summaries in one transaction
+            with self.session_scope() as session:
+                session.add(client_report)
+                session.flush()
+                report_id = client_report.id
+                result_rows = _allergen_result_rows(report_id, decode_payload(allergen_payload))
+                if result_rows:
+                    session.execute(insert(AllergenResult.__table__), result_rows)
+                _update_report_summaries(session.connection(), [
+                    (client_report.practitioner, report_date, result_rows)
+                ])
+                session.commit()
+            invalidate_archive_stats(self.engine)
             
             return {
                 'report_id': report_id,
@@ -403,70 +1469,861 @@ class DatabaseManager:
             print(f"Error saving client report: {e}")
             return None
     
-    def get_all_client_reports(self):
-        """Get all client reports for archive view"""
+    def save_client_reports_bulk(self, records, chunk_size=BULK_INSERT_CHUNK_SIZE, on_insert=None):
+        """
+        Save many client reports in a single transaction
+        
+        Rows are inserted with executemany in chunks of chunk_size. A chunk that
+        fails is rolled back to its savepoint and retried row by row, so one bad
+        record does not lose the rest of the batch.
+        
+        Parameters:
+        -----------
+        records : list
+            Dictionaries with 'client_info', 'pdf_data' and 'allergen_data'
+            (the same arguments as save_client_report)
+        chunk_size : int
+            Number of rows per executemany batch
+        on_insert : callable
+            Called as on_insert(conn, [(index, report_id), ...]) in the same
+            savepoint as the inserted rows, to record them atomically elsewhere
+        
+        Returns:
+        --------
+        dict
+            {'saved': [...], 'failed': [...]}. Saved entries have the same keys
+            as save_client_report plus 'index'; failed entries have 'index',
+            'patient_name' and 'error'. Indexes refer to positions in records.
+        """
+        result = {'saved': [], 'failed': []}
         if not self.connected or self.Session is None:
-            return []
+            result['failed'] = [
+                {'index': idx, 'patient_name': record['client_info'].get('name', ''), 'error': "Not connected to database"}
+                for idx, record in enumerate(records)
+            ]
+            return result
         
+        # Reserve usernames with one counter update per distinct base name
+        base_usernames = {}
+        for idx, record in enumerate(records):
+            try:
+                base_usernames[idx] = self.get_base_username(record['client_info'])
+            except Exception as e:
+                print(f"Error preparing client report {idx}: {e}")
+                result['failed'].append({'index': idx, 'patient_name': record['client_info'].get('name', ''), 'error': describe_error(e)})
+        
+        reserved = {}
         try:
-            session = self.Session()
-            reports = session.query(ClientReport).order_by(ClientReport.report_date.desc()).all()
-            
-            result = []
-            for report in reports:
-                result.append({
-                    'id': report.id,
-                    'patient_name': report.patient_name,
-                    'patient_id': report.patient_id,
-                    'report_date': report.report_date,
-                    'practitioner': report.practitioner,
-                    'username': report.username,
-                    'password': report.password,
-                    'is_active': report.is_active,
-                    'last_accessed': report.last_accessed
-                })
+            for base_username in set(base_usernames.values()):
+                count = sum(1 for base in base_usernames.values() if base == base_username)
+                reserved[base_username] = iter(self.reserve_usernames(base_username, count))
+        except Exception as e:
+            print(f"Error reserving usernames: {e}")
+            result['failed'] = [
+                {'index': idx, 'patient_name': record['client_info'].get('name', ''), 'error': describe_error(e)}
+                for idx, record in enumerate(records)
+            ]
+            return result
+        
+        # Build rows and credentials up front; invalid records fail individually
+        rows = []
+        allergen_records = {}
+        report_date = datetime.utcnow()
+        for idx, record in enumerate(records):
+            if idx not in base_usernames:
+                continue
+            client_info = record['client_info']
+            try:
+                username = next(reserved[base_usernames[idx]])
+                password = self.generate_password()
+                allergen_payload = encode_payload(record['allergen_data'])
+                allergen_records[idx] = decode_payload(allergen_payload)
+                rows.append((idx, {
+                    'patient_id': client_info.get('patient_id', ''),
+                    'patient_name': client_info.get('name', ''),
+                    'practitioner': client_info.get('practitioner', ''),
+                    'collection_date': client_info.get('collection_date', ''),
+                    'gender': client_info.get('gender', ''),
+                    'dob': client_info.get('dob', ''),
+                    'specimen_type': client_info.get('specimen', ''),
+                    'email': client_info.get('email', ''),
+                    'report_date': report_date,
+                    'pdf_data': record['pdf_data'],
+                    'allergen_data': allergen_payload,
+                    'username': username,
+                    'password': password
+                }))
+            except Exception as e:
+                print(f"Error preparing client report {idx}: {e}")
+                result['failed'].append({'index': idx, 'patient_name': client_info.get('name', ''), 'error': describe_error(e)})
+        
+        table = ClientReport.__table__
+        statement = insert(table).returning(table.c.id, table.c.username)
+        inserted = []
+        
+        def insert_results(conn, saved):
+            """Write the allergen_results rows and summary counts of (idx, row, report_id) triples"""
+            result_rows = []
+            summaries = []
+            for idx, row, report_id in saved:
+                report_rows = _allergen_result_rows(report_id, allergen_records[idx])
+                result_rows.extend(report_rows)
+                summaries.append((row['practitioner'], report_date, report_rows))
+            if result_rows:
+                conn.execute(insert(AllergenResult.__table__), result_rows)
+            _update_report_summaries(conn, summaries)
+            if on_insert is not None:
+                on_insert(conn, [(idx, report_id) for idx, _, report_id in saved])
+        
+        try:
+            with self.engine.begin() as conn:
+                for start in range(0, len(rows), chunk_size):
+                    chunk = rows[start:start + chunk_size]
+                    try:
+                        with conn.begin_nested():
+                            ids = conn.execute(statement, [row for _, row in chunk]).all()
+                            ids_by_username = {r.username: r.id for r in ids}
+                            insert_results(conn, [(idx, row, ids_by_username[row['username']]) for idx, row in chunk])
+                        inserted.extend((idx, row, ids_by_username[row['username']]) for idx, row in chunk)
+                    except Exception:
+                        # Isolate the failing rows
+                        for idx, row in chunk:
+                            try:
+                                with conn.begin_nested():
+                                    report_id = conn.execute(statement, [row]).all()[0].id
+                                    insert_results(conn, [(idx, row, report_id)])
+                                inserted.append((idx, row, report_id))
+                            except Exception as e:
+                                print(f"Error saving client report {idx}: {e}")
+                                result['failed'].append({'index': idx, 'patient_name': row['patient_name'], 'error': describe_error(e)})
+        except Exception as e:
+            print(f"Error saving client reports: {e}")
+            failed_indexes = {failure['index'] for failure in result['failed']}
+            result['failed'].extend(
+                {'index': idx, 'patient_name': row['patient_name'], 'error': describe_error(e)}
+                for idx, row in rows if idx not in failed_indexes
+            )
+            result['failed'].sort(key=lambda failure: failure['index'])
+            return result
+        
+        if inserted:
+            invalidate_archive_stats(self.engine)
+        
+        for idx, row, report_id in sorted(inserted, key=lambda item: item[0]):
+            result['saved'].append({
+                'index': idx,
+                'report_id': report_id,
+                'username': row['username'],
+                'password': row['password'],
+                'patient_name': row['patient_name'],
+                'patient_id': row['patient_id']
+            })
+        result['failed'].sort(key=lambda failure: failure['index'])
+        return result
+    
+    def _report_summary(self, report):
+        """Metadata of a report row as shown in archive listings"""
+        return {
+            'id': report.id,
+            'patient_name': report.patient_name,
+            'patient_id': report.patient_id,
+            'report_date': report.report_date,
+            'practitioner': report.practitioner,
+            'dob': report.dob,
+            'gender': report.gender,
+            'username': report.username,
+            'password': report.password,
+            'is_active': report.is_active,
+            'last_accessed': report.last_accessed
+        }
+    
+    def query_client_reports(self, search=None, status='all', sort='newest', after_cursor=None, limit=50):
+        """
+        Get one page of client reports with filtering and sorting done in SQL
+        
+        Pages are keyset-paginated: pass the returned next_cursor to get the
+        following page. Cursors are only valid for the same search, status
+        and sort.
+        
+        Parameters:
+        -----------
+        search : str
+            Case-insensitive substring of the patient name, patient ID,
+            practitioner or username
+        status : str
+            One of ARCHIVE_STATUSES
+        sort : str
+            One of the keys of ARCHIVE_SORTS
+        after_cursor : str
+            Cursor of the previous page, or None for the first page
+        limit : int
+            Maximum number of reports per page
+        
+        Returns:
+        --------
+        dict
+            {'reports': list of report dicts, 'next_cursor': str or None}
+        """
+        empty = {'reports': [], 'next_cursor': None}
+        if not self.connected or self.Session is None:
+            return empty
+        
+        if sort not in ARCHIVE_SORTS:
+            raise ValueError(f"Unknown sort order: {sort}")
+        if status not in ARCHIVE_STATUSES:
+            raise ValueError(f"Unknown status filter: {status}")
+        
+        sort_name, direction = ARCHIVE_SORTS[sort]
+        sort_column = getattr(ClientReport, sort_name)
+        
+        try:
+            with self.session_scope() as session:
+                query = session.query(ClientReport)
+                
+                if search and search.strip():
+                    query = query.filter(self._search_filter(search.strip()))
+                
+                if status == 'active':
+                    query = query.filter(ClientReport.is_active == True)
+                elif status == 'inactive':
+                    query = query.filter(ClientReport.is_active == False)
+                elif status == 'accessed':
+                    query = query.filter(ClientReport.last_accessed.isnot(None))
+                elif status == 'not_accessed':
+                    query = query.filter(ClientReport.last_accessed.is_(None))
+                
+                if after_cursor:
+                    sort_value, report_id = self._decode_cursor(after_cursor, sort_name)
+                    keyset = tuple_(sort_column, ClientReport.id)
+                    if direction == 'desc':
+                        query = query.filter(keyset < tuple_(sort_value, report_id))
+                    else:
+                        query = query.filter(keyset > tuple_(sort_value, report_id))
+                
+                if direction == 'desc':
+                    query = query.order_by(sort_column.desc(), ClientReport.id.desc())
+                else:
+                    query = query.order_by(sort_column.asc(), ClientReport.id.asc())
+                
+                # Fetch one extra row to know whether another page follows
+                reports = query.limit(limit + 1).all()
+                
+                next_cursor = None
+                if len(reports) > limit:
+                    reports = reports[:limit]
+                    last = reports[-1]
+                    next_cursor = self._encode_cursor(getattr(last, sort_name), last.id)
+                
+                result = [self._report_summary(report) for report in reports]
+            
+            return {'reports': result, 'next_cursor': next_cursor}
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error querying client reports: {e}")
+            return empty
+    
+    def _search_backend(self):
+        """Return 'trigram' or 'unicode61' for the SQLite FTS5 index, 'pg_trgm' or None"""
+        if self.db_url not in _search_backends:
+            backend = None
+            with self.engine.connect() as conn:
+                if conn.dialect.name == 'sqlite':
+                    ddl = conn.exec_driver_sql(
+                        "SELECT sql FROM sqlite_master WHERE name = 'client_reports_fts'"
+                    ).scalar()
+                    if ddl:
+                        backend = 'trigram' if 'trigram' in ddl else 'unicode61'
+                elif conn.dialect.name == 'postgresql':
+                    backend = 'pg_trgm'
+            _search_backends[self.db_url] = backend
+        return _search_backends[self.db_url]
+    
+    def _search_filter(self, search):
+        """
+        Build the WHERE clause for a case-insensitive substring/prefix search
+        over SEARCH_COLUMNS, using the search index where available
+        """
+        backend = self._search_backend()
+        term = search.lower()
+        like_pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        
+        if backend == 'pg_trgm':
+            return text(f"{SEARCH_DOCUMENT_SQL} LIKE :like_pattern ESCAPE '\\'").bindparams(like_pattern=like_pattern)
+        
+        fts_query = None
+        if backend == 'trigram' and len(term) >= 3:
+            # One phrase matches the term as a substring of any column
+            fts_query = '"' + term.replace('"', '""') + '"'
+        elif backend == 'unicode61':
+            # Every word must be a prefix of a token
+            tokens = re.findall(r'\w+', term)
+            if tokens:
+                fts_query = ' AND '.join(f'"{token}"*' for token in tokens)
+        
+        if fts_query is not None:
+            matching_ids = select(text('rowid')).select_from(text('client_reports_fts')).where(
+                text('client_reports_fts MATCH :fts_query').bindparams(fts_query=fts_query)
+            )
+            return ClientReport.id.in_(matching_ids)
+        
+        # Short terms (or no index): scan with LIKE
+        return or_(*[
+            func.lower(getattr(ClientReport, name)).like(like_pattern, escape='\\')
+            for name in SEARCH_COLUMNS
+        ])
+    
+    @staticmethod
+    def _encode_cursor(sort_value, report_id):
+        if isinstance(sort_value, datetime):
+            sort_value = sort_value.isoformat()
+        payload = json.dumps([sort_value, report_id]).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+    
+    @staticmethod
+    def _decode_cursor(cursor, sort_name):
+        try:
+            sort_value, report_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if sort_name == 'report_date':
+                sort_value = datetime.fromisoformat(sort_value)
+            return sort_value, int(report_id)
+        except Exception:
+            raise ValueError("Invalid pagination cursor")
+    
+    def get_archive_stats(self):
+        """
+        Get the archive summary metrics with a single aggregate query
+        
+        The result is cached in-process and invalidated by report saves,
+        activation changes and access event flushes.
+        
+        Returns:
+        --------
+        dict
+            Counts for 'total', 'active', 'accessed' and 'this_week'
+        """
+        empty = {'total': 0, 'active': 0, 'accessed': 0, 'this_week': 0}
+        if not self.connected or self.Session is None:
+            return empty
+        
+        cached = _archive_stats_cache.get(self.engine)
+        if cached and time.monotonic() - cached[0] < ARCHIVE_STATS_TTL:
+            return dict(cached[1])
+        
+        # Reports less than 8 days old, i.e. at most 7 whole days ago
+        week_start = datetime.now() - timedelta(days=8)
+        
+        try:
+            with self.session_scope() as session:
+                row = session.query(
+                    func.count(ClientReport.id),
+                    func.sum(case((ClientReport.is_active == True, 1), else_=0)),
+                    func.count(ClientReport.last_accessed),
+                    func.sum(case((ClientReport.report_date > week_start, 1), else_=0))
+                ).one()
+            
+            stats = {
+                'total': row[0] or 0,
+                'active': row[1] or 0,
+                'accessed': row[2] or 0,
+                'this_week': row[3] or 0
+            }
+            _archive_stats_cache[self.engine] = (time.monotonic(), stats)
+            return dict(stats)
+        except Exception as e:
+            print(f"Error retrieving archive stats: {e}")
+            return empty
+    
+    def find_reports_by_allergen(self, allergen, classification=None, active_only=True, limit=500):
+        """
+        Find reports with a result for an allergen, using allergen_results
+        
+        Parameters:
+        -----------
+        allergen : str
+            Allergen name (exact match)
+        classification : str
+            Only results with this classification (e.g. 'High')
+        active_only : bool
+            Skip deactivated reports
+        limit : int
+            Maximum number of reports returned
+        
+        Returns:
+        --------
+        list
+            Report summaries (same keys as query_client_reports) with the
+            matching 'igg' and 'classification', highest IgG first
+        """
+        if not self.connected or self.Session is None:
+            return []
+        
+        try:
+            with self.session_scope() as session:
+                query = session.query(ClientReport, AllergenResult.igg, AllergenResult.classification).join(
+                    AllergenResult, AllergenResult.report_id == ClientReport.id
+                ).filter(AllergenResult.allergen == allergen)
+                if classification is not None:
+                    query = query.filter(AllergenResult.classification == classification)
+                if active_only:
+                    query = query.filter(ClientReport.is_active == True)
+                
+                rows = query.order_by(AllergenResult.igg.desc(), ClientReport.id).limit(limit).all()
+                return [
+                    dict(self._report_summary(report), igg=igg, classification=result_classification)
+                    for report, igg, result_classification in rows
+                ]
+        except Exception as e:
+            print(f"Error finding reports by allergen: {e}")
+            return []
+    
+    def get_category_igg_averages(self, active_only=True):
+        """
+        Average IgG per allergen category across all reports
+        
+        Returns:
+        --------
+        list
+            Dictionaries with 'category', 'reports', 'results' and
+            'average_igg', sorted by category
+        """
+        if not self.connected or self.Session is None:
+            return []
+        
+        try:
+            with self.session_scope() as session:
+                query = session.query(
+                    AllergenResult.category,
+                    func.count(func.distinct(AllergenResult.report_id)),
+                    func.count(AllergenResult.id),
+                    func.avg(AllergenResult.igg)
+                )
+                if active_only:
+                    query = query.join(ClientReport, AllergenResult.report_id == ClientReport.id).filter(
+                        ClientReport.is_active == True
+                    )
+                rows = query.group_by(AllergenResult.category).order_by(AllergenResult.category).all()
+                return [
+                    {'category': category, 'reports': reports, 'results': results, 'average_igg': average_igg}
+                    for category, reports, results, average_igg in rows
+                ]
+        except Exception as e:
+            print(f"Error computing category averages: {e}")
+            return []
+    
+    def get_allergen_prevalence(self, group_by='allergen', allergen=None, practitioner=None):
+        """
+        High/Moderate prevalence from the pre-aggregated analytics summaries
+        
+        The query only reads allergen_summaries, whose size depends on the
+        number of allergens, practitioners and months rather than on the
+        number of reports.
+        
+        Parameters:
+        -----------
+        group_by : str
+            One of ANALYTICS_GROUPINGS
+        allergen : str
+            Only count results for this allergen
+        practitioner : str
+            Only count reports of this practitioner ('' for reports without one)
+        
+        Returns:
+        --------
+        list
+            Dictionaries with the group_by key plus 'tested', 'high',
+            'moderate', 'high_rate', 'moderate_rate' and 'average_igg'
+        """
+        if group_by not in ANALYTICS_GROUPINGS:
+            raise ValueError(f"Unknown analytics grouping: {group_by}")
+        if not self.connected or self.Session is None:
+            return []
+        
+        summaries = AllergenSummary.__table__
+        group_column = summaries.c[group_by]
+        statement = select(
+            group_column,
+            func.sum(summaries.c.tested),
+            func.sum(summaries.c.high),
+            func.sum(summaries.c.moderate),
+            func.sum(summaries.c.igg_total)
+        ).group_by(group_column).order_by(group_column)
+        if allergen is not None:
+            statement = statement.where(summaries.c.allergen == allergen)
+        if practitioner is not None:
+            statement = statement.where(summaries.c.practitioner == practitioner)
+        
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(statement).all()
+        except Exception as e:
+            print(f"Error retrieving allergen prevalence: {e}")
+            return []
+        
+        return [
+            {
+                group_by: key,
+                'tested': tested,
+                'high': high,
+                'moderate': moderate,
+                'high_rate': high / tested if tested else 0.0,
+                'moderate_rate': moderate / tested if tested else 0.0,
+                'average_igg': igg_total / tested if tested else 0.0
+            }
+            for key, tested, high, moderate, igg_total in rows
+        ]
+    
+    def get_report_counts(self, group_by='month'):
+        """
+        Number of reports per practitioner or per month, from report_summaries
+        
+        Returns:
+        --------
+        list
+            Dictionaries with the group_by key and 'reports'
+        """
+        if group_by not in ('practitioner', 'month'):
+            raise ValueError(f"Unknown report grouping: {group_by}")
+        if not self.connected or self.Session is None:
+            return []
+        
+        summaries = ReportSummary.__table__
+        group_column = summaries.c[group_by]
+        statement = select(group_column, func.sum(summaries.c.reports)).group_by(group_column).order_by(group_column)
+        
+        try:
+            with self.engine.connect() as conn:
+                return [{group_by: key, 'reports': reports} for key, reports in conn.execute(statement)]
+        except Exception as e:
+            print(f"Error retrieving report counts: {e}")
+            return []
+    
+    def set_report_active(self, report_id, is_active):
+        """
+        Activate or deactivate a client report's portal access
+        
+        Returns:
+        --------
+        bool
+            True if the report was updated
+        """
+        if not self.connected or self.Session is None:
+            return False
+        
+        reports = ClientReport.__table__
+        statement = update(reports).where(reports.c.id == report_id).values(
+            is_active=bool(is_active),
+            row_version=reports.c.row_version + 1
+        )
+        
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(statement).rowcount
+            invalidate_archive_stats(self.engine)
+            return updated > 0
+        except Exception as e:
+            print(f"Error updating report status: {e}")
+            return False
+    
+    def get_report_version(self, report_id):
+        """
+        Current row_version of an active report
+        
+        Returns:
+        --------
+        int
+            The row version, or None if the report is missing or inactive
+        """
+        if not self.connected or self.Session is None:
+            return None
+        
+        reports = ClientReport.__table__
+        try:
+            with self.engine.connect() as conn:
+                return conn.execute(
+                    select(reports.c.row_version).where(reports.c.id == report_id, reports.c.is_active == True)
+                ).scalar()
+        except Exception as e:
+            print(f"Error retrieving report version: {e}")
+            return None
+    
+    def iter_report_summaries(self, chunk_size=1000):
+        """
+        Stream the metadata of all client reports in chunks, newest first
+        
+        Rows are fetched with a server-side cursor where the database supports
+        it, so memory use depends on chunk_size rather than on the archive
+        size. A dedicated connection is used so other calls on this thread
+        can run between chunks.
+        
+        Yields:
+        -------
+        list
+            Up to chunk_size report dicts (same keys as get_all_client_reports)
+        """
+        if not self.connected or self.Session is None:
+            return
+        
+        reports = ClientReport.__table__
+        columns = [reports.c[name] for name in (
+            'id', 'patient_name', 'patient_id', 'report_date', 'practitioner', 'dob',
+            'gender', 'username', 'password', 'is_active', 'last_accessed'
+        )]
+        statement = select(*columns).order_by(reports.c.report_date.desc(), reports.c.id.desc())
+        
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+            for partition in result.partitions():
+                yield [dict(row._mapping) for row in partition]
+    
+    def get_all_client_reports(self):
+        """Get all client reports for archive view"""
+        if not self.connected or self.Session is None:
+            return []
+        
+        try:
+            with self.session_scope() as session:
+                reports = session.query(ClientReport).order_by(ClientReport.report_date.desc()).all()
+                
+                result = [self._report_summary(report) for report in reports]
             
-            session.close()
             return result
         except Exception as e:
             print(f"Error retrieving client reports: {e}")
             return []
     
-    def get_client_report(self, username, password):
-        """Authenticate and retrieve client report"""
+    def get_client_report(self, username, password, include_pdf=False, include_allergen_data=True):
+        """
+        Authenticate and retrieve client report
+        
+        The PDF is only loaded when include_pdf is set; use get_report_pdf or
+        iter_report_pdf to fetch it separately.
+        """
         if not self.connected or self.Session is None:
             return None
         
         try:
-            session = self.Session()
-            report = session.query(ClientReport).filter_by(
-                username=username, 
-                password=password, 
-                is_active=True
-            ).first()
+            with self.session_scope() as session:
+                query = session.query(ClientReport)
+                if include_pdf:
+                    query = query.options(undefer(ClientReport.pdf_data))
+                if include_allergen_data:
+                    query = query.options(undefer(ClientReport.allergen_data))
+                
+                report = query.filter_by(
+                    username=username, 
+                    password=password, 
+                    is_active=True
+                ).first()
+                
+                if report:
+                    self.record_access(report.id)
+                    
+                    # Return report data
+                    result = {
+                        'id': report.id,
+                        'patient_name': report.patient_name,
+                        'patient_id': report.patient_id,
+                        'report_date': report.report_date
+                    }
+                    if include_pdf:
+                        result['pdf_data'] = report.pdf_data
+                    if include_allergen_data:
+                        result['allergen_data'] = decode_payload(report.allergen_data)
+                    return result
             
-            if report:
-                # Update last accessed time
-                report.last_accessed = datetime.utcnow()
-                session.commit()
+            return None
+        except Exception as e:
+            print(f"Error retrieving client report: {e}")
+            return None
+    
+    def authenticate(self, username, password):
+        """
+        Check client credentials without loading or modifying the report
+        
+        Only the id and password of the active report are read, through the
+        unique index on username.
+        
+        Returns:
+        --------
+        dict
+            {'report_id': int, 'role': 'client'}, or None if the credentials are invalid
+        """
+        if not self.connected or self.Session is None:
+            return None
+        
+        try:
+            with self.session_scope() as session:
+                row = session.query(ClientReport.id, ClientReport.password).filter(
+                    ClientReport.username == username,
+                    ClientReport.is_active == True
+                ).first()
+            
+            if row and secrets.compare_digest(str(row.password), str(password)):
+                return {'report_id': row.id, 'role': 'client'}
+            return None
+        except Exception as e:
+            print(f"Error authenticating client: {e}")
+            return None
+    
+    def get_client_report_by_id(self, report_id, include_pdf=False):
+        """
+        Retrieve an active client report after authentication
+        
+        Parameters:
+        -----------
+        report_id : int
+            ID returned by authenticate
+        include_pdf : bool
+            Also load the PDF binary data
+        
+        Returns:
+        --------
+        dict
+            Report metadata and parsed allergen data, or None if not found
+        """
+        if not self.connected or self.Session is None:
+            return None
+        
+        try:
+            with self.session_scope() as session:
+                query = session.query(ClientReport).options(undefer(ClientReport.allergen_data))
+                if include_pdf:
+                    query = query.options(undefer(ClientReport.pdf_data))
+                
+                report = query.filter(
+                    ClientReport.id == report_id,
+                    ClientReport.is_active == True
+                ).first()
+                
+                if not report:
+                    return None
+                
+                self.record_access(report.id)
                 
-                # Return report data
                 result = {
                     'id': report.id,
                     'patient_name': report.patient_name,
                     'patient_id': report.patient_id,
                     'report_date': report.report_date,
-                    'pdf_data': report.pdf_data,
-                    'allergen_data': json.loads(report.allergen_data)
+                    'practitioner': report.practitioner,
+                    'collection_date': report.collection_date,
+                    'gender': report.gender,
+                    'dob': report.dob,
+                    'specimen_type': report.specimen_type,
+                    'email': report.email,
+                    'row_version': report.row_version,
+                    'allergen_data': decode_payload(report.allergen_data)
                 }
-                session.close()
-                return result
+                if include_pdf:
+                    result['pdf_data'] = report.pdf_data
             
-            session.close()
-            return None
+            return result
         except Exception as e:
             print(f"Error retrieving client report: {e}")
             return None
+    
+    def record_access(self, report_id):
+        """
+        Record a report view in the write-behind access log
+        
+        The event is buffered in memory; last_accessed is updated when the
+        buffer is flushed.
+        """
+        get_access_buffer(self.db_url).record(report_id)
+    
+    def get_access_history(self, report_id, limit=100):
+        """
+        Get the most recent access times of a report
+        
+        Returns:
+        --------
+        list
+            Access timestamps, newest first
+        """
+        if not self.connected or self.Session is None:
+            return []
+        
+        try:
+            with self.session_scope() as session:
+                rows = session.query(AccessEvent.accessed_at).filter(
+                    AccessEvent.report_id == report_id
+                ).order_by(AccessEvent.accessed_at.desc()).limit(limit).all()
+            return [row.accessed_at for row in rows]
+        except Exception as e:
+            print(f"Error retrieving access history: {e}")
+            return []
+    
+    def get_report_pdf(self, report_id, active_only=False):
+        """
+        Get the PDF of a single report
+        
+        Parameters:
+        -----------
+        report_id : int
+            ID of the client report
+        active_only : bool
+            Only return the PDF of an active report (client downloads, so a
+            report deactivated after login can no longer be fetched)
+        
+        Returns:
+        --------
+        bytes
+            PDF binary data, or None if the report does not exist (or is
+            inactive when active_only is set)
+        """
+        if not self.connected or self.Session is None:
+            return None
+        
+        try:
+            with self.session_scope() as session:
+                query = session.query(ClientReport.pdf_data).filter(ClientReport.id == report_id)
+                if active_only:
+                    query = query.filter(ClientReport.is_active == True)
+                return query.scalar()
+        except Exception as e:
+            print(f"Error retrieving report PDF: {e}")
+            return None
+    
+    def iter_report_pdf(self, report_id, chunk_size=PDF_CHUNK_SIZE):
+        """
+        Stream the PDF of a single report in chunks
+        
+        Each chunk is read with its own substr() query, so at most chunk_size
+        bytes of the blob are held in memory at a time.
+        
+        Parameters:
+        -----------
+        report_id : int
+            ID of the client report
+        chunk_size : int
+            Maximum number of bytes per chunk
+        
+        Yields:
+        -------
+        bytes
+            Consecutive chunks of the PDF
+        """
+        if not self.connected or self.Session is None:
+            return
+        
+        with self.session_scope() as session:
+            total_size = session.query(func.length(ClientReport.pdf_data)).filter(
+                ClientReport.id == report_id
+            ).scalar()
+        
+        if not total_size:
+            return
+        
+        # substr() offsets are 1-based in both SQLite and PostgreSQL
+        for offset in range(1, total_size + 1, chunk_size):
+            with self.session_scope() as session:
+                chunk = session.query(func.substr(ClientReport.pdf_data, offset, chunk_size)).filter(
+                    ClientReport.id == report_id
+                ).scalar()
+            if not chunk:
+                return
+            yield bytes(chunk)
 
 # Create a global instance of the database manager
 db_manager = DatabaseManager()
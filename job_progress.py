@@ -0,0 +1,86 @@
+"""
+Progress display for background report jobs
+"""
+import os
+import streamlit as st
+from db import db_manager
+from report_jobs import get_job, get_recent_jobs, retry_failed_items, start_embedded_worker
+
+# Seconds between progress polls while a job is running
+JOB_PROGRESS_REFRESH = float(os.environ.get('JOB_PROGRESS_REFRESH', '2'))
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+def _show_progress(job):
+    done = job['done_items'] + job['failed_items']
+    total = job['total_items'] or 1
+    label = "Waiting for a worker..." if job['status'] == 'queued' else f"Generated {done} of {job['total_items']} reports"
+    st.progress(done / total, text=label)
+
+def _poll_job(job_id):
+    """Redraw the progress bar; reruns the whole page once the job has finished"""
+    job = get_job(db_manager.engine, job_id)
+    if job is None or job['status'] not in ACTIVE_STATUSES:
+        st.rerun()
+    _show_progress(job)
+
+# Fragments re-poll on their own without rerunning the page (Streamlit 1.37+)
+_poll_job_fragment = st.fragment(run_every=JOB_PROGRESS_REFRESH)(_poll_job) if hasattr(st, 'fragment') else None
+
+def render_job_progress(job_id):
+    """
+    Show the progress of a job until it finishes
+    
+    Parameters:
+    -----------
+    job_id : int
+        ID returned by report_jobs.submit_job
+    
+    Returns:
+    --------
+    dict
+        Job as returned by report_jobs.get_job, or None if it does not exist
+    """
+    start_embedded_worker(db_manager)
+    
+    job = get_job(db_manager.engine, job_id)
+    if job is None:
+        st.warning("The report job no longer exists.")
+        return None
+    
+    if job['status'] in ACTIVE_STATUSES:
+        if _poll_job_fragment is not None:
+            _poll_job_fragment(job_id)
+        else:
+            _show_progress(job)
+            st.button("🔄 Refresh progress", key=f"refresh_job_{job_id}")
+        st.caption("Reports are generated in the background; you can leave this page and come back later.")
+    elif job['status'] == 'failed':
+        st.error(f"Report job failed: {job['error']}")
+    
+    if job['status'] not in ACTIVE_STATUSES and job['failed_items']:
+        if st.button(f"🔁 Retry {job['failed_items']} failed report(s)", key=f"retry_job_{job_id}"):
+            retry_failed_items(db_manager.engine, job_id)
+            start_embedded_worker(db_manager)
+            st.rerun()
+    
+    return job
+
+def render_recent_jobs(kind, session_key):
+    """List recent jobs of a kind; choosing one stores its id in st.session_state[session_key]"""
+    jobs = get_recent_jobs(db_manager.engine, kind=kind)
+    if not jobs:
+        return
+    
+    with st.expander("🕒 Recent report jobs"):
+        for job in jobs:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.write(
+                    f"Job #{job['id']} · {job['created_date']:%Y-%m-%d %H:%M} · {job['status']} · "
+                    f"{job['done_items']} saved, {job['failed_items']} failed of {job['total_items']}"
+                )
+            with col2:
+                if st.button("Show", key=f"show_job_{kind}_{job['id']}"):
+                    st.session_state[session_key] = job['id']
+                    st.rerun()
@@ -0,0 +1,257 @@
+"""
+Login throttling: token buckets and lockouts checked before credentials reach the database
+"""
+import os
+import time
+import threading
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import db
+from db import db_manager
+
+# 'memory' keeps state per process; 'database' shares it through login_throttle_state
+LOGIN_THROTTLE_BACKEND = os.environ.get('LOGIN_THROTTLE_BACKEND', 'memory').lower()
+
+# Failed attempts per username and client address before a lockout, unless
+# the portal's max_login_attempts setting says otherwise
+DEFAULT_MAX_LOGIN_ATTEMPTS = int(os.environ.get('MAX_LOGIN_ATTEMPTS', '5'))
+LOGIN_LOCKOUT_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_SECONDS', '900'))
+
+# Token buckets as (capacity, tokens refilled per second); a capacity of 0 disables a bucket.
+# Every client behind one NAT (e.g. a clinic) shares an address bucket, so it only
+# caps bursts well above what a busy practice produces. There is deliberately no
+# per-username bucket: anyone could drain it and lock the real client out.
+ADDRESS_BUCKET = (float(os.environ.get('LOGIN_ADDRESS_BURST', '60')), float(os.environ.get('LOGIN_ADDRESS_PER_MINUTE', '60')) / 60)
+GLOBAL_BUCKET = (float(os.environ.get('LOGIN_GLOBAL_BURST', '100')), float(os.environ.get('LOGIN_GLOBAL_PER_SECOND', '50')))
+
+# Seconds the max_login_attempts setting is cached between database reads
+SETTINGS_TTL = 60
+
+# Idle state older than this is pruned
+STATE_RETENTION_SECONDS = 24 * 60 * 60
+
+def _new_state(capacity, now):
+    return {'tokens': capacity, 'updated_at': now, 'failures': 0, 'locked_until': 0.0}
+
+def _refill(state, bucket, now):
+    """Add the tokens earned since the last update"""
+    capacity, rate = bucket
+    elapsed = max(0.0, now - state['updated_at'])
+    state['tokens'] = min(capacity, state['tokens'] + elapsed * rate)
+    state['updated_at'] = now
+
+class MemoryThrottleStore:
+    """Throttle state held in this process"""
+    
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+    
+    def transaction(self, keys, buckets, now, apply):
+        """Run apply(states) atomically on the states of keys and keep its changes"""
+        with self._lock:
+            states = {
+                key: dict(self._states.get(key) or _new_state(buckets[key][0], now))
+                for key in keys
+            }
+            result = apply(states)
+            self._states.update(states)
+            
+            if now - self._last_prune > 60:
+                self._last_prune = now
+                for key in [key for key, state in self._states.items()
+                            if now - state['updated_at'] > STATE_RETENTION_SECONDS]:
+                    del self._states[key]
+            return result
+    
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+class DatabaseThrottleStore:
+    """
+    Throttle state shared by every process through the login_throttle_state table
+    
+    Only that table is read or written, never client_reports. PostgreSQL
+    locks the rows for the duration of a check with SELECT ... FOR UPDATE;
+    on SQLite the check runs under BEGIN IMMEDIATE (db.write_transaction),
+    so concurrent checks take the database write lock before reading the
+    state and run one after another.
+    """
+    
+    def __init__(self, manager=db_manager):
+        self.manager = manager
+        self._last_prune = 0.0
+    
+    def transaction(self, keys, buckets, now, apply):
+        table = db.LoginThrottleState.__table__
+        engine = self.manager.engine
+        
+        with db.write_transaction(engine) as conn:
+            statement = select(table).where(table.c.key.in_(keys))
+            if conn.dialect.name == 'postgresql':
+                statement = statement.with_for_update()
+            stored = {row.key: dict(row._mapping) for row in conn.execute(statement)}
+            
+            states = {}
+            for key in keys:
+                state = stored.get(key) or _new_state(buckets[key][0], now)
+                states[key] = {name: state[name] for name in ('tokens', 'updated_at', 'failures', 'locked_until')}
+            result = apply(states)
+            
+            rows = [dict(state, key=key) for key, state in states.items()]
+            dialect_insert = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}.get(conn.dialect.name)
+            if dialect_insert is not None:
+                upsert = dialect_insert(table)
+                upsert = upsert.on_conflict_do_update(
+                    index_elements=[table.c.key],
+                    set_={name: upsert.excluded[name] for name in ('tokens', 'updated_at', 'failures', 'locked_until')}
+                )
+                conn.execute(upsert, rows)
+            else:
+                conn.execute(delete(table).where(table.c.key.in_(keys)))
+                conn.execute(table.insert(), rows)
+            
+            if now - self._last_prune > 60:
+                self._last_prune = now
+                conn.execute(delete(table).where(
+                    table.c.updated_at < now - STATE_RETENTION_SECONDS,
+                    table.c.locked_until < now
+                ))
+        return result
+    
+    def clear(self):
+        with db.write_transaction(self.manager.engine) as conn:
+            conn.execute(delete(db.LoginThrottleState.__table__))
+
+class LoginThrottle:
+    """
+    Decide whether a login attempt may be checked against the database
+    
+    Every attempt takes a token from two buckets: the client address and a
+    global one that caps the database load of a distributed burst. Failed
+    attempts are counted per username and client address; max_login_attempts
+    failures lock that pair out for lockout_seconds, so attempts from other
+    addresses never lock a client out. Rejections are decided from throttle
+    state alone.
+    """
+    
+    def __init__(self, store=None, max_attempts=None, lockout_seconds=LOGIN_LOCKOUT_SECONDS,
+                 address_bucket=ADDRESS_BUCKET, global_bucket=GLOBAL_BUCKET):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.lockout_seconds = lockout_seconds
+        self.address_bucket = address_bucket
+        self.global_bucket = global_bucket
+        self._settings_cache = None
+    
+    def _get_store(self):
+        if self.store is None:
+            self.store = DatabaseThrottleStore() if LOGIN_THROTTLE_BACKEND == 'database' else MemoryThrottleStore()
+        return self.store
+    
+    def _max_attempts(self):
+        """max_login_attempts from the portal settings, cached for SETTINGS_TTL seconds"""
+        if self.max_attempts is not None:
+            return self.max_attempts
+        
+        now = time.monotonic()
+        if self._settings_cache is None or now - self._settings_cache[0] > SETTINGS_TTL:
+            try:
+                value = int(db_manager.get_portal_setting('max_login_attempts', DEFAULT_MAX_LOGIN_ATTEMPTS))
+            except (TypeError, ValueError):
+                value = DEFAULT_MAX_LOGIN_ATTEMPTS
+            self._settings_cache = (now, max(1, value))
+        return self._settings_cache[1]
+    
+    def _keys(self, username, client_address):
+        username = (username or '').strip().lower()
+        client_address = client_address or 'unknown'
+        return {
+            'pair': (f"pair:{username}|{client_address}", (0.0, 0.0)),
+            'address': (f"address:{client_address}", self.address_bucket),
+            'global': ("global", self.global_bucket)
+        }
+    
+    def check(self, username, client_address):
+        """
+        Take a token for a login attempt
+        
+        Returns:
+        --------
+        tuple
+            (allowed, retry_after): retry_after is the number of seconds to
+            wait before the next attempt can succeed, 0 when allowed
+        """
+        keys = self._keys(username, client_address)
+        buckets = {key: bucket for key, bucket in keys.values()}
+        now = time.time()
+        
+        def apply(states):
+            lockout = states[keys['pair'][0]]['locked_until'] - now
+            if lockout > 0:
+                return False, lockout
+            
+            for name in ('address', 'global'):
+                key, bucket = keys[name]
+                if bucket[0] <= 0:
+                    continue
+                _refill(states[key], bucket, now)
+                if states[key]['tokens'] < 1:
+                    return False, (1 - states[key]['tokens']) / bucket[1] if bucket[1] > 0 else self.lockout_seconds
+            
+            for name in ('address', 'global'):
+                key, bucket = keys[name]
+                if bucket[0] > 0:
+                    states[key]['tokens'] -= 1
+            return True, 0.0
+        
+        return self._get_store().transaction([key for key, _ in keys.values()], buckets, now, apply)
+    
+    def record_failure(self, username, client_address):
+        """Count a failed attempt; returns True if the username and address are now locked out"""
+        key, bucket = self._keys(username, client_address)['pair']
+        max_attempts = self._max_attempts()
+        now = time.time()
+        
+        def apply(states):
+            state = states[key]
+            state['updated_at'] = now
+            state['failures'] += 1
+            if state['failures'] >= max_attempts:
+                state['failures'] = 0
+                state['locked_until'] = now + self.lockout_seconds
+                return True
+            return False
+        
+        return self._get_store().transaction([key], {key: bucket}, now, apply)
+    
+    def record_success(self, username, client_address):
+        """Reset the failure count of a username and address after a successful login"""
+        key, bucket = self._keys(username, client_address)['pair']
+        now = time.time()
+        
+        def apply(states):
+            states[key].update(failures=0, locked_until=0.0, updated_at=now)
+        
+        self._get_store().transaction([key], {key: bucket}, now, apply)
+
+def get_client_address():
+    """Best-effort address of the browser that is running the current Streamlit script"""
+    try:
+        import streamlit as st
+        context = getattr(st, 'context', None)
+        if context is None:
+            return 'unknown'
+        address = getattr(context, 'ip_address', None)
+        if address:
+            return address
+        forwarded = context.headers.get('X-Forwarded-For', '')
+        return forwarded.split(',')[0].strip() or context.headers.get('X-Real-Ip', '') or 'unknown'
+    except Exception:
+        return 'unknown'
+
+# Create a global instance of the login throttle
+login_throttle = LoginThrottle()
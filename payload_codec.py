@@ -0,0 +1,292 @@
+"""
+Compact columnar encoding for tabular payloads stored in text columns
+
+DataFrames (allergen results, analysis results) are stored as a version
+tag followed by a base64 string of a zlib-compressed columnar layout:
+string columns are dictionary encoded and numeric columns are packed
+arrays. Other values (e.g. grid parameters) are stored as compact JSON.
+Rows written before this codec existed hold pandas to_json text and are
+decoded as JSON.
+"""
+import json
+import zlib
+import base64
+import struct
+from collections.abc import Sequence
+import numpy as np
+import pandas as pd
+
+# Tag of the current columnar format; bump the version when the layout changes
+CODEC_VERSION = 1
+CODEC_PREFIX = f"cp{CODEC_VERSION}:"
+
+# Column kinds of the columnar layout
+_FLOAT = b'f'
+_INT = b'i'
+_BOOL = b'b'
+_STRING = b's'
+_JSON = b'j'
+
+class PayloadDecodeError(ValueError):
+    """Raised when a stored payload cannot be decoded"""
+
+def _pack_string(value):
+    data = value.encode('utf-8')
+    return struct.pack('<I', len(data)) + data
+
+def _unpack_string(buffer, offset):
+    (length,) = struct.unpack_from('<I', buffer, offset)
+    offset += 4
+    return bytes(buffer[offset:offset + length]).decode('utf-8'), offset + length
+
+def _smallest_int_dtype(minimum, maximum, unsigned=False):
+    candidates = ('<u1', '<u2', '<u4', '<u8') if unsigned else ('<i1', '<i2', '<i4', '<i8')
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if info.min <= minimum and maximum <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(candidates[-1])
+
+def _encode_column(values):
+    """Encode one column as kind byte + body"""
+    dtype = values.dtype
+    
+    if pd.api.types.is_bool_dtype(dtype) and not values.isna().any():
+        return _BOOL + values.to_numpy(dtype='u1').tobytes()
+    
+    if pd.api.types.is_integer_dtype(dtype) and not values.isna().any():
+        array = values.to_numpy(dtype='int64')
+        int_dtype = _smallest_int_dtype(array.min(), array.max()) if len(array) else np.dtype('<i1')
+        return _INT + int_dtype.str[-2:].encode() + array.astype(int_dtype).tobytes()
+    
+    if pd.api.types.is_float_dtype(dtype):
+        array = values.to_numpy(dtype='float64', na_value=np.nan)
+        # float32 only when every value survives the round trip unchanged
+        with np.errstate(over='ignore'):
+            narrowed = array.astype('<f4')
+        if np.array_equal(narrowed.astype('float64'), array, equal_nan=True):
+            return _FLOAT + b'f4' + narrowed.tobytes()
+        return _FLOAT + b'f8' + array.astype('<f8').tobytes()
+    
+    if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+        present = values.notna().to_numpy()
+        if all(isinstance(value, str) for value in values[present]):
+            # Dictionary encoding; code 0 marks a missing value
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            codes = codes.astype('int64') + 1
+            code_dtype = _smallest_int_dtype(0, len(uniques), unsigned=True)
+            body = struct.pack('<I', len(uniques)) + b''.join(_pack_string(str(value)) for value in uniques)
+            return _STRING + body + code_dtype.str[-2:].encode() + codes.astype(code_dtype).tobytes()
+    
+    # Anything else (dates, mixed objects) keeps the to_json representation
+    return _JSON + _pack_string(values.to_json(orient='values'))
+
+def _decode_column(kind, buffer, offset, row_count):
+    """Decode one column; returns (values, offset after the column)"""
+    if kind == _BOOL:
+        array = np.frombuffer(buffer, dtype='u1', count=row_count, offset=offset).astype(bool)
+        return array, offset + row_count
+    
+    if kind in (_INT, _FLOAT):
+        dtype = np.dtype('<' + bytes(buffer[offset:offset + 2]).decode())
+        offset += 2
+        array = np.frombuffer(buffer, dtype=dtype, count=row_count, offset=offset)
+        return array.astype('int64' if kind == _INT else 'float64'), offset + row_count * dtype.itemsize
+    
+    if kind == _STRING:
+        (unique_count,) = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        uniques = [None]
+        for _ in range(unique_count):
+            value, offset = _unpack_string(buffer, offset)
+            uniques.append(value)
+        code_dtype = np.dtype('<' + bytes(buffer[offset:offset + 2]).decode())
+        offset += 2
+        codes = np.frombuffer(buffer, dtype=code_dtype, count=row_count, offset=offset)
+        array = np.array(uniques, dtype=object)[codes]
+        return array, offset + row_count * code_dtype.itemsize
+    
+    if kind == _JSON:
+        text, offset = _unpack_string(buffer, offset)
+        return np.array(json.loads(text), dtype=object), offset
+    
+    raise PayloadDecodeError(f"Unknown column kind {kind!r}")
+
+def _column_end(kind, buffer, offset, row_count):
+    """Offset just past a column, without decoding its values"""
+    if kind == _BOOL:
+        return offset + row_count
+    
+    if kind == _STRING:
+        (unique_count,) = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        for _ in range(unique_count):
+            (length,) = struct.unpack_from('<I', buffer, offset)
+            offset += 4 + length
+    elif kind == _JSON:
+        (length,) = struct.unpack_from('<I', buffer, offset)
+        return offset + 4 + length
+    elif kind not in (_INT, _FLOAT):
+        raise PayloadDecodeError(f"Unknown column kind {kind!r}")
+    
+    dtype = np.dtype('<' + bytes(buffer[offset:offset + 2]).decode())
+    return offset + 2 + row_count * dtype.itemsize
+
+def _python_value(value):
+    """Convert a decoded NumPy scalar to the value json.loads would give"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+class ColumnarRecords(Sequence):
+    """
+    Lazily decoded list of records
+    
+    Behaves like the list of dicts that json.loads returns for a
+    to_json(orient='records') payload. The layout is parsed on first use
+    and each column is decoded only when it is first needed; to_frame()
+    builds a DataFrame straight from the column arrays.
+    """
+    
+    def __init__(self, data):
+        self._data = data
+        self._buffer = None
+        self._columns = None
+        self._decoded = {}
+        self._row_count = 0
+    
+    def _parse(self):
+        if self._buffer is not None:
+            return
+        try:
+            buffer = memoryview(zlib.decompress(base64.b64decode(self._data)))
+            self._row_count, column_count = struct.unpack_from('<IH', buffer, 0)
+            offset = 6
+            columns = []
+            for _ in range(column_count):
+                name, offset = _unpack_string(buffer, offset)
+                kind = bytes(buffer[offset:offset + 1])
+                offset += 1
+                columns.append((name, kind, offset))
+                offset = _column_end(kind, buffer, offset, self._row_count)
+        except (zlib.error, struct.error, ValueError, UnicodeDecodeError) as e:
+            raise PayloadDecodeError(f"Corrupt columnar payload: {e}") from e
+        self._buffer = buffer
+        self._columns = columns
+    
+    @property
+    def columns(self):
+        """Column names in their original order"""
+        self._parse()
+        return [name for name, _, _ in self._columns]
+    
+    def column(self, name):
+        """Decoded NumPy array of one column"""
+        self._parse()
+        if name not in self._decoded:
+            for column_name, kind, offset in self._columns:
+                if column_name == name:
+                    self._decoded[name], _ = _decode_column(kind, self._buffer, offset, self._row_count)
+                    break
+            else:
+                raise KeyError(name)
+        return self._decoded[name]
+    
+    def to_frame(self):
+        """Build a DataFrame of all columns"""
+        return pd.DataFrame({name: self.column(name) for name in self.columns})
+    
+    def __len__(self):
+        self._parse()
+        return self._row_count
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        return {name: _python_value(self.column(name)[index]) for name in self.columns}
+    
+    def __iter__(self):
+        names = self.columns
+        arrays = [self.column(name) for name in names]
+        for values in zip(*arrays):
+            yield {name: _python_value(value) for name, value in zip(names, values)}
+    
+    def __eq__(self, other):
+        if isinstance(other, (ColumnarRecords, list)):
+            return list(self) == list(other)
+        return NotImplemented
+    
+    def __repr__(self):
+        return f"ColumnarRecords({len(self)} records)"
+    
+    def __reduce__(self):
+        return (ColumnarRecords, (self._data,))
+
+def encode_payload(value):
+    """
+    Encode a value for storage in a text column
+    
+    Parameters:
+    -----------
+    value : pandas.DataFrame or JSON-serializable object
+        DataFrames use the columnar format; other values become compact JSON
+    
+    Returns:
+    --------
+    str
+        Text to store
+    """
+    if not isinstance(value, pd.DataFrame):
+        return json.dumps(value, separators=(',', ':'))
+    
+    parts = [struct.pack('<IH', len(value), len(value.columns))]
+    for name in value.columns:
+        parts.append(_pack_string(str(name)))
+        parts.append(_encode_column(value[name]))
+    data = base64.b64encode(zlib.compress(b''.join(parts), 6)).decode('ascii')
+    return CODEC_PREFIX + data
+
+def decode_payload(text):
+    """
+    Decode a stored payload
+    
+    Parameters:
+    -----------
+    text : str
+        Stored text: a columnar payload or (legacy) JSON
+    
+    Returns:
+    --------
+    object
+        ColumnarRecords for columnar payloads, otherwise the parsed JSON
+    
+    Raises:
+    -------
+    PayloadDecodeError
+        If the text is neither a known columnar payload nor valid JSON
+    """
+    text = str(text)
+    if text.startswith(CODEC_PREFIX):
+        return ColumnarRecords(text[len(CODEC_PREFIX):])
+    if text.startswith('cp') and text[2:text.find(':')].isdigit():
+        raise PayloadDecodeError(f"Unsupported payload version {text[:text.find(':')]}")
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise PayloadDecodeError(f"Invalid JSON payload: {e}") from e
+
+def payload_to_frame(payload):
+    """Build a DataFrame from a decoded payload (columnar records or a list of dicts)"""
+    if isinstance(payload, ColumnarRecords):
+        return payload.to_frame()
+    if isinstance(payload, str):
+        payload = decode_payload(payload)
+        if isinstance(payload, ColumnarRecords):
+            return payload.to_frame()
+    return pd.DataFrame(payload)
@@ -0,0 +1,132 @@
+"""
+Content-addressed disk cache for rendered PDF reports
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+import pandas as pd
+
+# Bump whenever the report layout changes; every cached PDF is then discarded
+REPORT_TEMPLATE_VERSION = 1
+
+# client_info fields that appear in the rendered report
+LAYOUT_FIELDS = (
+    'name', 'dob', 'gender', 'specimen', 'patient_id', 'email',
+    'draw_date', 'collection_date', 'report_date', 'practitioner'
+)
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pdf_cache')
+CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+
+class PdfRenderCache:
+    """
+    Disk cache of rendered PDFs keyed by a hash of their inputs
+    
+    Entries live in a directory per template version. The total size is kept
+    under max_bytes by evicting the least recently used files (by mtime,
+    which is refreshed on every hit).
+    """
+    
+    def __init__(self, root=CACHE_ROOT, template_version=REPORT_TEMPLATE_VERSION, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.template_version = template_version
+        self.max_bytes = max_bytes
+        self.directory = os.path.join(root, f"v{template_version}")
+        self._lock = threading.Lock()
+        self._prepared = False
+    
+    def _prepare(self):
+        """Create the cache directory and drop caches of other template versions"""
+        if self._prepared:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if path != self.directory and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        self._prepared = True
+    
+    def key(self, data, client_info):
+        """
+        Compute the cache key of a report
+        
+        Parameters:
+        -----------
+        data : pandas.DataFrame
+            Processed allergen data
+        client_info : dict
+            Client information dictionary (only LAYOUT_FIELDS are used)
+        
+        Returns:
+        --------
+        str
+            Hex SHA-256 digest
+        """
+        digest = hashlib.sha256()
+        digest.update(f"template:{self.template_version}\n".encode())
+        fields = {field: str(client_info.get(field, '')) for field in LAYOUT_FIELDS}
+        digest.update(json.dumps(fields, sort_keys=True).encode())
+        digest.update(json.dumps([str(column) for column in data.columns]).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+    
+    def get(self, key):
+        """Return the cached PDF bytes for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cached_file:
+                pdf_data = cached_file.read()
+            os.utime(path)
+            return pdf_data
+        except OSError:
+            return None
+    
+    def put(self, key, pdf_data):
+        """Store a rendered PDF and evict old entries beyond max_bytes"""
+        with self._lock:
+            try:
+                self._prepare()
+                path = self._path(key)
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as cached_file:
+                    cached_file.write(pdf_data)
+                os.replace(temp_path, path)
+                self._evict()
+            except OSError as e:
+                print(f"Error writing PDF cache: {e}")
+    
+    def _evict(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        
+        if total_size <= self.max_bytes:
+            return
+        
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break
+    
+    def clear(self):
+        """Remove every cached PDF"""
+        with self._lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self._prepared = False
+
+# Create a global instance of the PDF render cache
+pdf_cache = PdfRenderCache()
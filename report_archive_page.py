@@ -2,9 +2,24 @@
 Report Archive page for viewing and managing all generated client reports
 """
 import streamlit as st
-import pandas as pd
 from datetime import datetime
 from db import db_manager
+from report_export import EXPORT_COLUMNS, export_reports_csv
+
+# Archive filter labels mapped to query_client_reports arguments
+STATUS_FILTERS = {
+    "All": 'all',
+    "Active": 'active',
+    "Inactive": 'inactive',
+    "Accessed": 'accessed',
+    "Not Accessed": 'not_accessed'
+}
+SORT_OPTIONS = {
+    "Newest first": 'newest',
+    "Oldest first": 'oldest',
+    "Patient name": 'name'
+}
+PAGE_SIZES = [25, 50, 100]
 
 def render_report_archive_page():
     """
@@ -13,53 +28,56 @@ def render_report_archive_page():
     st.subheader("Report Archive")
     st.markdown("View and manage all generated client reports with their access credentials.")
     
-    # Get all client reports from database
-    reports = db_manager.get_all_client_reports()
+    # Summary metrics come from one cached aggregate query
+    stats = db_manager.get_archive_stats()
     
-    if not reports:
+    if not stats['total']:
         st.info("No reports found. Generate reports in the Reporting tab to see them here.")
         return
     
     # Summary metrics
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total Reports", len(reports))
+        st.metric("Total Reports", stats['total'])
     with col2:
-        active_reports = len([r for r in reports if r['is_active']])
-        st.metric("Active Reports", active_reports)
+        st.metric("Active Reports", stats['active'])
     with col3:
-        accessed_reports = len([r for r in reports if r['last_accessed']])
-        st.metric("Accessed Reports", accessed_reports)
+        st.metric("Accessed Reports", stats['accessed'])
     with col4:
-        recent_reports = len([r for r in reports if (datetime.now() - r['report_date']).days <= 7])
-        st.metric("This Week", recent_reports)
+        st.metric("This Week", stats['this_week'])
     
     st.markdown("---")
     
     # Filter options
-    col1, col2 = st.columns(2)
+    col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
     with col1:
-        search_term = st.text_input("🔍 Search by patient name or ID", placeholder="Enter patient name or ID")
+        search_term = st.text_input("🔍 Search by patient, ID, practitioner or username", placeholder="Enter patient name, ID, practitioner or username")
     with col2:
-        status_filter = st.selectbox("Filter by status", ["All", "Active", "Inactive", "Accessed", "Not Accessed"])
+        status_filter = st.selectbox("Filter by status", list(STATUS_FILTERS))
+    with col3:
+        sort_option = st.selectbox("Sort by", list(SORT_OPTIONS))
+    with col4:
+        page_size = st.selectbox("Per page", PAGE_SIZES)
     
-    # Filter reports based on search and status
-    filtered_reports = reports
-    if search_term:
-        filtered_reports = [r for r in filtered_reports if 
-                          search_term.lower() in r['patient_name'].lower() or 
-                          search_term.lower() in r['patient_id'].lower()]
+    # Start from the first page whenever the query changes
+    query_key = (search_term, status_filter, sort_option, page_size)
+    if st.session_state.get('archive_query') != query_key:
+        st.session_state.archive_query = query_key
+        st.session_state.archive_cursors = [None]
     
-    if status_filter == "Active":
-        filtered_reports = [r for r in filtered_reports if r['is_active']]
-    elif status_filter == "Inactive":
-        filtered_reports = [r for r in filtered_reports if not r['is_active']]
-    elif status_filter == "Accessed":
-        filtered_reports = [r for r in filtered_reports if r['last_accessed']]
-    elif status_filter == "Not Accessed":
-        filtered_reports = [r for r in filtered_reports if not r['last_accessed']]
+    # Filtering, sorting and pagination happen in the database
+    page = db_manager.query_client_reports(
+        search=search_term,
+        status=STATUS_FILTERS[status_filter],
+        sort=SORT_OPTIONS[sort_option],
+        after_cursor=st.session_state.archive_cursors[-1],
+        limit=page_size
+    )
+    filtered_reports = page['reports']
     
-    st.markdown(f"**Showing {len(filtered_reports)} of {len(reports)} reports**")
+    page_number = len(st.session_state.archive_cursors)
+    first_index = (page_number - 1) * page_size
+    st.markdown(f"**Showing reports {first_index + 1 if filtered_reports else 0}–{first_index + len(filtered_reports)} (page {page_number})**")
     
     # Display reports in a table format
     if filtered_reports:
@@ -102,7 +120,21 @@ def render_report_archive_page():
                     with button_col2:
                         toggle_text = "Deactivate" if report['is_active'] else "Activate"
                         if st.button(f"🔒 {toggle_text}", key=f"toggle_{report['id']}"):
-                            st.info(f"Report status toggle functionality would be implemented here")
+                            if db_manager.set_report_active(report['id'], not report['is_active']):
+                                st.rerun()
+                            else:
+                                st.error("Unable to update report status")
+        
+        # Page navigation
+        nav_col1, nav_col2, nav_col3 = st.columns([1, 3, 1])
+        with nav_col1:
+            if page_number > 1 and st.button("◀ Previous", use_container_width=True):
+                st.session_state.archive_cursors.pop()
+                st.rerun()
+        with nav_col3:
+            if page['next_cursor'] and st.button("Next ▶", use_container_width=True):
+                st.session_state.archive_cursors.append(page['next_cursor'])
+                st.rerun()
     
     # Bulk operations
     st.markdown("---")
@@ -111,32 +143,31 @@ def render_report_archive_page():
     col1, col2, col3 = st.columns(3)
     with col1:
         if st.button("📧 Email All Active Credentials"):
-            active_count = len([r for r in reports if r['is_active']])
+            active_count = stats['active']
             st.success(f"Would email credentials to {active_count} active clients")
     
     with col2:
-        if st.button("📊 Export Report Data"):
-            # Create a summary dataframe for export
-            export_data = []
-            for report in reports:
-                export_data.append({
-                    'Patient Name': report['patient_name'],
-                    'Patient ID': report['patient_id'],
-                    'Practitioner': report['practitioner'],
-                    'Report Date': report['report_date'].strftime('%Y-%m-%d %H:%M'),
-                    'Username': report['username'],
-                    'Password': report['password'],
-                    'Status': 'Active' if report['is_active'] else 'Inactive',
-                    'Last Accessed': report['last_accessed'].strftime('%Y-%m-%d %H:%M') if report['last_accessed'] else 'Never'
-                })
+        export_columns = st.multiselect("Export columns", list(EXPORT_COLUMNS), default=list(EXPORT_COLUMNS))
+        compress_export = st.checkbox("Gzip compress export")
+        
+        if st.button("📊 Export Report Data", disabled=not export_columns):
+            # Stream reports from the database into a spooled CSV file
+            progress_bar = st.progress(0)
+            export_file = export_reports_csv(
+                columns=export_columns,
+                compress=compress_export,
+                progress_callback=lambda exported, total: progress_bar.progress(
+                    exported / total, text=f"Exported {exported} of {total} reports"
+                )
+            )
+            progress_bar.empty()
             
-            df = pd.DataFrame(export_data)
-            csv_data = df.to_csv(index=False)
+            file_name = f"report_archive_{datetime.now().strftime('%Y%m%d')}.csv"
             st.download_button(
                 label="⬇️ Download CSV",
-                data=csv_data,
-                file_name=f"report_archive_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv"
+                data=export_file,
+                file_name=file_name + ".gz" if compress_export else file_name,
+                mime="application/gzip" if compress_export else "text/csv"
             )
     
     with col3:
@@ -0,0 +1,81 @@
+"""
+Streaming CSV export of the report archive
+"""
+import csv
+import gzip
+import io
+import tempfile
+from db import db_manager
+
+# Exports larger than this are spooled to a temporary file on disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Reports fetched from the database per round trip
+EXPORT_CHUNK_SIZE = 1000
+
+def _format_date(value):
+    return value.strftime('%Y-%m-%d %H:%M') if value else ''
+
+# CSV column name -> value of a report summary row
+EXPORT_COLUMNS = {
+    'Patient Name': lambda report: report['patient_name'],
+    'Patient ID': lambda report: report['patient_id'],
+    'Practitioner': lambda report: report['practitioner'],
+    'Report Date': lambda report: _format_date(report['report_date']),
+    'Username': lambda report: report['username'],
+    'Password': lambda report: report['password'],
+    'Status': lambda report: 'Active' if report['is_active'] else 'Inactive',
+    'Last Accessed': lambda report: _format_date(report['last_accessed']) or 'Never'
+}
+
+def export_reports_csv(columns=None, compress=False, progress_callback=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Write the report archive as CSV into a spooled temporary file
+    
+    Reports are streamed from the database chunk by chunk and written
+    incrementally, so peak memory does not grow with the archive size.
+    
+    Parameters:
+    -----------
+    columns : list
+        Names from EXPORT_COLUMNS to include, in order (default: all)
+    compress : bool
+        Gzip the CSV output
+    progress_callback : callable
+        Called as progress_callback(exported, total) after each chunk
+    chunk_size : int
+        Reports fetched per database round trip
+    
+    Returns:
+    --------
+    tempfile.SpooledTemporaryFile
+        Binary file positioned at the start of the CSV (or .csv.gz) data
+    """
+    columns = list(columns or EXPORT_COLUMNS)
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+    binary_out = gzip.GzipFile(fileobj=spool, mode='wb') if compress else spool
+    text_out = io.TextIOWrapper(binary_out, encoding='utf-8', newline='')
+    
+    writer = csv.writer(text_out)
+    writer.writerow(columns)
+    
+    total = db_manager.get_archive_stats()['total']
+    exported = 0
+    for chunk in db_manager.iter_report_summaries(chunk_size):
+        writer.writerows([EXPORT_COLUMNS[column](report) for column in columns] for report in chunk)
+        exported += len(chunk)
+        if progress_callback:
+            progress_callback(exported, max(total, exported))
+    
+    # Detach so closing the wrappers does not close the spooled file
+    text_out.flush()
+    text_out.detach()
+    if compress:
+        binary_out.close()
+    
+    spool.seek(0)
+    return spool
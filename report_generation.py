@@ -0,0 +1,160 @@
+"""
+Parallel PDF report generation for batch uploads
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pdf_cache import pdf_cache
+
+# Worker processes used to render PDFs (0 = one per CPU core)
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '0')) or os.cpu_count() or 1
+
+# Finished reports are written to the database in batches of this size
+SAVE_BATCH_SIZE = int(os.environ.get('REPORT_SAVE_BATCH_SIZE', '50'))
+
+def render_report_pdf(data, client_info):
+    """
+    Render one PDF report
+    
+    Parameters:
+    -----------
+    data : pandas.DataFrame
+        Processed allergen data
+    client_info : dict
+        Client information dictionary
+    
+    Returns:
+    --------
+    bytes
+        PDF binary data
+    """
+    import fixed_report_layout
+    pdf_data, _, _ = fixed_report_layout.create_report(data, client_info, output_format='both')
+    return pdf_data
+
+def _render_item(key, data, client_info):
+    """Worker entry point; errors are returned instead of raised so one bad report does not stop the batch"""
+    try:
+        return key, render_report_pdf(data, client_info), None
+    except Exception as e:
+        return key, None, str(e)
+
+def generate_report_pdfs(items, max_workers=None, cache=pdf_cache):
+    """
+    Render PDF reports across worker processes
+    
+    Reports found in the render cache are returned without rendering;
+    newly rendered PDFs are added to it.
+    
+    Parameters:
+    -----------
+    items : dict
+        Report key -> {'data': DataFrame, 'client_info': dict}
+    max_workers : int
+        Number of worker processes (default REPORT_WORKERS); 1 renders in-process
+    cache : pdf_cache.PdfRenderCache
+        Render cache to use, or None to always render
+    
+    Yields:
+    -------
+    tuple
+        (key, pdf_data, error) in completion order; pdf_data is None on error
+    """
+    cache_keys = {}
+    to_render = {}
+    for key, item in items.items():
+        if cache is not None:
+            cache_keys[key] = cache.key(item['data'], item['client_info'])
+            pdf_data = cache.get(cache_keys[key])
+            if pdf_data:
+                yield key, pdf_data, None
+                continue
+        to_render[key] = item
+    
+    for key, pdf_data, error in _render_items(to_render, max_workers):
+        if cache is not None and pdf_data:
+            cache.put(cache_keys[key], pdf_data)
+        yield key, pdf_data, error
+
+def _render_items(items, max_workers):
+    if not items:
+        return
+    
+    max_workers = min(max_workers or REPORT_WORKERS, len(items)) or 1
+    
+    if max_workers == 1:
+        for key, item in items.items():
+            yield _render_item(key, item['data'], item['client_info'])
+        return
+    
+    # Spawn fresh workers rather than forking the Streamlit server process
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(_render_item, key, item['data'], item['client_info'])
+            for key, item in items.items()
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+def generate_and_save_reports(items, db_manager, max_workers=None, progress_callback=None,
+                              save_batch_size=SAVE_BATCH_SIZE):
+    """
+    Render PDF reports in parallel and save them with client credentials
+    
+    Finished PDFs are saved with save_client_reports_bulk once
+    save_batch_size of them are ready, and at the end of the run.
+    
+    Parameters:
+    -----------
+    items : dict
+        Report key -> {'data': DataFrame, 'client_info': dict}
+    db_manager : db.DatabaseManager
+        Database to save the reports to
+    max_workers : int
+        Number of worker processes (default REPORT_WORKERS)
+    progress_callback : callable
+        Called as progress_callback(done, total, key, error) after each report
+    save_batch_size : int
+        Reports per database batch
+    
+    Returns:
+    --------
+    dict
+        {'saved': {key: {'pdf_data', 'credentials'}}, 'failed': {key: error}}
+    """
+    result = {'saved': {}, 'failed': {}}
+    pending = []
+    
+    def save_pending():
+        bulk_result = db_manager.save_client_reports_bulk([
+            {'client_info': items[key]['client_info'], 'pdf_data': pdf_data, 'allergen_data': items[key]['data']}
+            for key, pdf_data in pending
+        ])
+        for credentials in bulk_result['saved']:
+            key, pdf_data = pending[credentials['index']]
+            result['saved'][key] = {'pdf_data': pdf_data, 'credentials': credentials}
+        for failure in bulk_result['failed']:
+            key, _ = pending[failure['index']]
+            result['failed'][key] = f"Failed to save report: {failure['error']}"
+        pending.clear()
+    
+    done = 0
+    for key, pdf_data, error in generate_report_pdfs(items, max_workers):
+        done += 1
+        if error is None and not pdf_data:
+            error = "Report generator returned no PDF"
+        
+        if error is None:
+            pending.append((key, pdf_data))
+            if len(pending) >= save_batch_size:
+                save_pending()
+        else:
+            result['failed'][key] = error
+        
+        if progress_callback:
+            progress_callback(done, len(items), key, error)
+    
+    if pending:
+        save_pending()
+    
+    return result
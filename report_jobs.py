@@ -0,0 +1,511 @@
+"""
+Database-backed background jobs for report generation
+
+Pages submit a job (one item per report) and poll its progress; workers
+claim queued jobs, render and save the reports in batches and mark each
+item done in the transaction that saves its report. Everything lives in
+report_jobs and report_job_items, so jobs survive closed tabs, reruns and
+restarts: a job whose worker stops sending heartbeats is reclaimed and
+continues with the items that are still pending. A job that keeps failing
+is given up after JOB_MAX_ATTEMPTS claims.
+
+Workers run as a daemon thread of the Streamlit server (JOB_EMBEDDED_WORKER)
+and/or as separate processes started with `python job_worker.py`.
+"""
+import os
+import json
+import socket
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert, func, or_, and_
+from sqlalchemy.exc import IntegrityError
+import db
+from payload_codec import encode_payload, payload_to_frame, decode_payload
+from report_generation import SAVE_BATCH_SIZE, generate_report_pdfs
+
+# Seconds an idle worker waits before looking for queued jobs again
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+
+# A running job whose heartbeat is older than this is taken over by another worker
+JOB_HEARTBEAT_TIMEOUT = float(os.environ.get('JOB_HEARTBEAT_TIMEOUT', '60'))
+
+# Claims of a job before it is marked failed (a worker crashing or erroring on it each time)
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+# Items rendered and saved per batch
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', str(SAVE_BATCH_SIZE)))
+
+# Run a worker thread inside the Streamlit server; disable when job_worker.py processes are deployed
+JOB_EMBEDDED_WORKER = os.environ.get('JOB_EMBEDDED_WORKER', 'true').lower() in ('1', 'true', 'yes')
+
+JOB_STATUSES = ('queued', 'running', 'completed', 'failed')
+
+def _render_lab_report_pdfs(items, max_workers):
+    """Render lab export reports with the report generator"""
+    return generate_report_pdfs(items, max_workers)
+
+def _render_admin_report_pdfs(items, max_workers):
+    """Placeholder PDFs of admin CSV reports"""
+    for key, item in items.items():
+        yield key, f"Report for {item['client_info'].get('patient_name', '')} - {len(item['data'])} allergens tested".encode(), None
+
+# Job kinds -> renderer yielding (key, pdf_data, error) for {key: {'data', 'client_info'}}
+JOB_RENDERERS = {
+    'lab_reports': _render_lab_report_pdfs,
+    'admin_reports': _render_admin_report_pdfs
+}
+
+def job_idempotency_key(kind, items):
+    """SHA-256 of the job kind and its encoded items"""
+    digest = hashlib.sha256(kind.encode('utf-8'))
+    for item in items:
+        digest.update(b'\0' + item['item_key'].encode('utf-8'))
+        digest.update(b'\0' + item['client_info'].encode('utf-8'))
+        digest.update(b'\0' + item['payload'].encode('ascii'))
+    return digest.hexdigest()
+
+def submit_job(engine, kind, items, options=None, idempotency_key=None):
+    """
+    Queue a report generation job
+    
+    Submitting the same items again (e.g. after a rerun repeated a button
+    click) returns the existing job instead of creating a second one,
+    whatever its status; its failed items are rerun with retry_failed_items.
+    
+    Parameters:
+    -----------
+    engine : sqlalchemy.engine.Engine
+        Database holding the job tables
+    kind : str
+        One of JOB_RENDERERS
+    items : list
+        (item_key, client_info dict, allergen DataFrame) tuples, one per report
+    options : dict
+        JSON-serializable job options, e.g. {'max_workers': 4}
+    idempotency_key : str
+        Explicit deduplication key (defaults to a hash of kind and items)
+    
+    Returns:
+    --------
+    int
+        Job ID
+    """
+    if kind not in JOB_RENDERERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    
+    rows = [
+        {
+            'position': position,
+            'item_key': str(item_key),
+            'client_info': json.dumps(client_info, sort_keys=True, default=str),
+            'payload': encode_payload(data),
+            'status': 'pending'
+        }
+        for position, (item_key, client_info, data) in enumerate(items)
+    ]
+    idempotency_key = idempotency_key or job_idempotency_key(kind, rows)
+    
+    jobs = db.ReportJob.__table__
+    existing = select(jobs.c.id).where(jobs.c.idempotency_key == idempotency_key)
+    
+    with db.write_transaction(engine) as conn:
+        job_id = conn.execute(existing).scalar()
+        if job_id is not None:
+            return job_id
+        try:
+            with conn.begin_nested():
+                job_id = conn.execute(insert(jobs).values(
+                    kind=kind,
+                    idempotency_key=idempotency_key,
+                    status='queued',
+                    options=json.dumps(options or {}),
+                    total_items=len(rows),
+                    done_items=0,
+                    failed_items=0,
+                    created_date=datetime.utcnow()
+                ).returning(jobs.c.id)).scalar()
+                if rows:
+                    conn.execute(insert(db.ReportJobItem.__table__), [dict(row, job_id=job_id) for row in rows])
+        except IntegrityError:
+            # Submitted concurrently by another rerun
+            job_id = conn.execute(existing).scalar()
+    return job_id
+
+def retry_failed_items(engine, job_id):
+    """
+    Queue the failed items of a finished job again
+    
+    Returns:
+    --------
+    int
+        Number of items set back to pending (0 if the job is still queued or running)
+    """
+    jobs = db.ReportJob.__table__
+    items = db.ReportJobItem.__table__
+    
+    with db.write_transaction(engine) as conn:
+        requeued = conn.execute(
+            update(jobs)
+            .where(jobs.c.id == job_id, jobs.c.status.in_(('completed', 'failed')), jobs.c.failed_items > 0)
+            .values(status='queued', attempts=0, worker_id=None, error=None, finished_date=None)
+        )
+        if requeued.rowcount != 1:
+            return 0
+        count = conn.execute(
+            update(items).where(items.c.job_id == job_id, items.c.status == 'failed').values(status='pending', error=None)
+        ).rowcount
+        conn.execute(update(jobs).where(jobs.c.id == job_id).values(failed_items=jobs.c.failed_items - count))
+        return count
+
+def _job_dict(row):
+    job = dict(row._mapping)
+    job['options'] = json.loads(job['options'] or '{}')
+    job['pending_items'] = job['total_items'] - job['done_items'] - job['failed_items']
+    return job
+
+def get_job(engine, job_id):
+    """Job row as a dictionary (with pending_items), or None"""
+    jobs = db.ReportJob.__table__
+    with engine.connect() as conn:
+        row = conn.execute(select(jobs).where(jobs.c.id == job_id)).first()
+    return _job_dict(row) if row else None
+
+def get_recent_jobs(engine, kind=None, limit=10):
+    """Newest jobs first, optionally of one kind"""
+    jobs = db.ReportJob.__table__
+    statement = select(jobs).order_by(jobs.c.id.desc()).limit(limit)
+    if kind:
+        statement = statement.where(jobs.c.kind == kind)
+    with engine.connect() as conn:
+        return [_job_dict(row) for row in conn.execute(statement)]
+
+def get_job_items(engine, job_id):
+    """
+    Items of a job in submission order
+    
+    Returns:
+    --------
+    list
+        Dictionaries with item_key, status, error, client_info and, for
+        saved reports, the report's credentials (report_id, username,
+        password, patient_name, patient_id)
+    """
+    items = db.ReportJobItem.__table__
+    reports = db.ClientReport.__table__
+    statement = select(
+        items.c.item_key, items.c.status, items.c.error, items.c.client_info, items.c.report_id,
+        reports.c.username, reports.c.password, reports.c.patient_name, reports.c.patient_id
+    ).select_from(
+        items.outerjoin(reports, items.c.report_id == reports.c.id)
+    ).where(items.c.job_id == job_id).order_by(items.c.position)
+    
+    with engine.connect() as conn:
+        result = []
+        for row in conn.execute(statement):
+            item = {
+                'item_key': row.item_key,
+                'status': row.status,
+                'error': row.error,
+                'client_info': json.loads(row.client_info),
+                'credentials': None
+            }
+            if row.report_id is not None:
+                item['credentials'] = {
+                    'report_id': row.report_id,
+                    'username': row.username,
+                    'password': row.password,
+                    'patient_name': row.patient_name,
+                    'patient_id': row.patient_id
+                }
+            result.append(item)
+        return result
+
+class JobWorker:
+    """
+    Claims queued jobs and runs them batch by batch
+    
+    A job is claimed with a conditional update, so two workers never run
+    it at the same time. While it runs, a heartbeat thread refreshes
+    heartbeat_at; if another worker has taken the job over (because the
+    heartbeat stalled) this worker stops after its current batch.
+    """
+    
+    def __init__(self, manager, worker_id=None, max_workers=None, batch_size=JOB_BATCH_SIZE,
+                 heartbeat_timeout=JOB_HEARTBEAT_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS):
+        self.manager = manager
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+    
+    @property
+    def engine(self):
+        return self.manager.engine
+    
+    def _claimable(self, now):
+        jobs = db.ReportJob.__table__
+        return or_(
+            jobs.c.status == 'queued',
+            and_(jobs.c.status == 'running', jobs.c.heartbeat_at < now - timedelta(seconds=self.heartbeat_timeout))
+        )
+    
+    def claim_job(self):
+        """
+        Claim the oldest queued (or abandoned) job; returns its row dictionary or None
+        
+        Every claim counts as an attempt. A job claimed more than max_attempts
+        times is marked failed, with its pending items, instead of being run.
+        """
+        jobs = db.ReportJob.__table__
+        now = datetime.utcnow()
+        
+        with db.write_transaction(self.engine) as conn:
+            candidates = conn.execute(
+                select(jobs.c.id).where(self._claimable(now)).order_by(jobs.c.id).limit(5)
+            ).scalars().all()
+            for job_id in candidates:
+                claimed = conn.execute(
+                    update(jobs)
+                    .where(jobs.c.id == job_id, self._claimable(now))
+                    .values(
+                        status='running',
+                        worker_id=self.worker_id,
+                        heartbeat_at=now,
+                        attempts=jobs.c.attempts + 1,
+                        started_date=func.coalesce(jobs.c.started_date, now)
+                    )
+                )
+                if claimed.rowcount != 1:
+                    continue
+                
+                job = _job_dict(conn.execute(select(jobs).where(jobs.c.id == job_id)).first())
+                if job['attempts'] <= self.max_attempts:
+                    return job
+                
+                error = f"Gave up after {self.max_attempts} attempts"
+                if job['error']:
+                    error = f"{error}; last error: {job['error']}"
+                self._mark_failed(conn, [], error, job_id=job_id)
+                self._update_counts(conn, job_id, status='failed', error=error, finished_date=now)
+                print(f"Report job {job_id} failed: {error}")
+        return None
+    
+    def _heartbeat(self, job_id):
+        """Refresh the job's heartbeat; returns False if this worker no longer owns it"""
+        jobs = db.ReportJob.__table__
+        with db.write_transaction(self.engine) as conn:
+            return conn.execute(
+                update(jobs)
+                .where(jobs.c.id == job_id, jobs.c.worker_id == self.worker_id, jobs.c.status == 'running')
+                .values(heartbeat_at=datetime.utcnow())
+            ).rowcount == 1
+    
+    def _update_counts(self, conn, job_id, **values):
+        jobs = db.ReportJob.__table__
+        items = db.ReportJobItem.__table__
+        counts = dict(conn.execute(
+            select(items.c.status, func.count()).where(items.c.job_id == job_id).group_by(items.c.status)
+        ).all())
+        conn.execute(
+            update(jobs).where(jobs.c.id == job_id).values(
+                done_items=counts.get('done', 0),
+                failed_items=counts.get('failed', 0),
+                **values
+            )
+        )
+        return counts.get('pending', 0)
+    
+    def _mark_failed(self, conn, item_ids, error, job_id=None):
+        """Mark pending items failed: those of item_ids, or all of job_id's when given"""
+        items = db.ReportJobItem.__table__
+        selected = items.c.job_id == job_id if job_id is not None else items.c.id.in_(item_ids)
+        conn.execute(
+            update(items).where(selected, items.c.status == 'pending').values(status='failed', error=error)
+        )
+    
+    def _release(self, job_id, error):
+        """Hand a job this worker could not run back to the queue, recording why"""
+        jobs = db.ReportJob.__table__
+        with db.write_transaction(self.engine) as conn:
+            conn.execute(
+                update(jobs)
+                .where(jobs.c.id == job_id, jobs.c.worker_id == self.worker_id, jobs.c.status == 'running')
+                .values(status='queued', worker_id=None, error=error)
+            )
+    
+    def run_job(self, job, stop_event=None):
+        """
+        Process the pending items of a claimed job
+        
+        Returns:
+        --------
+        str
+            Final status, or 'running' if the worker stopped or lost the job
+        """
+        job_id = job['id']
+        jobs = db.ReportJob.__table__
+        items = db.ReportJobItem.__table__
+        renderer = JOB_RENDERERS.get(job['kind'])
+        
+        if renderer is None:
+            with db.write_transaction(self.engine) as conn:
+                conn.execute(update(jobs).where(jobs.c.id == job_id).values(
+                    status='failed', error=f"Unknown job kind: {job['kind']}", finished_date=datetime.utcnow()
+                ))
+            return 'failed'
+        
+        max_workers = job['options'].get('max_workers') or self.max_workers
+        lost = threading.Event()
+        finished = threading.Event()
+        
+        def beat():
+            while not finished.wait(self.heartbeat_timeout / 3):
+                try:
+                    if not self._heartbeat(job_id):
+                        lost.set()
+                        return
+                except Exception as e:
+                    print(f"Error refreshing job heartbeat: {e}")
+        
+        heartbeat = threading.Thread(target=beat, name=f"job-heartbeat-{job_id}", daemon=True)
+        heartbeat.start()
+        try:
+            while not lost.is_set() and not (stop_event is not None and stop_event.is_set()):
+                with self.engine.connect() as conn:
+                    batch = conn.execute(
+                        select(items.c.id, items.c.item_key, items.c.client_info, items.c.payload)
+                        .where(items.c.job_id == job_id, items.c.status == 'pending')
+                        .order_by(items.c.position)
+                        .limit(self.batch_size)
+                    ).all()
+                
+                if not batch:
+                    with db.write_transaction(self.engine) as conn:
+                        self._update_counts(conn, job_id, status='completed', finished_date=datetime.utcnow())
+                    return 'completed'
+                
+                try:
+                    self._run_batch(job_id, renderer, batch, max_workers)
+                except Exception as e:
+                    # Fail this batch's items and carry on with the rest of the job,
+                    # unless another worker has taken the job over meanwhile
+                    print(f"Error running a batch of report job {job_id}: {e}")
+                    if not self._heartbeat(job_id):
+                        return 'running'
+                    with db.write_transaction(self.engine) as conn:
+                        self._mark_failed(conn, [row.id for row in batch], f"Batch failed: {db.describe_error(e)}")
+                        self._update_counts(conn, job_id, heartbeat_at=datetime.utcnow())
+            return 'running'
+        finally:
+            finished.set()
+    
+    def _run_batch(self, job_id, renderer, batch, max_workers):
+        """Render and save one batch of pending items"""
+        render_items = {}
+        item_ids = {}
+        with db.write_transaction(self.engine) as conn:
+            for row in batch:
+                try:
+                    render_items[row.item_key] = {
+                        'client_info': json.loads(row.client_info),
+                        'data': payload_to_frame(decode_payload(row.payload))
+                    }
+                    item_ids[row.item_key] = row.id
+                except Exception as e:
+                    self._mark_failed(conn, [row.id], f"Invalid job item: {e}")
+        
+        rendered = []
+        errors = {}
+        for key, pdf_data, error in renderer(render_items, max_workers):
+            if error is None and not pdf_data:
+                error = "Report generator returned no PDF"
+            if error is None:
+                rendered.append((key, pdf_data))
+            else:
+                errors[key] = error
+        
+        items = db.ReportJobItem.__table__
+        
+        def mark_done(conn, inserted):
+            # Runs in the savepoint that inserts the reports: if another worker has
+            # already saved an item, raising rolls its duplicate report back
+            for idx, report_id in inserted:
+                marked = conn.execute(
+                    update(items)
+                    .where(items.c.id == item_ids[rendered[idx][0]], items.c.status == 'pending')
+                    .values(status='done', report_id=report_id, error=None)
+                )
+                if marked.rowcount != 1:
+                    raise RuntimeError("Job item was already processed by another worker")
+        
+        save_result = {'saved': [], 'failed': []}
+        if rendered:
+            save_result = self.manager.save_client_reports_bulk([
+                {'client_info': render_items[key]['client_info'], 'pdf_data': pdf_data, 'allergen_data': render_items[key]['data']}
+                for key, pdf_data in rendered
+            ], on_insert=mark_done)
+        
+        with db.write_transaction(self.engine) as conn:
+            for key, error in errors.items():
+                self._mark_failed(conn, [item_ids[key]], error)
+            for failure in save_result['failed']:
+                self._mark_failed(conn, [item_ids[rendered[failure['index']][0]]], f"Failed to save report: {failure['error']}")
+            self._update_counts(conn, job_id, heartbeat_at=datetime.utcnow())
+    
+    def run(self, stop_event=None, once=False, poll_interval=JOB_POLL_INTERVAL):
+        """
+        Claim and run jobs until stop_event is set
+        
+        Parameters:
+        -----------
+        stop_event : threading.Event
+            Set to stop after the current batch
+        once : bool
+            Return when no job is waiting instead of polling
+        poll_interval : float
+            Seconds to wait between polls while idle
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                job = self.claim_job()
+            except Exception as e:
+                print(f"Error claiming report job: {e}")
+                job = None
+            
+            if job is None:
+                if once:
+                    return
+                stop_event.wait(poll_interval)
+                continue
+            
+            try:
+                status = self.run_job(job, stop_event)
+                print(f"Report job {job['id']} {status}")
+            except Exception as e:
+                # Requeue it; claim_job gives up on it after max_attempts
+                print(f"Error running report job {job['id']}: {e}")
+                try:
+                    self._release(job['id'], db.describe_error(e))
+                except Exception as release_error:
+                    # The job stays running and is reclaimed once its heartbeat times out
+                    print(f"Error releasing report job {job['id']}: {release_error}")
+                stop_event.wait(poll_interval)
+
+_embedded_worker = None
+_embedded_worker_lock = threading.Lock()
+
+def start_embedded_worker(manager):
+    """Start the in-process worker thread once per process (if JOB_EMBEDDED_WORKER is enabled)"""
+    global _embedded_worker
+    if not JOB_EMBEDDED_WORKER or not manager.is_connected():
+        return None
+    
+    with _embedded_worker_lock:
+        if _embedded_worker is None or not _embedded_worker.is_alive():
+            worker = JobWorker(manager)
+            _embedded_worker = threading.Thread(target=worker.run, name="report-job-worker", daemon=True)
+            _embedded_worker.start()
+        return _embedded_worker
@@ -0,0 +1,186 @@
+"""
+Bounded, disk-backed store for large per-session artifacts (processed report data)
+"""
+import os
+import time
+import uuid
+import pickle
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+STORE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'session_artifacts')
+
+# In-memory bytes per browser session before least recently used artifacts spill to disk
+SESSION_MEMORY_BUDGET = int(os.environ.get('SESSION_MEMORY_BUDGET', str(64 * 1024 * 1024)))
+
+# Sessions idle for longer than this many seconds are purged from memory and disk
+SESSION_ARTIFACT_TTL = int(os.environ.get('SESSION_ARTIFACT_TTL', str(2 * 60 * 60)))
+
+def _payload_size(payload):
+    """Approximate in-memory size of an artifact in bytes"""
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    memory_usage = getattr(payload, 'memory_usage', None)
+    if callable(memory_usage):
+        # pandas DataFrame
+        return int(memory_usage(deep=True).sum())
+    return len(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+
+class SessionArtifactStore:
+    """
+    Per-session artifact store with a memory budget and LRU spill to disk
+    
+    Pages keep only artifact names in st.session_state and fetch payloads
+    from here when they need them. Each session's artifacts are kept in
+    memory up to memory_budget bytes; beyond that the least recently used
+    ones are pickled to a per-session directory and loaded back on access.
+    """
+    
+    def __init__(self, root=STORE_ROOT, memory_budget=SESSION_MEMORY_BUDGET, ttl=SESSION_ARTIFACT_TTL):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self._sessions = {}
+        self._last_used = {}
+        self._lock = threading.RLock()
+        self._last_expiry_check = 0
+    
+    def _session_dir(self, session_id):
+        return os.path.join(self.root, session_id)
+    
+    def _artifact_path(self, session_id, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self._session_dir(session_id), f"{digest}.pkl")
+    
+    def _touch(self, session_id):
+        self._last_used[session_id] = time.time()
+        # Keep the spill directory's mtime current so other processes sharing
+        # the store root do not take this live session for an idle leftover
+        try:
+            os.utime(self._session_dir(session_id))
+        except OSError:
+            pass
+        return self._sessions.setdefault(session_id, OrderedDict())
+    
+    def put(self, session_id, name, payload):
+        """Store (or replace) an artifact of a session"""
+        with self._lock:
+            self._expire_idle()
+            artifacts = self._touch(session_id)
+            self._discard(session_id, name)
+            artifacts[name] = {'payload': payload, 'size': _payload_size(payload)}
+            self._spill(session_id)
+    
+    def get(self, session_id, name):
+        """
+        Get an artifact, loading it back from disk if it was spilled
+        
+        Returns:
+        --------
+        object
+            The stored payload, or None if there is no such artifact
+        """
+        with self._lock:
+            self._expire_idle()
+            artifacts = self._touch(session_id)
+            entry = artifacts.get(name)
+            if entry is None:
+                return None
+            
+            artifacts.move_to_end(name)
+            if entry['payload'] is None:
+                try:
+                    with open(self._artifact_path(session_id, name), 'rb') as artifact_file:
+                        entry['payload'] = pickle.load(artifact_file)
+                except OSError as e:
+                    print(f"Error loading session artifact '{name}': {e}")
+                    del artifacts[name]
+                    return None
+                self._spill(session_id, keep=name)
+            return entry['payload']
+    
+    def delete(self, session_id, name):
+        """Remove one artifact of a session"""
+        with self._lock:
+            self._discard(session_id, name)
+    
+    def clear_session(self, session_id):
+        """Remove every artifact of a session, e.g. on logout"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+            shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+    
+    def memory_usage(self, session_id):
+        """Bytes of a session's artifacts currently held in memory"""
+        with self._lock:
+            artifacts = self._sessions.get(session_id, {})
+            return sum(entry['size'] for entry in artifacts.values() if entry['payload'] is not None)
+    
+    def _discard(self, session_id, name):
+        artifacts = self._sessions.get(session_id)
+        if artifacts and artifacts.pop(name, None) is not None:
+            try:
+                os.remove(self._artifact_path(session_id, name))
+            except OSError:
+                pass
+    
+    def _spill(self, session_id, keep=None):
+        """Move least recently used artifacts to disk until the session fits its budget"""
+        artifacts = self._sessions[session_id]
+        in_memory = self.memory_usage(session_id)
+        for name, entry in artifacts.items():
+            if in_memory <= self.memory_budget:
+                break
+            if entry['payload'] is None or name == keep:
+                continue
+            path = self._artifact_path(session_id, name)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as artifact_file:
+                    pickle.dump(entry['payload'], artifact_file, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                print(f"Error spilling session artifact '{name}': {e}")
+                continue
+            entry['payload'] = None
+            in_memory -= entry['size']
+    
+    def _expire_idle(self):
+        """
+        Purge sessions idle longer than the TTL, including leftovers of other processes
+        
+        Spill directories not owned by this process are only removed once
+        their mtime is older than the TTL; every access to a session touches
+        its directory, so sessions still in use elsewhere are left alone.
+        """
+        now = time.time()
+        if now - self._last_expiry_check < 60:
+            return
+        self._last_expiry_check = now
+        
+        for session_id, last_used in list(self._last_used.items()):
+            if now - last_used > self.ttl:
+                self.clear_session(session_id)
+        
+        if os.path.isdir(self.root):
+            for session_id in os.listdir(self.root):
+                path = self._session_dir(session_id)
+                if session_id in self._sessions:
+                    continue
+                try:
+                    idle = now - os.path.getmtime(path)
+                except OSError:
+                    continue
+                if idle > self.ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+
+def get_session_id(session_state):
+    """Return the artifact session id stored in a Streamlit session state, creating it if needed"""
+    if 'artifact_session_id' not in session_state:
+        session_state.artifact_session_id = uuid.uuid4().hex
+    return session_state.artifact_session_id
+
+# Create a global instance of the session artifact store
+artifact_store = SessionArtifactStore()
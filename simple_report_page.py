@@ -5,12 +5,110 @@ import streamlit as st
 import pandas as pd
 import os
 from datetime import datetime
-import zipfile
-import io
+from functools import partial
 import separate_pages_report
 import improved_report
 import improved_report_new
 import fixed_report_layout
+from db import db_manager
+from report_generation import REPORT_WORKERS
+from report_jobs import submit_job, get_job_items
+from job_progress import render_job_progress, render_recent_jobs
+from zip_export import build_zip
+from session_store import artifact_store, get_session_id
+from csv_ingestion import MissingColumnsError, ingest_lab_export
+
+def build_data_zip(session_id, reports):
+    """
+    Build a ZIP of the processed CSV data of the given reports
+    
+    Called by the download button when it is clicked, so the archive is
+    only built on demand, one member at a time.
+    
+    Parameters:
+    -----------
+    session_id : str
+        Session whose stored artifacts hold the processed data
+    reports : list
+        Values of st.session_state.processed_reports
+    
+    Returns:
+    --------
+    tempfile.SpooledTemporaryFile
+        The archive, positioned at its start
+    """
+    return build_zip(
+        (f"{report_data['client_info']['patient_id']}_{report_data['client_info']['name']}_data.csv",
+         data_df.to_csv(index=False))
+        for report_data in reports
+        for data_df in [artifact_store.get(session_id, report_data['data_key'])]
+        if data_df is not None
+    )
+
+def build_pdf_zip(pdfs):
+    """
+    Build a ZIP of saved PDF reports, streaming each one from the database
+    
+    Parameters:
+    -----------
+    pdfs : list
+        Values of st.session_state.generated_pdfs
+    
+    Returns:
+    --------
+    tempfile.SpooledTemporaryFile
+        The archive, positioned at its start
+    """
+    return build_zip(
+        (pdf_data['filename'], db_manager.iter_report_pdf(pdf_data['credentials']['report_id']))
+        for pdf_data in pdfs
+    )
+
+def render_report_job(job_id):
+    """
+    Show the progress of a report generation job and, once it has finished,
+    its failures and the credentials of the saved reports
+    """
+    st.markdown("---")
+    st.subheader(f"Report Generation (Job #{job_id})")
+    job = render_job_progress(job_id)
+    if job is None or job['status'] != 'completed':
+        return
+    
+    items = get_job_items(db_manager.engine, job_id)
+    # Collected again when retried items have been saved since
+    if st.session_state.get('collected_report_job_id') != (job_id, job['done_items']):
+        # Keep only the report ids; the PDFs are fetched from the database when needed
+        for item in items:
+            if item['credentials']:
+                client_info = item['client_info']
+                st.session_state.generated_pdfs[item['item_key']] = {
+                    'filename': f"{client_info['patient_id']}_{client_info['name']}.pdf",
+                    'credentials': item['credentials']
+                }
+        st.session_state.collected_report_job_id = (job_id, job['done_items'])
+        st.rerun()
+    
+    for item in items:
+        if item['status'] == 'failed':
+            st.error(f"Failed to generate report for {item['client_info']['name']}: {item['error']}")
+    
+    saved = [item['credentials'] for item in items if item['credentials']]
+    if saved:
+        st.success(f"✅ Generated {len(saved)} PDF reports successfully!")
+        
+        # Display client credentials
+        st.subheader("🔑 Client Access Credentials")
+        st.markdown("Share these credentials with your clients to access their reports:")
+        
+        for cred in saved:
+            with st.expander(f"📄 {cred['patient_name']} (ID: {cred['patient_id']})"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.code(f"Username: {cred['username']}\nPassword: {cred['password']}", language=None)
+                with col2:
+                    st.markdown("**Portal URL:**")
+                    st.code("https://portal.pinnertest.com/client-login", language=None)
 
 def render_reports_page():
     """
@@ -18,6 +116,9 @@ def render_reports_page():
     """
     st.subheader("Generate Reports")
     
+    # Processed DataFrames live in the artifact store; session state only keeps their names
+    session_id = get_session_id(st.session_state)
+    
     # Initialize session state for multiple uploads
     if 'processed_reports' not in st.session_state:
         st.session_state.processed_reports = {}
@@ -55,68 +156,27 @@ def render_reports_page():
         # Process multiple files
         for file_idx, uploaded_file in enumerate(uploaded_data_files):
             try:
-                # Read the uploaded CSV file
-                uploaded_df = pd.read_csv(uploaded_file)
-                
-                # Check if required columns are present
-                required_columns = ['Category', 'Allergen', 'IgG', 'Sample ID', 'Name', 'Gender', 'Date of Birth', 'Practitioner', 'Date of Receipt', 'Report Date']
-                missing_columns = [col for col in required_columns if col not in uploaded_df.columns]
-                
-                if missing_columns:
-                    st.error(f"File '{uploaded_file.name}' is missing required columns: {', '.join(missing_columns)}")
+                # Read and convert the uploaded CSV file chunk by chunk
+                try:
+                    extracted_client_info, processed_df = ingest_lab_export(uploaded_file, file_idx)
+                except MissingColumnsError as e:
+                    st.error(f"File '{uploaded_file.name}' is missing required columns: {', '.join(e.columns)}")
                     continue
-                
-                # Extract client information from the first row
-                first_row = uploaded_df.iloc[0]
-                patient_name = str(first_row['Name']) if pd.notna(first_row['Name']) else f"Patient_{file_idx+1}"
-                patient_id = str(first_row['Sample ID']) if pd.notna(first_row['Sample ID']) else f"ID_{file_idx+1}"
-                
-                # Extract the actual date of birth from the CSV data
-                actual_dob = str(first_row['Date of Birth']) if pd.notna(first_row['Date of Birth']) else ''
-                
-                extracted_client_info = {
-                    'patient_id': patient_id,
-                    'name': patient_name,
-                    'gender': str(first_row['Gender']) if pd.notna(first_row['Gender']) else '',
-                    'dob': actual_dob,  # Use the actual DOB from CSV
-                    'practitioner': str(first_row['Practitioner']) if pd.notna(first_row['Practitioner']) else '',
-                    'collection_date': str(first_row['Date of Receipt']) if pd.notna(first_row['Date of Receipt']) else '',
-                    'report_date': str(first_row['Report Date']) if pd.notna(first_row['Report Date']) else '',
-                    'specimen': 'Dry Blood',
-                    'email': ''
-                }
-                
-                # Convert the uploaded data to the format expected by the report generator
-                processed_data = []
-                for idx, row in uploaded_df.iterrows():
-                    # Convert IgG values - handle "Unelevated" and numeric values
-                    igg_value = row['IgG']
-                    if pd.isna(igg_value) or str(igg_value).lower() == 'unelevated':
-                        igg_numeric = 0.0
-                    else:
-                        try:
-                            igg_numeric = float(igg_value)
-                        except:
-                            igg_numeric = 0.0
-                    
-                    processed_data.append({
-                        'Row': idx + 1,
-                        'Column': 1,
-                        'Allergen': str(row['Allergen']) if pd.notna(row['Allergen']) else '',
-                        'Latin Name': '',
-                        'Category': str(row['Category']) if pd.notna(row['Category']) else '',
-                        'IgG (µg/ml)': igg_numeric
-                    })
-                
-                # Create processed dataframe
-                processed_df = pd.DataFrame(processed_data)
+                patient_name = extracted_client_info['name']
+                patient_id = extracted_client_info['patient_id']
                 
                 # Store processed data with unique identifier
                 file_key = f"{patient_name}_{patient_id}_{file_idx}"
+                artifact_store.put(session_id, file_key, processed_df)
                 st.session_state.processed_reports[file_key] = {
                     'client_info': extracted_client_info,
-                    'data': processed_df,
-                    'filename': uploaded_file.name
+                    'data_key': file_key,
+                    'filename': uploaded_file.name,
+                    'summary': {
+                        'total': len(processed_df),
+                        'elevated': int((processed_df['IgG (µg/ml)'] > 0).sum()),
+                        'categories': int(processed_df['Category'].nunique())
+                    }
                 }
                 
             except Exception as e:
@@ -131,118 +191,78 @@ def render_reports_page():
             st.subheader("Processed Files Summary")
             for file_key, report_data in st.session_state.processed_reports.items():
                 client_info = report_data['client_info']
-                data_df = report_data['data']
-                elevated_count = len(data_df[data_df['IgG (µg/ml)'] > 0])
+                summary = report_data['summary']
                 
                 with st.expander(f"📄 {client_info['name']} (ID: {client_info['patient_id']})"):
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Total Allergens", len(data_df))
+                        st.metric("Total Allergens", summary['total'])
                     with col2:
-                        st.metric("Elevated Allergens", elevated_count)
+                        st.metric("Elevated Allergens", summary['elevated'])
                     with col3:
-                        st.metric("Categories", len(data_df['Category'].unique()))
+                        st.metric("Categories", summary['categories'])
             
             st.markdown("---")
             
             # Batch operations
+            worker_count = st.number_input("PDF generation workers", min_value=1, max_value=REPORT_WORKERS, value=REPORT_WORKERS,
+                                           help="Number of CPU cores used to render PDF reports in parallel")
             col1, col2, col3 = st.columns(3)
             
             with col1:
                 if st.button("🔄 Generate All PDF Reports", use_container_width=True):
-                    with st.spinner("Generating all PDF reports..."):
-                        success_count = 0
-                        for file_key, report_data in st.session_state.processed_reports.items():
-                            try:
-                                pdf_data, _, _ = fixed_report_layout.create_report(
-                                    report_data['data'],
-                                    report_data['client_info'],
-                                    output_format='both'
-                                )
-                                if pdf_data:
-                                    # Save to database with client credentials
-                                    from db import db_manager
-                                    credentials = db_manager.save_client_report(
-                                        report_data['client_info'],
-                                        pdf_data,
-                                        report_data['data']
-                                    )
-                                    
-                                    if credentials:
-                                        st.session_state.generated_pdfs[file_key] = {
-                                            'pdf_data': pdf_data,
-                                            'filename': f"{report_data['client_info']['patient_id']}_{report_data['client_info']['name']}.pdf",
-                                            'credentials': credentials
-                                        }
-                                        success_count += 1
-                            except Exception as e:
-                                st.error(f"Failed to generate report for {report_data['client_info']['name']}: {str(e)}")
-                        
-                        if success_count > 0:
-                            st.success(f"✅ Generated {success_count} PDF reports successfully!")
-                            
-                            # Display client credentials
-                            st.subheader("🔑 Client Access Credentials")
-                            st.markdown("Share these credentials with your clients to access their reports:")
-                            
-                            for file_key, pdf_data in st.session_state.generated_pdfs.items():
-                                if 'credentials' in pdf_data:
-                                    cred = pdf_data['credentials']
-                                    with st.expander(f"📄 {cred['patient_name']} (ID: {cred['patient_id']})"):
-                                        col1, col2 = st.columns(2)
-                                        with col1:
-                                            st.code(f"Username: {cred['username']}\nPassword: {cred['password']}", language=None)
-                                        with col2:
-                                            st.markdown("**Portal URL:**")
-                                            st.code("https://portal.pinnertest.com/client-login", language=None)
-                            
-                            st.rerun()
+                    items = []
+                    for file_key, report_data in st.session_state.processed_reports.items():
+                        data_df = artifact_store.get(session_id, report_data['data_key'])
+                        if data_df is None:
+                            st.error(f"Processed data for {report_data['client_info']['name']} has expired. Please upload the file again.")
+                            continue
+                        items.append((file_key, report_data['client_info'], data_df))
+                    
+                    # Queue the batch; a background worker renders the PDFs and saves the reports
+                    if items:
+                        st.session_state.report_job_id = submit_job(
+                            db_manager.engine, 'lab_reports', items, options={'max_workers': worker_count}
+                        )
+                        st.session_state.pop('collected_report_job_id', None)
+                        st.rerun()
             
             with col2:
-                # Download all processed data as CSV files in a zip
-                if st.button("📥 Download All Data (ZIP)", use_container_width=True):
-                    # Create zip file with all CSV data
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for file_key, report_data in st.session_state.processed_reports.items():
-                            csv_data = report_data['data'].to_csv(index=False)
-                            filename = f"{report_data['client_info']['patient_id']}_{report_data['client_info']['name']}_data.csv"
-                            zip_file.writestr(filename, csv_data)
-                    
-                    zip_buffer.seek(0)
-                    st.download_button(
-                        label="⬇️ Download CSV ZIP",
-                        data=zip_buffer.getvalue(),
-                        file_name=f"allergen_data_batch_{datetime.now().strftime('%Y%m%d')}.zip",
-                        mime="application/zip",
-                        use_container_width=True
-                    )
+                # Download all processed data as CSV files in a zip, built only when clicked
+                st.download_button(
+                    label="📥 Download All Data (ZIP)",
+                    data=partial(build_data_zip, session_id, list(st.session_state.processed_reports.values())),
+                    file_name=f"allergen_data_batch_{datetime.now().strftime('%Y%m%d')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
             
             with col3:
                 # Download all PDF reports in a zip (only if PDFs are generated)
                 if st.session_state.generated_pdfs:
-                    if st.button("📄 Download All PDFs (ZIP)", use_container_width=True):
-                        # Create zip file with all PDF reports
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            for file_key, pdf_data in st.session_state.generated_pdfs.items():
-                                zip_file.writestr(pdf_data['filename'], pdf_data['pdf_data'])
-                        
-                        zip_buffer.seek(0)
-                        st.download_button(
-                            label="⬇️ Download PDF ZIP",
-                            data=zip_buffer.getvalue(),
-                            file_name=f"reports_batch_{datetime.now().strftime('%Y%m%d')}.zip",
-                            mime="application/zip",
-                            use_container_width=True
-                        )
+                    # Saved PDFs are streamed from the database into the zip when clicked
+                    st.download_button(
+                        label="📄 Download All PDFs (ZIP)",
+                        data=partial(build_pdf_zip, list(st.session_state.generated_pdfs.values())),
+                        file_name=f"reports_batch_{datetime.now().strftime('%Y%m%d')}.zip",
+                        mime="application/zip",
+                        use_container_width=True
+                    )
                 else:
                     st.markdown('<div style="color: #666666; font-size: 0.85em; padding: 8px; text-align: center; font-style: italic;">Generate PDFs first</div>', unsafe_allow_html=True)
             
             # Clear all processed data button
             st.markdown("---")
             if st.button("🗑️ Clear All Data", type="secondary"):
+                artifact_store.clear_session(session_id)
                 st.session_state.processed_reports = {}
                 st.session_state.generated_pdfs = {}
+                st.session_state.pop('report_job_id', None)
                 st.success("All data cleared!")
                 st.rerun()
+    
+    # Progress and results of the background generation job; jobs keep running
+    # when the tab is closed and can be reopened from the recent jobs list
+    if st.session_state.get('report_job_id'):
+        render_report_job(st.session_state.report_job_id)
+    render_recent_jobs('lab_reports', 'report_job_id')
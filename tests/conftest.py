@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from benchmarks.synthetic import SyntheticData
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'test.db')
+
+@pytest.fixture
+def manager(db_path):
+    """A DatabaseManager connected to a fresh, migrated SQLite database"""
+    manager = db.DatabaseManager()
+    assert manager.connect(f"sqlite:///{db_path}")
+    yield manager
+    db.dispose_engines()
+
+@pytest.fixture
+def synthetic():
+    return SyntheticData(seed=7, panel_size=10, pdf_size=1024)
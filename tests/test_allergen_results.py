@@ -0,0 +1,49 @@
+import pandas as pd
+from sqlalchemy import select, update
+
+import db
+
+def _lab_report(allergens):
+    """A report in the lab export format: Category and IgG (µg/ml), no Classification"""
+    allergen_data = pd.DataFrame({
+        'Allergen': [name for name, _ in allergens],
+        'Category': ['Grains'] * len(allergens),
+        'IgG (µg/ml)': [level for _, level in allergens],
+    })
+    client_info = {'patient_id': 'S1', 'name': 'Ann Lee', 'practitioner': 'Dr. A'}
+    return client_info, b'%PDF-1.4 test', allergen_data
+
+def test_lab_export_results_are_classified_by_igg(manager):
+    saved = manager.save_client_report(*_lab_report([('Wheat', 12.5), ('Rice', 1.6), ('Oat', 0.2)]))
+    
+    high = manager.find_reports_by_allergen('Wheat', classification='High')
+    assert [report['id'] for report in high] == [saved['report_id']]
+    assert manager.find_reports_by_allergen('Rice', classification='Moderate')
+    assert manager.find_reports_by_allergen('Oat', classification='Low')
+
+def test_migration_classifies_existing_unclassified_results(manager):
+    manager.save_client_report(*_lab_report([('Wheat', 12.5)]))
+    results = db.AllergenResult.__table__
+    with manager.engine.begin() as conn:
+        # Rows written before the classification fallback existed
+        conn.execute(update(results).values(classification=None))
+        db._migration_allergen_classifications(conn)
+    
+    with manager.engine.connect() as conn:
+        assert conn.execute(select(results.c.classification)).scalars().all() == ['High']
+        assert conn.execute(select(db.AllergenSummary.__table__.c.high)).scalars().all() == [1]
+
+def test_migration_backfills_results_of_existing_reports(manager):
+    manager.save_client_report(*_lab_report([('Wheat', 12.5), ('Rice', 1.6)]))
+    summaries = db.AllergenSummary.__table__
+    with manager.engine.begin() as conn:
+        # A database migrated to version 8 before any results were written
+        conn.execute(db.AllergenResult.__table__.delete())
+        db._rebuild_report_summaries(conn)
+        assert conn.execute(select(summaries)).all() == []
+        
+        db._migration_backfill_allergen_results(conn)
+    
+    with manager.engine.connect() as conn:
+        counts = conn.execute(select(summaries.c.allergen, summaries.c.high, summaries.c.moderate).order_by(summaries.c.allergen)).all()
+    assert [tuple(row) for row in counts] == [('Rice', 0, 1), ('Wheat', 1, 0)]
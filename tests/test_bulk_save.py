@@ -0,0 +1,23 @@
+import sqlite3
+
+def _count_reports(db_path):
+    """Count client reports through a separate connection (sees committed rows only)"""
+    other = sqlite3.connect(db_path)
+    try:
+        return other.execute("SELECT COUNT(*) FROM client_reports").fetchone()[0]
+    finally:
+        other.close()
+
+def test_bulk_save_commits_all_chunks_together(manager, db_path, synthetic):
+    visible = []
+    
+    def on_insert(conn, inserted):
+        # Runs inside every chunk's savepoint; earlier chunks must not be committed yet
+        visible.append(_count_reports(db_path))
+    
+    records = [synthetic.report() for _ in range(6)]
+    result = manager.save_client_reports_bulk(records, chunk_size=2, on_insert=on_insert)
+    
+    assert len(result['saved']) == 6
+    assert visible == [0, 0, 0]
+    assert _count_reports(db_path) == 6
@@ -0,0 +1,39 @@
+import sqlite3
+
+from client_report_cache import get_cached_client_report
+
+def _update_elsewhere(db_path, statement):
+    """Change client_reports through a separate connection, like another process would"""
+    other = sqlite3.connect(db_path)
+    try:
+        with other:
+            other.execute(statement)
+    finally:
+        other.close()
+
+def test_changes_from_other_processes_are_seen_on_next_rerun(manager, db_path, synthetic):
+    record = synthetic.report()
+    saved = manager.save_client_report(record['client_info'], record['pdf_data'], record['allergen_data'])
+    report_id = saved['report_id']
+    session_state = {}
+    
+    report = get_cached_client_report(session_state, manager, report_id)
+    assert get_cached_client_report(session_state, manager, report_id) is report
+    
+    _update_elsewhere(db_path, f"UPDATE client_reports SET patient_name = 'Renamed' WHERE id = {report_id}")
+    report = get_cached_client_report(session_state, manager, report_id)
+    assert report['patient_name'] == 'Renamed'
+    assert report['row_version'] == 2
+    
+    _update_elsewhere(db_path, f"UPDATE client_reports SET is_active = 0 WHERE id = {report_id}")
+    assert get_cached_client_report(session_state, manager, report_id) is None
+    assert session_state == {}
+
+def test_set_report_active_bumps_row_version_once(manager, synthetic):
+    record = synthetic.report()
+    report_id = manager.save_client_report(record['client_info'], record['pdf_data'], record['allergen_data'])['report_id']
+    
+    assert manager.set_report_active(report_id, False)
+    assert manager.set_report_active(report_id, True)
+    assert manager.get_report_version(report_id) == 3
+    assert not manager.set_report_active(report_id + 1000, False)
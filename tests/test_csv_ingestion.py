@@ -0,0 +1,90 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from csv_ingestion import build_admin_records, ingest_lab_export
+
+
+def legacy_admin_records(df):
+    """Row loop that build_admin_records replaced"""
+    records = []
+    for idx, row in df.iterrows():
+        allergen_data = []
+        for col in df.columns:
+            if col not in ['Name', 'Date of Birth', 'Gender', 'Email', 'Collection Date', 'Practitioner']:
+                try:
+                    value = float(row[col]) if pd.notna(row[col]) else 0.0
+                    if value >= 2.5:
+                        classification = "High"
+                    elif value >= 1.5:
+                        classification = "Moderate"
+                    else:
+                        classification = "Low"
+                    allergen_data.append({'Allergen': col, 'IgG_Level': value, 'Classification': classification})
+                except:
+                    continue
+        records.append({'patient_id': f"P{idx + 1:04d}", 'allergen_data': pd.DataFrame(allergen_data)})
+    return records
+
+
+def legacy_lab_rows(uploaded_df):
+    """Row loop that ingest_lab_export replaced"""
+    processed_data = []
+    for idx, row in uploaded_df.iterrows():
+        igg_value = row['IgG']
+        if pd.isna(igg_value) or str(igg_value).lower() == 'unelevated':
+            igg_numeric = 0.0
+        else:
+            try:
+                igg_numeric = float(igg_value)
+            except:
+                igg_numeric = 0.0
+        processed_data.append({
+            'Row': idx + 1,
+            'Column': 1,
+            'Allergen': str(row['Allergen']) if pd.notna(row['Allergen']) else '',
+            'Latin Name': '',
+            'Category': str(row['Category']) if pd.notna(row['Category']) else '',
+            'IgG (µg/ml)': igg_numeric
+        })
+    return pd.DataFrame(processed_data)
+
+
+def test_admin_records_match_row_loop():
+    df = pd.DataFrame({
+        'Name': ['Ann', 'Bob', 'Cy', 'Di'],
+        'Email': ['a@x', 'b@x', 'c@x', 'd@x'],
+        'Wheat': [True, np.nan, False, True],
+        'Milk': ['3.1', 'abc', ' inf ', '1_000'],
+        'Egg': [1, 2, 3, 4],
+        'Soy': [np.nan, np.nan, np.nan, np.nan],
+        'Rice': ['1.7', 2.6, True, None],
+    })
+    assert df['Wheat'].dtype == object
+    
+    records = build_admin_records(df)
+    expected = legacy_admin_records(df)
+    assert len(records) == len(expected)
+    for record, legacy in zip(records, expected):
+        assert record['client_info']['patient_id'] == legacy['patient_id']
+        pdt.assert_frame_equal(record['allergen_data'], legacy['allergen_data'], check_dtype=False)
+
+
+def test_lab_export_matches_row_loop():
+    csv = (
+        "Category,Allergen,IgG,Sample ID,Name,Gender,Date of Birth,Practitioner,Date of Receipt,Report Date\n"
+        "Grains,Wheat,12.5,S1,Ann,F,1990-01-01,Dr. A,2025-01-01,2025-01-02\n"
+        "Grains,Rice,Unelevated,,,,,,,\n"
+        "Dairy,Milk,UNELEVATED,,,,,,,\n"
+        ",Egg,,,,,,,,\n"
+        "Dairy,,abc,,,,,,,\n"
+        "Nuts,Peanut, inf ,,,,,,,\n"
+        "Nuts,Almond,1_000,,,,,,,\n"
+    )
+    client_info, processed = ingest_lab_export(io.StringIO(csv), chunk_size=3)
+    
+    assert client_info['name'] == 'Ann'
+    expected = legacy_lab_rows(pd.read_csv(io.StringIO(csv)))
+    pdt.assert_frame_equal(processed, expected, check_dtype=False)
@@ -0,0 +1,26 @@
+import threading
+
+from login_throttle import DatabaseThrottleStore, LoginThrottle
+
+def test_database_store_serializes_concurrent_checks(manager):
+    # Only the global bucket applies: 20 tokens and no refill
+    throttle = LoginThrottle(store=DatabaseThrottleStore(manager), max_attempts=5,
+                             address_bucket=(0.0, 0.0), global_bucket=(20.0, 0.0))
+    allowed = []
+    errors = []
+    
+    def attempt_logins(worker):
+        for attempt in range(10):
+            try:
+                allowed.append(throttle.check(f"user{worker}", f"10.0.0.{worker}")[0])
+            except Exception as e:
+                errors.append(e)
+    
+    threads = [threading.Thread(target=attempt_logins, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert errors == []
+    assert sum(allowed) == 20
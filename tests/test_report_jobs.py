@@ -0,0 +1,74 @@
+from sqlalchemy import event, func, select, update
+
+import db
+import report_jobs
+from report_jobs import JobWorker, get_job, get_job_items, submit_job
+
+def _count(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+def _submit(manager, synthetic, count):
+    items = []
+    for position in range(count):
+        record = synthetic.report()
+        items.append((f"item{position}", record['client_info'], record['allergen_data']))
+    return submit_job(manager.engine, 'admin_reports', items)
+
+def test_item_taken_over_mid_batch_rolls_back_only_its_report(manager, synthetic, monkeypatch):
+    job_id = _submit(manager, synthetic, 4)
+    job_items = db.ReportJobItem.__table__
+    
+    def render_while_another_worker_finishes_item2(items, max_workers):
+        # Another worker saves item2 after this batch was read but before it is saved
+        with manager.engine.begin() as conn:
+            conn.execute(update(job_items).where(job_items.c.item_key == 'item2').values(status='done'))
+        for key, item in items.items():
+            yield key, b'%PDF-1.4 test', None
+    
+    monkeypatch.setitem(report_jobs.JOB_RENDERERS, 'admin_reports', render_while_another_worker_finishes_item2)
+    worker = JobWorker(manager, batch_size=10)
+    assert worker.run_job(worker.claim_job()) == 'completed'
+    
+    items = {item['item_key']: item for item in get_job_items(manager.engine, job_id)}
+    assert items['item2']['credentials'] is None
+    saved = {items[key]['credentials']['report_id'] for key in ('item0', 'item1', 'item3')}
+    assert len(saved) == 3
+    
+    # The duplicate report of item2 and everything written with it were rolled back
+    assert _count(manager.engine, db.ClientReport.__table__) == 3
+    with manager.engine.connect() as conn:
+        result_reports = set(conn.execute(select(db.AllergenResult.__table__.c.report_id).distinct()).scalars())
+        summary_reports = conn.execute(select(func.sum(db.ReportSummary.__table__.c.reports))).scalar()
+    assert result_reports == saved
+    assert summary_reports == 3
+    assert get_job(manager.engine, job_id)['done_items'] == 4
+
+def test_failure_after_batch_insert_saves_nothing(manager, synthetic, monkeypatch):
+    job_id = _submit(manager, synthetic, 3)
+    update_report_summaries = db._update_report_summaries
+    armed = []
+    
+    def arm_after_insert(conn, reports):
+        update_report_summaries(conn, reports)
+        armed.append(True)
+    
+    @event.listens_for(manager.engine, 'commit')
+    def fail_commit_of_batch(conn):
+        # The savepoints of the batch were released; the transaction still has to commit
+        if armed:
+            armed.clear()
+            raise RuntimeError("disk I/O error")
+    
+    monkeypatch.setattr(db, '_update_report_summaries', arm_after_insert)
+    worker = JobWorker(manager, batch_size=10)
+    try:
+        assert worker.run_job(worker.claim_job()) == 'completed'
+    finally:
+        event.remove(manager.engine, 'commit', fail_commit_of_batch)
+    
+    job = get_job(manager.engine, job_id)
+    assert (job['done_items'], job['failed_items']) == (0, 3)
+    assert all(item['credentials'] is None for item in get_job_items(manager.engine, job_id))
+    assert _count(manager.engine, db.ClientReport.__table__) == 0
+    assert _count(manager.engine, db.AllergenResult.__table__) == 0
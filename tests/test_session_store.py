@@ -0,0 +1,29 @@
+import os
+import time
+
+from session_store import SessionArtifactStore
+
+
+def test_live_session_of_another_process_is_not_expired(tmp_path):
+    root = str(tmp_path / 'artifacts')
+    # Two processes sharing one store root; a tiny budget forces a spill to disk
+    owner = SessionArtifactStore(root=root, memory_budget=1, ttl=60)
+    other = SessionArtifactStore(root=root, memory_budget=1, ttl=60)
+    owner.put('live', 'a', b'x' * 10)
+    owner.put('live', 'b', b'y' * 10)
+    session_dir = os.path.join(root, 'live')
+    assert os.listdir(session_dir)
+
+    # Backdate the directory, then use the session again in its owner
+    stale = time.time() - 120
+    os.utime(session_dir, (stale, stale))
+    assert owner.get('live', 'a') == b'x' * 10
+
+    other.get('unrelated', 'missing')
+    assert os.path.isdir(session_dir)
+
+    # Once the owner stops using it, the leftover is purged by the other process
+    os.utime(session_dir, (stale, stale))
+    other._last_expiry_check = 0
+    other.get('unrelated', 'missing')
+    assert not os.path.isdir(session_dir)
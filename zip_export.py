@@ -0,0 +1,55 @@
+"""
+Disk-spooled ZIP archives for bulk report downloads
+"""
+import os
+import time
+import tempfile
+import zipfile
+
+# Archives larger than this are spooled to a temporary file on disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Members with these extensions are already compressed and are stored as-is
+STORED_EXTENSIONS = ('.pdf', '.zip', '.gz', '.png', '.jpg', '.jpeg')
+
+def build_zip(members, spool_max_size=SPOOL_MAX_SIZE):
+    """
+    Write a ZIP archive into a spooled temporary file
+    
+    Members are written one at a time, and chunked content is copied chunk
+    by chunk, so only one chunk of one member is held in memory at a time.
+    Already-compressed files such as PDFs are stored without deflating.
+    
+    Parameters:
+    -----------
+    members : iterable
+        (arcname, content) pairs; content is bytes, str, or an iterable of
+        bytes chunks (e.g. DatabaseManager.iter_report_pdf)
+    spool_max_size : int
+        Size in bytes above which the archive is moved to disk
+    
+    Returns:
+    --------
+    tempfile.SpooledTemporaryFile
+        Binary file positioned at the start of the archive
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size, mode='w+b')
+    
+    with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for arcname, content in members:
+            stored = os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+            compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            if isinstance(content, (bytes, bytearray, memoryview)):
+                content = [bytes(content)]
+            
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            info.compress_type = compress_type
+            with zip_file.open(info, 'w', force_zip64=True) as member:
+                for chunk in content:
+                    member.write(chunk)
+    
+    spool.seek(0)
+    return spool